@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный симулятор парка сенсоров глюкозы.
+
+Моделирует тысячи виртуальных сенсоров в одном процессе (asyncio + aiohttp)
+и использует те же подпись и шифрование, что и secure_glucose_generator.py.
+Сенсоры отправляют данные на endpoints single, batch и enhanced-batch,
+синхронизируются через sync, имеют собственный сдвиг часов и могут
+одновременно уходить в офлайн с последующим массовым переподключением.
+
+Список сенсоров читается из JSON-файла [{"serial_number", "secret_key"}, ...],
+который создаёт команда create_fleet_sensors сервиса glucose-monitor-service.
+
+Пример:
+    python glucose_fleet_simulator.py --fleet fleet.json --sensors 2000 \\
+        --duration 300 --interval 10 --storm-at 120 --storm-fraction 0.5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from secure_glucose_generator import (
+    PAYLOAD_BINARY_V1, PAYLOAD_JSON, derive_session_key, encrypt_measurements, sign_payload, sign_request_v2,
+    sign_session_request
+)
+
+logger = logging.getLogger('glucose_fleet_simulator')
+
+ENDPOINTS = ('single', 'batch', 'enhanced-batch')
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга (значения отсортированы)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class FleetStats:
+    """Сбор задержек, статусов и ошибок по endpoint'ам"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.errors: Counter = Counter()
+        self.measurements_sent = 0
+
+    def record(self, endpoint: str, latency: float, status: int, error: Optional[str] = None):
+        self.latencies[endpoint].append(latency)
+        self.statuses[endpoint][status] += 1
+        if error:
+            self.errors[f"{endpoint}: {error}"] += 1
+
+    def summary(self) -> Dict:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        endpoints = {}
+        total = 0
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            total += len(values)
+            ok = sum(count for status, count in self.statuses[endpoint].items() if 200 <= status < 300)
+            endpoints[endpoint] = {
+                'requests': len(values),
+                'success': ok,
+                'rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p95_ms': round(percentile(values, 95) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+                'max_ms': round(values[-1] * 1000, 1) if values else 0.0,
+                'statuses': {str(status): count for status, count in sorted(self.statuses[endpoint].items())},
+            }
+        return {
+            'elapsed_seconds': round(elapsed, 1),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 1) if elapsed else 0.0,
+            'measurements_sent': self.measurements_sent,
+            'measurements_per_second': round(self.measurements_sent / elapsed, 1) if elapsed else 0.0,
+            'endpoints': endpoints,
+            'errors': dict(self.errors.most_common()),
+        }
+
+    def print_report(self):
+        summary = self.summary()
+        print("\n" + "=" * 78)
+        print(f"  Длительность: {summary['elapsed_seconds']} c, запросов: {summary['requests']}, "
+              f"{summary['throughput_rps']} req/s, измерений: {summary['measurements_per_second']}/s")
+        print("=" * 78)
+        print(f"{'endpoint':<16}{'req':>8}{'ok':>8}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+        for endpoint, row in summary['endpoints'].items():
+            print(f"{endpoint:<16}{row['requests']:>8}{row['success']:>8}{row['rps']:>8}"
+                  f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['max_ms']:>9}")
+        if summary['errors']:
+            print("\nОшибки:")
+            for error, count in summary['errors'].items():
+                print(f"  {count:>8}  {error}")
+
+
+def classify_error(status: int, body: str) -> Optional[str]:
+    """Категория ошибки для сводки (без уникальных деталей ответа)"""
+    if 200 <= status < 300:
+        return None
+    text = body.lower()
+    if status == 401:
+        for marker in ('session_expired', 'timestamp', 'nonce already used', 'nonce', 'counter', 'signature',
+                       'invalid sensor'):
+            if marker in text:
+                return f"401 {marker}"
+        return "401 unauthorized"
+    if status == 503:
+        return "503 busy"
+    return f"{status}"
+
+
+class VirtualSensor:
+    """
+    Виртуальный сенсор: состояние nonce, часы со сдвигом и накопленные
+    в офлайне измерения. Состояние хранится только в памяти.
+    """
+
+    def __init__(self, serial_number: str, secret_key: str, clock_skew: float = 0.0):
+        self.serial_number = serial_number
+        self.secret_key = secret_key
+        self.clock_skew = clock_skew
+        self.clock_correction = 0
+        self.nonce_window_start = 1000
+        self.nonce_window_size = 1000
+        self.current_nonce = 1000
+        self.glucose = random.uniform(4.5, 8.0)
+        self.pending: List[Dict] = []
+        self.offline_until = 0.0
+        self.session_token: Optional[str] = None
+        self.session_key: Optional[bytes] = None
+        self.session_expires_at = 0
+        self.session_counter = 0
+
+    def session_active(self) -> bool:
+        return self.session_token is not None and self.session_expires_at - 30 > time.time()
+
+    def device_time(self) -> int:
+        """Время по часам устройства с учётом поправки, полученной при синхронизации"""
+        return int(time.time() + self.clock_skew) - self.clock_correction
+
+    def next_nonce(self) -> int:
+        if self.current_nonce >= self.nonce_window_start + self.nonce_window_size:
+            self.nonce_window_start += self.nonce_window_size
+        self.current_nonce += 1
+        return self.current_nonce
+
+    def measure(self) -> Dict:
+        """Случайное блуждание значения глюкозы в физиологических пределах"""
+        self.glucose = min(max(self.glucose + random.gauss(0, 0.3), 2.5), 20.0)
+        return {'value': round(self.glucose, 1), 'timestamp': self.device_time()}
+
+
+class FleetSimulator:
+    def __init__(self, base_url: str, sensors: List[VirtualSensor], args):
+        self.base_url = base_url.rstrip('/')
+        self.base_path = urlparse(self.base_url).path.rstrip('/')
+        self.sensors = sensors
+        self.args = args
+        self.stats = FleetStats()
+        self.mix = self._parse_mix(args.mix)
+        self.deadline = 0.0
+
+    @staticmethod
+    def _parse_mix(mix: str) -> Dict[str, float]:
+        weights = {}
+        for part in mix.split(','):
+            name, _, weight = part.partition('=')
+            if name not in ENDPOINTS:
+                raise ValueError(f"Unknown endpoint in mix: {name}")
+            weights[name] = float(weight or 1)
+        return weights
+
+    async def request(self, session, sensor: VirtualSensor, endpoint: str, body: Dict, measurements: int = 0):
+        """Подписанный POST на endpoint сенсора с записью задержки и результата"""
+        path = f"{self.base_path}/sensor/{sensor.serial_number}/{endpoint}/"
+        if endpoint != 'sync' and sensor.session_active():
+            sensor.session_counter += 1
+            body.pop('nonce')
+            timestamp = body.pop('timestamp')
+            data = json.dumps(body).encode('utf-8')
+            headers = {
+                'Content-Type': 'application/json',
+                'X-Sensor-Session': sensor.session_token,
+                'X-Sensor-Counter': str(sensor.session_counter),
+                'X-Sensor-Timestamp': str(timestamp),
+                'X-Sensor-Signature': sign_session_request(
+                    sensor.session_key, 'POST', path, sensor.session_counter, timestamp, data
+                ),
+            }
+        elif self.args.signature_version == 2:
+            nonce, timestamp = body.pop('nonce'), body.pop('timestamp')
+            data = json.dumps(body).encode('utf-8')
+            headers = {
+                'Content-Type': 'application/json',
+                'X-Sensor-Signature': sign_request_v2(sensor.secret_key, 'POST', path, nonce, timestamp, data),
+                'X-Sensor-Nonce': str(nonce),
+                'X-Sensor-Timestamp': str(timestamp),
+            }
+        else:
+            body['signature'] = sign_payload(sensor.secret_key, {
+                'path': path,
+                'nonce': body['nonce'],
+                'timestamp': body['timestamp'],
+                'body': {key: value for key, value in body.items() if key != 'signature'},
+            })
+            data = json.dumps(body).encode('utf-8')
+            headers = {'Content-Type': 'application/json'}
+
+        started = time.perf_counter()
+        try:
+            async with session.post(f"{self.base_url}/sensor/{sensor.serial_number}/{endpoint}/",
+                                    data=data, headers=headers) as response:
+                text = await response.text()
+                status = response.status
+        except asyncio.TimeoutError:
+            self.stats.record(endpoint, time.perf_counter() - started, 0, "timeout")
+            return 0, None
+        except aiohttp.ClientError as e:
+            self.stats.record(endpoint, time.perf_counter() - started, 0, type(e).__name__)
+            return 0, None
+
+        if status == 401 and 'session_expired' in text:
+            # Следующий запрос пойдёт через полную аутентификацию
+            sensor.session_token = None
+        self.stats.record(endpoint, time.perf_counter() - started, status, classify_error(status, text))
+        if 200 <= status < 300:
+            self.stats.measurements_sent += measurements
+        try:
+            return status, json.loads(text)
+        except ValueError:
+            return status, None
+
+    async def sync(self, session, sensor: VirtualSensor) -> bool:
+        next_window = sensor.nonce_window_start + sensor.nonce_window_size
+        now = int(time.time())
+        status, result = await self.request(session, sensor, 'sync', {
+            'nonce': next_window + 1,
+            'timestamp': now,
+            'device_timestamp': int(time.time() + sensor.clock_skew),
+            'request_new_window': True,
+            **({'request_session': True} if self.args.session else {}),
+        })
+        if status != 200 or not result:
+            return False
+
+        window = result.get('nonce_window', {})
+        sensor.nonce_window_start = window.get('start', sensor.nonce_window_start)
+        sensor.nonce_window_size = window.get('size', sensor.nonce_window_size)
+        sensor.current_nonce = sensor.nonce_window_start
+        if 'session' in result:
+            sensor.session_token = result['session']['token']
+            sensor.session_expires_at = result['session']['expires_at']
+            sensor.session_key = derive_session_key(sensor.secret_key, sensor.session_token)
+            sensor.session_counter = 0
+        if self.args.correct_skew:
+            sensor.clock_correction = result.get('sync_info', {}).get('offset_seconds', 0)
+        return True
+
+    async def send(self, session, sensor: VirtualSensor, endpoint: str, measurements: List[Dict]) -> bool:
+        if endpoint == 'single':
+            measurement = measurements[0]
+            nonce = sensor.next_nonce()
+            status, _ = await self.request(session, sensor, 'single', {
+                'value': measurement['value'],
+                'sequence_id': nonce,
+                'timestamp': measurement['timestamp'],
+                'nonce': nonce,
+            }, measurements=1)
+            return 200 <= status < 300
+
+        if endpoint == 'enhanced-batch':
+            part_size = self.args.part_size
+            parts = [measurements[i:i + part_size] for i in range(0, len(measurements), part_size)]
+            batch_id = f"{sensor.serial_number}-{sensor.current_nonce}"
+        else:
+            parts = [measurements]
+            batch_id = None
+
+        for index, part in enumerate(parts):
+            nonce = sensor.next_nonce()
+            body = {
+                'nonce': nonce,
+                'timestamp': sensor.device_time(),
+                'encrypted_data': encrypt_measurements(sensor.secret_key, part, self.args.payload_format),
+                'is_final': index == len(parts) - 1,
+            }
+            if self.args.payload_format != PAYLOAD_JSON:
+                body['payload_format'] = self.args.payload_format
+            if batch_id:
+                body['batch_id'] = batch_id
+                body['part_number'] = index
+            status, result = await self.request(session, sensor, endpoint, body, measurements=len(part))
+            if status == 401 and result and 'nonce' in str(result.get('error', '')).lower():
+                await self.sync(session, sensor)
+                return False
+            if not 200 <= status < 300:
+                return False
+        return True
+
+    def pick_endpoint(self, pending: int) -> str:
+        if pending > 1:
+            batch_mix = {name: weight for name, weight in self.mix.items() if name != 'single'}
+            if batch_mix:
+                return random.choices(list(batch_mix), weights=list(batch_mix.values()))[0]
+        return random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+    async def run_sensor(self, session, sensor: VirtualSensor):
+        # Разносим старт сенсоров по первому интервалу
+        await asyncio.sleep(random.uniform(0, self.args.ramp_up or self.args.interval))
+        await self.sync(session, sensor)
+
+        while time.monotonic() < self.deadline:
+            sensor.pending.append(sensor.measure())
+
+            if time.monotonic() >= sensor.offline_until:
+                if sensor.offline_until:
+                    # Возврат после обрыва связи: сначала синхронизация
+                    sensor.offline_until = 0.0
+                    await self.sync(session, sensor)
+                endpoint = self.pick_endpoint(len(sensor.pending))
+                batch = sensor.pending[:1 if endpoint == 'single' else self.args.max_batch]
+                if await self.send(session, sensor, endpoint, batch):
+                    del sensor.pending[:len(batch)]
+
+            interval = self.args.interval
+            await asyncio.sleep(random.uniform(interval * 0.8, interval * 1.2))
+
+    async def reconnect_storm(self):
+        """Одновременный уход части парка в офлайн и массовое переподключение"""
+        await asyncio.sleep(self.args.storm_at)
+        affected = random.sample(self.sensors, int(len(self.sensors) * self.args.storm_fraction))
+        reconnect_at = time.monotonic() + self.args.storm_duration
+        for sensor in affected:
+            sensor.offline_until = reconnect_at
+        logger.info(f"Reconnect storm: {len(affected)} sensors offline for {self.args.storm_duration}s")
+
+    async def run(self):
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+        connector = aiohttp.TCPConnector(limit=self.args.connections)
+        headers = {'User-Agent': 'GlucoseFleetSimulator/1.0'}
+
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector, headers=headers) as session:
+            self.stats = FleetStats()
+            self.deadline = time.monotonic() + self.args.duration
+            tasks = [asyncio.create_task(self.run_sensor(session, sensor)) for sensor in self.sensors]
+            if self.args.storm_at is not None:
+                tasks.append(asyncio.create_task(self.reconnect_storm()))
+            await asyncio.gather(*tasks)
+            self.stats.finished = time.monotonic()
+        return self.stats
+
+
+def load_fleet(path: str, limit: Optional[int], max_skew: float) -> List[VirtualSensor]:
+    with open(path, 'r', encoding='utf-8') as f:
+        fleet = json.load(f)
+    if limit:
+        fleet = fleet[:limit]
+    return [
+        VirtualSensor(item['serial_number'], item['secret_key'], random.uniform(-max_skew, max_skew))
+        for item in fleet
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load generator for glucose-monitor-service sensor endpoints')
+    parser.add_argument('--fleet', required=True, help='JSON file with serial_number/secret_key pairs')
+    parser.add_argument('--api-base-url', default='http://localhost:8006/api/v1')
+    parser.add_argument('--sensors', type=int, default=None, help='Use only the first N sensors of the fleet')
+    parser.add_argument('--duration', type=float, default=60, help='Test duration, seconds')
+    parser.add_argument('--interval', type=float, default=5, help='Measurement interval per sensor, seconds')
+    parser.add_argument('--ramp-up', type=float, default=None, help='Spread sensor start over N seconds')
+    parser.add_argument('--mix', default='single=1,batch=1,enhanced-batch=1',
+                        help='Endpoint weights, e.g. single=3,batch=1')
+    parser.add_argument('--max-batch', type=int, default=500, help='Max measurements per upload')
+    parser.add_argument('--part-size', type=int, default=100, help='Measurements per enhanced-batch part')
+    parser.add_argument('--payload-format', choices=[PAYLOAD_JSON, PAYLOAD_BINARY_V1], default=PAYLOAD_JSON,
+                        help='Batch payload encoding')
+    parser.add_argument('--signature-version', type=int, choices=[1, 2], default=1,
+                        help='1: signed canonical JSON body, 2: signed raw body with X-Sensor-* headers')
+    parser.add_argument('--session', action='store_true',
+                        help='Request a session token on sync and sign data requests with the session key')
+    parser.add_argument('--clock-skew', type=float, default=0, help='Max device clock skew, seconds (+/-)')
+    parser.add_argument('--no-correct-skew', dest='correct_skew', action='store_false',
+                        help='Ignore the offset returned by sync')
+    parser.add_argument('--storm-at', type=float, default=None, help='Start reconnect storm after N seconds')
+    parser.add_argument('--storm-fraction', type=float, default=0.5, help='Share of sensors going offline')
+    parser.add_argument('--storm-duration', type=float, default=30, help='Offline period, seconds')
+    parser.add_argument('--connections', type=int, default=500, help='Max concurrent HTTP connections')
+    parser.add_argument('--timeout', type=float, default=30, help='Request timeout, seconds')
+    parser.add_argument('--json', dest='json_output', help='Write summary to a JSON file')
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    sensors = load_fleet(args.fleet, args.sensors, args.clock_skew)
+    logger.info(f"Simulating {len(sensors)} sensors against {args.api_base_url} for {args.duration}s")
+
+    stats = asyncio.run(FleetSimulator(args.api_base_url, sensors, args).run())
+    stats.print_report()
+
+    if args.json_output:
+        with open(args.json_output, 'w', encoding='utf-8') as f:
+            json.dump(stats.summary(), f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,29 +4,174 @@ import hmac
 import json
 import logging
 import os
-import pickle
 import random
+import struct
 import sys
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List, Optional
-import sqlite3
 from datetime import datetime, timedelta
 
 import requests
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('secure_glucose_generator.log', encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from sensor_state_store import create_state_store
+
 logger = logging.getLogger(__name__)
 
 
+def configure_logging():
+    """Настройка логирования при запуске генератора как скрипта"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('secure_glucose_generator.log', encoding='utf-8'),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+
+def sign_payload(secret_key: str, data: Dict[str, Any]) -> str:
+    """HMAC-SHA512 подпись канонического JSON (ключ - hex-строка)"""
+    canonical_data = json.dumps(data, sort_keys=True).encode('utf-8')
+    signature = hmac.new(
+        bytes.fromhex(secret_key),
+        canonical_data,
+        hashlib.sha512
+    ).digest()
+    return base64.b64encode(signature).decode('utf-8')
+
+
+def sign_request_v2(secret_key: str, method: str, path: str, nonce: int, timestamp: int, body: bytes) -> str:
+    """Подпись v2: HMAC-SHA512 над заголовком запроса и сырыми байтами тела"""
+    mac = hmac.new(
+        bytes.fromhex(secret_key),
+        f"v2\n{method.upper()}\n{path}\n{nonce}\n{timestamp}\n".encode('utf-8'),
+        hashlib.sha512
+    )
+    mac.update(body)
+    return base64.b64encode(mac.digest()).decode('utf-8')
+
+
+def derive_session_key(secret_key: str, token: str) -> bytes:
+    """Ключ сессии: HMAC-SHA256(секрет сенсора, токен сессии)"""
+    return hmac.new(bytes.fromhex(secret_key), b'glucose-session\n' + token.encode('utf-8'), hashlib.sha256).digest()
+
+
+def sign_session_request(session_key: bytes, method: str, path: str, counter: int, timestamp: int,
+                         body: bytes) -> str:
+    """Подпись запроса в рамках сессии: HMAC-SHA256 ключом сессии со счётчиком вместо nonce"""
+    mac = hmac.new(
+        session_key,
+        f"s1\n{method.upper()}\n{path}\n{counter}\n{timestamp}\n".encode('utf-8'),
+        hashlib.sha256
+    )
+    mac.update(body)
+    return base64.b64encode(mac.digest()).decode('utf-8')
+
+
+PAYLOAD_JSON = 'json'
+PAYLOAD_BINARY_V1 = 'binary-v1'
+
+# Сжатие открытого текста перед шифрованием
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+
+# Формат binary-v1: заголовок magic/версия/count/base_timestamp и записи (ts_delta uint32, value uint16)
+BINARY_HEADER = struct.Struct('<3sBIQ')
+BINARY_RECORD = struct.Struct('<IH')
+
+
+def encode_binary_measurements(measurements_list: List[Dict]) -> bytes:
+    """Упаковка измерений в двоичный формат binary-v1 (6 байт на измерение)"""
+    base = min((m['timestamp'] for m in measurements_list), default=0)
+    buffer = bytearray(BINARY_HEADER.size + BINARY_RECORD.size * len(measurements_list))
+    BINARY_HEADER.pack_into(buffer, 0, b'GLB', 1, len(measurements_list), base)
+
+    offset = BINARY_HEADER.size
+    for m in measurements_list:
+        BINARY_RECORD.pack_into(buffer, offset, m['timestamp'] - base, int(round(m['value'] * 100)))
+        offset += BINARY_RECORD.size
+    return bytes(buffer)
+
+
+def encrypt_bytes(secret_key: str, payload: bytes) -> str:
+    """Шифрование AES-GCM, результат: base64(nonce (12) + ciphertext + tag (16))"""
+    # Генерация случайного nonce (96 бит/12 байт)
+    nonce = os.urandom(12)
+
+    # Создание шифра AES-GCM
+    cipher = Cipher(
+        algorithms.AES(bytes.fromhex(secret_key)),
+        modes.GCM(nonce),
+        backend=default_backend()
+    )
+    encryptor = cipher.encryptor()
+
+    # Шифрование данных
+    ciphertext = encryptor.update(payload) + encryptor.finalize()
+    tag = encryptor.tag
+
+    # Формат: nonce (12) + ciphertext + tag (16)
+    encrypted = nonce + ciphertext + tag
+    return base64.b64encode(encrypted).decode('utf-8')
+
+
+def encrypt_measurements(secret_key: str, measurements_list: List[Dict],
+                         payload_format: str = PAYLOAD_JSON, compression: str = COMPRESSION_NONE) -> str:
+    """Шифрование списка измерений AES-GCM для batch-отправки (со сжатием до шифрования)"""
+    if payload_format == PAYLOAD_BINARY_V1:
+        plaintext = encode_binary_measurements(measurements_list)
+    else:
+        # Добавляем соль для дополнительной безопасности
+        salt = base64.b64encode(os.urandom(16)).decode('utf-8')
+        data_with_salt = {
+            'salt': salt,
+            'measurements': measurements_list,
+            'count': len(measurements_list)
+        }
+        plaintext = json.dumps(data_with_salt).encode('utf-8')
+
+    if compression == COMPRESSION_ZLIB:
+        plaintext = zlib.compress(plaintext)
+    return encrypt_bytes(secret_key, plaintext)
+
+
+class UplinkController:
+    """
+    Адаптивный размер batch: удвоение после полностью успешного раунда отправки,
+    укладывающегося в целевое время, и уменьшение вдвое при ошибке или таймауте.
+    Верхняя граница - min(max_batch_size из конфигурации, лимит сервера).
+    """
+
+    def __init__(self, initial_size: int, max_size: int = 1000, target_seconds: float = 5.0):
+        self.max_size = max_size
+        self.server_limit: Optional[int] = None
+        self.target_seconds = target_seconds
+        self.size = max(1, min(initial_size, max_size))
+
+    @property
+    def limit(self) -> int:
+        return min(self.max_size, self.server_limit or self.max_size)
+
+    def record_success(self, elapsed: float):
+        if elapsed <= self.target_seconds:
+            self.size = min(self.size * 2, self.limit)
+
+    def record_failure(self):
+        self.size = max(self.size // 2, 1)
+
+    def apply_server_limits(self, limits: Optional[Dict[str, Any]]):
+        """Учёт лимитов из ответа sync или 413"""
+        if limits and limits.get('max_measurements'):
+            self.server_limit = int(limits['max_measurements'])
+            self.size = min(self.size, self.limit)
+
+
 class SecureGlucoseDataGenerator:
     """
     Безопасный генератор данных глюкозы с поддержкой:
@@ -42,12 +187,12 @@ class SecureGlucoseDataGenerator:
         self.state_file = f"sensor_state_{self.config['serial_number']}.pickle"
         self.db_file = f"sensor_data_{self.config['serial_number']}.db"
         
+        # Хранилище состояния и накопленных данных (одно соединение SQLite в режиме WAL)
+        self.store = create_state_store(self.config, self.db_file, legacy_state_file=self.state_file)
+
         # Загружаем сохраненное состояние или инициализируем новое
         self.state = self.load_state()
         
-        # Инициализируем локальную БД для накопления данных
-        self.init_local_db()
-        
         # Настройки HTTP
         self.session = requests.Session()
         self.session.headers.update({
@@ -55,6 +200,25 @@ class SecureGlucoseDataGenerator:
             'User-Agent': 'SecureGlucoseSensor/2.0'
         })
         
+        # Формат batch-данных: 'json' или компактный 'binary-v1'
+        self.payload_format = self.config.get('payload_format', PAYLOAD_JSON)
+        # Схема подписи: 1 - канонический JSON в теле, 2 - подпись сырого тела в заголовках
+        self.signature_version = self.config.get('signature_version', 1)
+        # Сессионный режим: полная аутентификация только на sync, далее ключ сессии и счётчик
+        self.use_session = self.config.get('use_session', False)
+
+        # Отправка накопленных данных: адаптивный размер batch, сжатие и несколько batch в полёте
+        self.compression = self.config.get('compression', COMPRESSION_ZLIB)
+        self.uplink = UplinkController(
+            self.config.get('batch_size', 5),
+            max_size=self.config.get('max_batch_size', 1000),
+            target_seconds=self.config.get('uplink_target_seconds', 5)
+        )
+        self.pipeline_depth = max(1, self.config.get('uplink_pipeline_depth', 2))
+        self.drain_seconds = self.config.get('uplink_drain_seconds', 30)
+        # Счётчики и состояние изменяются из потоков отправки
+        self.state_lock = threading.RLock()
+
         # Флаг состояния соединения
         self.connection_available = True
         self.last_sync_attempt = 0
@@ -109,6 +273,14 @@ class SecureGlucoseDataGenerator:
                 "probability": 0.7
             },
             "batch_size": 5,
+            "max_batch_size": 1000,
+            "compression": "zlib",
+            "uplink_pipeline_depth": 2,
+            "uplink_drain_seconds": 30,
+            "payload_format": "json",
+            "signature_version": 1,
+            "use_session": False,
+            "state_backend": "sqlite",
             "max_offline_hours": 24,
             "sync_interval_minutes": 30
         }
@@ -120,48 +292,30 @@ class SecureGlucoseDataGenerator:
 
     def load_state(self) -> Dict[str, Any]:
         """Загрузка сохраненного состояния сенсора"""
-        try:
-            with open(self.state_file, 'rb') as f:
-                state = pickle.load(f)
-                logger.info("Состояние сенсора восстановлено из файла")
-                return state
-        except FileNotFoundError:
-            logger.info("Создание нового состояния сенсора")
-            return {
-                'current_nonce': 1000,  # Начинаем с 1000
-                'nonce_window_start': 1000,
-                'nonce_window_size': 1000,
-                'last_sync_timestamp': int(time.time()),
-                'device_clock_offset': 0,
-                'total_measurements': 0,
-                'last_successful_send': None
-            }
+        return self.store.load_state({
+            'current_nonce': 1000,  # Начинаем с 1000
+            'nonce_window_start': 1000,
+            'nonce_window_size': 1000,
+            'last_sync_timestamp': int(time.time()),
+            'device_clock_offset': 0,
+            'total_measurements': 0,
+            'last_successful_send': None,
+            'session_token': None,
+            'session_expires_at': 0,
+            'session_counter': 0
+        })
 
     def save_state(self):
-        """Сохранение текущего состояния сенсора"""
-        with open(self.state_file, 'wb') as f:
-            pickle.dump(self.state, f)
-
-    def init_local_db(self):
-        """Инициализация локальной БД для накопления данных"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS measurements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                value REAL NOT NULL,
-                timestamp INTEGER NOT NULL,
-                sent BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """Сохранение изменённых полей состояния сенсора"""
+        with self.state_lock:
+            self.store.save_state(self.state)
 
     def get_next_nonce(self) -> int:
         """Получение следующего nonce"""
+        with self.state_lock:
+            return self._next_nonce()
+
+    def _next_nonce(self) -> int:
         current_nonce = self.state['current_nonce']
         window_start = self.state['nonce_window_start']
         window_size = self.state['nonce_window_size']
@@ -173,51 +327,66 @@ class SecureGlucoseDataGenerator:
             self.state['nonce_window_start'] = new_window_start
             logger.info(f"Переход к новому окну nonce: {new_window_start}")
         
-        self.state['current_nonce'] += 1
-        self.save_state()
-        return self.state['current_nonce']
+        # На диск записывается только граница зарезервированного блока nonce
+        return self.store.next_counter(self.state, 'current_nonce')
 
     def generate_hmac_signature(self, data: Dict[str, Any]) -> str:
         """Генерация HMAC-SHA512 подписи для данных"""
-        canonical_data = json.dumps(data, sort_keys=True).encode('utf-8')
-        signature = hmac.new(
-            bytes.fromhex(self.config['secret_key']),
-            canonical_data,
-            hashlib.sha512
-        ).digest()
-        return base64.b64encode(signature).decode('utf-8')
+        return sign_payload(self.config['secret_key'], data)
 
     def encrypt_batch_data(self, measurements_list: List[Dict]) -> str:
         """Шифрование списка измерений для batch-отправки"""
-        # Добавляем соль для дополнительной безопасности
-        salt = base64.b64encode(os.urandom(16)).decode('utf-8')
-        data_with_salt = {
-            'salt': salt,
-            'measurements': measurements_list,
-            'count': len(measurements_list)
+        return encrypt_measurements(self.config['secret_key'], measurements_list, self.payload_format, self.compression)
+
+    def session_active(self) -> bool:
+        """Есть ли действующий токен сессии (с запасом в 30 секунд)"""
+        return bool(self.state.get('session_token')) and self.state.get('session_expires_at', 0) - 30 > time.time()
+
+    def clear_session(self):
+        self.state['session_token'] = None
+        self.state['session_expires_at'] = 0
+        self.save_state()
+
+    def post_signed(self, endpoint: str, payload: Dict[str, Any], nonce: int, timestamp: int):
+        """Отправка подписанного запроса на endpoint сенсора"""
+        path = f"/api/v1/sensor/{self.config['serial_number']}/{endpoint}/"
+        url = f"{self.config['api_base_url']}/sensor/{self.config['serial_number']}/{endpoint}/"
+
+        if endpoint != 'sync' and self.session_active():
+            with self.state_lock:
+                counter = self.store.next_counter(self.state, 'session_counter')
+            body = json.dumps(payload).encode('utf-8')
+            session_key = derive_session_key(self.config['secret_key'], self.state['session_token'])
+            headers = {
+                'X-Sensor-Session': self.state['session_token'],
+                'X-Sensor-Counter': str(counter),
+                'X-Sensor-Timestamp': str(timestamp),
+                'X-Sensor-Signature': sign_session_request(session_key, 'POST', path, counter, timestamp, body),
+            }
+            response = self.session.post(url, data=body, headers=headers, timeout=30)
+            if response.status_code != 401 or 'session_expired' not in response.text:
+                return response
+            # Сессия недействительна - возвращаемся к полной аутентификации
+            logger.info("Сессия истекла, переход к полной аутентификации")
+            self.clear_session()
+
+        if self.signature_version == 2:
+            body = json.dumps(payload).encode('utf-8')
+            headers = {
+                'X-Sensor-Signature': sign_request_v2(self.config['secret_key'], 'POST', path, nonce, timestamp, body),
+                'X-Sensor-Nonce': str(nonce),
+                'X-Sensor-Timestamp': str(timestamp),
+            }
+            return self.session.post(url, data=body, headers=headers, timeout=30)
+
+        sign_data = {
+            'path': path,
+            'nonce': nonce,
+            'timestamp': timestamp,
+            'body': payload
         }
-        
-        # Преобразуем в JSON
-        payload = json.dumps(data_with_salt).encode('utf-8')
-        
-        # Генерация случайного nonce (96 бит/12 байт)
-        nonce = os.urandom(12)
-        
-        # Создание шифра AES-GCM
-        cipher = Cipher(
-            algorithms.AES(bytes.fromhex(self.config['secret_key'])),
-            modes.GCM(nonce),
-            backend=default_backend()
-        )
-        encryptor = cipher.encryptor()
-        
-        # Шифрование данных
-        ciphertext = encryptor.update(payload) + encryptor.finalize()
-        tag = encryptor.tag
-        
-        # Формат: nonce (12) + ciphertext + tag (16)
-        encrypted = nonce + ciphertext + tag
-        return base64.b64encode(encrypted).decode('utf-8')
+        signed_payload = dict(payload, signature=self.generate_hmac_signature(sign_data))
+        return self.session.post(url, json=signed_payload, timeout=30)
 
     def generate_glucose_value(self) -> float:
         """Генерация случайного значения глюкозы"""
@@ -237,64 +406,25 @@ class SecureGlucoseDataGenerator:
         return round(value, 1)
 
     def store_measurement_locally(self, value: float, timestamp: int):
-        """Сохранение измерения в локальной БД"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO measurements (value, timestamp) VALUES (?, ?)
-        ''', (value, timestamp))
-        
-        conn.commit()
-        conn.close()
-        
+        """Сохранение измерения в локальной БД (запись пакетами, см. sensor_state_store)"""
+        self.store.add_measurement(value, timestamp)
         self.state['total_measurements'] += 1
-        self.save_state()
 
     def get_unsent_measurements(self, limit: Optional[int] = None) -> List[Dict]:
         """Получение неотправленных измерений"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        query = '''
-            SELECT id, value, timestamp FROM measurements 
-            WHERE sent = FALSE 
-            ORDER BY timestamp ASC
-        '''
-        
-        if limit:
-            query += f' LIMIT {limit}'
-        
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                'id': row[0],
-                'value': row[1],
-                'timestamp': row[2]
-            }
-            for row in rows
-        ]
+        return self.store.get_unsent_measurements(limit)
 
     def mark_measurements_sent(self, measurement_ids: List[int]):
         """Отметка измерений как отправленных"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        placeholders = ','.join(['?' for _ in measurement_ids])
-        cursor.execute(f'''
-            UPDATE measurements 
-            SET sent = TRUE 
-            WHERE id IN ({placeholders})
-        ''', measurement_ids)
-        
-        conn.commit()
-        conn.close()
+        self.store.mark_measurements_sent(measurement_ids)
 
     def sync_with_server(self) -> bool:
         """Синхронизация времени и nonce с сервером"""
+        # Параллельные отправки не получают nonce, пока окно переключается
+        with self.state_lock:
+            return self._sync_with_server()
+
+    def _sync_with_server(self) -> bool:
         current_timestamp = int(time.time())
         
         # Для синхронизации используем nonce из следующего окна
@@ -307,22 +437,12 @@ class SecureGlucoseDataGenerator:
             'device_timestamp': current_timestamp + self.state['device_clock_offset'],
             'request_new_window': True
         }
-        
-        sign_data = {
-            'path': f"/api/v1/sensor/{self.config['serial_number']}/sync/",
-            'nonce': sync_nonce,
-            'timestamp': current_timestamp,
-            'body': payload
-        }
-        
-        signature = self.generate_hmac_signature(sign_data)
-        payload['signature'] = signature
-        
-        url = f"{self.config['api_base_url']}/sensor/{self.config['serial_number']}/sync/"
+        if self.use_session:
+            payload['request_session'] = True
         
         try:
             logger.info(f"Синхронизация с сервером (nonce: {sync_nonce})...")
-            response = self.session.post(url, json=payload, timeout=30)
+            response = self.post_signed('sync', payload, sync_nonce, current_timestamp)
             
             if response.status_code == 200:
                 sync_info = response.json()
@@ -336,9 +456,19 @@ class SecureGlucoseDataGenerator:
                     self.state['nonce_window_size'] = new_window_size
                     # Устанавливаем текущий nonce в начало нового окна
                     self.state['current_nonce'] = new_window_start
+                    self.store.reset_counter('current_nonce', new_window_start)
                     
                     logger.info(f"Новое окно nonce: {new_window_start} - {new_window_start + new_window_size}")
                 
+                if 'session' in sync_info:
+                    self.state['session_token'] = sync_info['session']['token']
+                    self.state['session_expires_at'] = sync_info['session']['expires_at']
+                    self.state['session_counter'] = 0
+                    self.store.reset_counter('session_counter', 0)
+                    logger.info("Получен токен сессии")
+
+                self.uplink.apply_server_limits(sync_info.get('batch_limits'))
+
                 if 'sync_info' in sync_info:
                     self.state['device_clock_offset'] = sync_info['sync_info']['offset_seconds']
                     logger.info(f"Смещение времени обновлено: {self.state['device_clock_offset']} сек")
@@ -368,20 +498,8 @@ class SecureGlucoseDataGenerator:
             'nonce': nonce
         }
         
-        sign_data = {
-            'path': f"/api/v1/sensor/{self.config['serial_number']}/single/",
-            'nonce': nonce,
-            'timestamp': current_timestamp,
-            'body': payload
-        }
-        
-        signature = self.generate_hmac_signature(sign_data)
-        payload['signature'] = signature
-        
-        url = f"{self.config['api_base_url']}/sensor/{self.config['serial_number']}/single/"
-        
         try:
-            response = self.session.post(url, json=payload, timeout=30)
+            response = self.post_signed('single', payload, nonce, current_timestamp)
             
             if response.status_code == 201:
                 logger.info(f"[SUCCESS] Измерение отправлено: {value} mmol/L")
@@ -426,23 +544,15 @@ class SecureGlucoseDataGenerator:
             'encrypted_data': encrypted_data,
             'is_final': True
         }
-        
-        sign_data = {
-            'path': f"/api/v1/sensor/{self.config['serial_number']}/batch/",
-            'nonce': nonce,
-            'timestamp': current_timestamp,
-            'body': payload
-        }
-        
-        signature = self.generate_hmac_signature(sign_data)
-        payload['signature'] = signature
-        
-        url = f"{self.config['api_base_url']}/sensor/{self.config['serial_number']}/batch/"
+        if self.payload_format != PAYLOAD_JSON:
+            payload['payload_format'] = self.payload_format
+        if self.compression != COMPRESSION_NONE:
+            payload['compression'] = self.compression
         
         try:
             retry_text = f" (попытка {retry_count + 1})" if retry_count > 0 else ""
             logger.info(f"Отправка batch из {len(measurements)} измерений{retry_text}...")
-            response = self.session.post(url, json=payload, timeout=30)
+            response = self.post_signed('batch', payload, nonce, current_timestamp)
             
             if response.status_code == 201:
                 result = response.json()
@@ -456,6 +566,15 @@ class SecureGlucoseDataGenerator:
                 self.save_state()
                 return True
                 
+            elif response.status_code == 413:
+                # Batch больше лимита сервера - уменьшаем размер по лимитам из ответа
+                logger.warning(f"[TOO_LARGE] Batch из {len(measurements)} измерений превышает лимит сервера")
+                try:
+                    self.uplink.apply_server_limits(response.json().get('batch_limits'))
+                except ValueError:
+                    pass
+                return False
+
             elif response.status_code == 401:
                 # Ошибка аутентификации - возможно проблема с nonce
                 error_text = response.text
@@ -510,16 +629,55 @@ class SecureGlucoseDataGenerator:
                 logger.warning("Синхронизация не удалась")
         
         # Отправляем накопленные данные
-        batch_size = self.config.get('batch_size', 5)
-        unsent = self.get_unsent_measurements(limit=batch_size)
-        
-        if unsent:
-            logger.info(f"Найдено {len(unsent)} неотправленных измерений")
-            if self.send_batch_measurements(unsent):
+        unsent_count = self.store.count_unsent_measurements()
+        if unsent_count:
+            logger.info(f"Найдено {unsent_count} неотправленных измерений")
+            sent = self.drain_accumulated_data()
+            if sent >= unsent_count:
                 logger.info("Накопленные данные отправлены")
+            elif sent:
+                logger.info(f"Отправлено {sent} из {unsent_count} измерений, остаток - в следующем цикле")
             else:
                 logger.warning("Не удалось отправить накопленные данные")
 
+    def drain_accumulated_data(self) -> int:
+        """
+        Отправка накопленных данных раундами, пока есть связь и не истёк uplink_drain_seconds.
+        В каждом раунде параллельно отправляются до uplink_pipeline_depth batch'ей
+        текущего размера; размер batch подстраивается по результату раунда.
+        В сессионном режиме batch'и отправляются по одному: сервер требует строго
+        возрастающий счётчик.
+
+        Returns:
+            int: количество отправленных измерений
+        """
+        deadline = time.monotonic() + self.drain_seconds
+        depth = 1 if self.session_active() else self.pipeline_depth
+        sent = 0
+
+        with ThreadPoolExecutor(max_workers=depth) as pool:
+            while time.monotonic() < deadline:
+                size = self.uplink.size
+                unsent = self.get_unsent_measurements(limit=size * depth)
+                if not unsent:
+                    break
+
+                batches = [unsent[i:i + size] for i in range(0, len(unsent), size)]
+                started = time.monotonic()
+                results = list(pool.map(self.send_batch_measurements, batches))
+                elapsed = time.monotonic() - started
+                sent += sum(len(batch) for batch, success in zip(batches, results) if success)
+
+                if not all(results):
+                    self.uplink.record_failure()
+                    logger.info(f"Размер batch уменьшен до {self.uplink.size}")
+                    break
+                if len(unsent) < size * depth:
+                    break
+                self.uplink.record_success(elapsed)
+
+        return sent
+
     def run_measurement_cycle(self):
         """Один цикл измерения и отправки"""
         # Генерируем измерение
@@ -568,7 +726,7 @@ class SecureGlucoseDataGenerator:
         except Exception as e:
             logger.error(f"Критическая ошибка: {str(e)}")
         finally:
-            self.save_state()
+            self.close()
             logger.info("Состояние сохранено")
 
     def send_test_data(self):
@@ -592,9 +750,14 @@ class SecureGlucoseDataGenerator:
         # Отправляем все тестовые данные
         self.try_send_accumulated_data()
 
+    def close(self):
+        """Сохранение состояния и накопленных измерений, закрытие хранилища"""
+        self.save_state()
+        self.store.close()
+
     def get_status(self) -> Dict[str, Any]:
         """Получение статуса генератора"""
-        unsent_count = len(self.get_unsent_measurements())
+        unsent_count = self.store.count_unsent_measurements()
         
         return {
             'serial_number': self.config['serial_number'],
@@ -614,31 +777,34 @@ class SecureGlucoseDataGenerator:
 
 def main():
     """Основная функция"""
+    configure_logging()
+
     if len(sys.argv) > 1:
         command = sys.argv[1]
-        
-        if command == 'test':
-            # Режим тестирования
-            generator = SecureGlucoseDataGenerator()
-            generator.send_test_data()
-        elif command == 'status':
-            # Показать статус
-            generator = SecureGlucoseDataGenerator()
-            status = generator.get_status()
-            print(json.dumps(status, indent=2, default=str))
-        elif command == 'sync':
-            # Принудительная синхронизация
-            generator = SecureGlucoseDataGenerator()
-            if generator.sync_with_server():
-                print("Синхронизация успешна")
-            else:
-                print("Синхронизация не удалась")
-        elif command == 'send':
-            # Отправить накопленные данные
-            generator = SecureGlucoseDataGenerator()
-            generator.try_send_accumulated_data()
-        else:
+        if command not in ('test', 'status', 'sync', 'send'):
             print("Доступные команды: test, status, sync, send")
+            return
+
+        generator = SecureGlucoseDataGenerator()
+        try:
+            if command == 'test':
+                # Режим тестирования
+                generator.send_test_data()
+            elif command == 'status':
+                # Показать статус
+                status = generator.get_status()
+                print(json.dumps(status, indent=2, default=str))
+            elif command == 'sync':
+                # Принудительная синхронизация
+                if generator.sync_with_server():
+                    print("Синхронизация успешна")
+                else:
+                    print("Синхронизация не удалась")
+            elif command == 'send':
+                # Отправить накопленные данные
+                generator.try_send_accumulated_data()
+        finally:
+            generator.close()
     else:
         # Обычный режим работы
         generator = SecureGlucoseDataGenerator()
@@ -0,0 +1,297 @@
+"""
+Хранилище состояния устройства для secure_glucose_generator.py.
+
+Состояние сенсора (окно nonce, смещение часов, сессия) и накопленные
+измерения хранятся в одной SQLite-базе с одним долгоживущим соединением
+в режиме WAL (synchronous=NORMAL): запись не требует fsync на каждую
+транзакцию, что снижает нагрузку на CPU и износ flash-памяти шлюза.
+
+Монотонные счётчики (nonce, счётчик сессии) резервируются блоками: на диск
+записывается только верхняя граница блока, после перезапуска отсчёт
+продолжается с неё. Неиспользованные значения блока пропускаются, повтор
+значения невозможен.
+
+Измерения накапливаются в памяти и записываются одним executemany по порогу
+количества или времени, а также перед любым чтением неотправленных данных.
+
+Реализации:
+    SQLiteStateStore - постоянное хранилище (по умолчанию)
+    MemoryStateStore - состояние в памяти процесса (симуляторы, тесты)
+"""
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+COUNTER_BLOCK_SIZE = 100
+RESERVED_PREFIX = 'reserved:'
+
+
+class DeviceStateStore(ABC):
+    """Интерфейс хранилища состояния устройства"""
+
+    def __init__(self, counter_block: int = COUNTER_BLOCK_SIZE):
+        self.counter_block = counter_block
+        self._reserved: Dict[str, int] = {}
+
+    @abstractmethod
+    def load_state(self, defaults: Dict[str, Any]) -> Dict[str, Any]:
+        """Загрузка состояния (отсутствующие поля берутся из defaults)"""
+
+    @abstractmethod
+    def save_state(self, state: Dict[str, Any]):
+        """Сохранение изменённых полей состояния"""
+
+    @abstractmethod
+    def _persist_reservation(self, name: str, limit: int):
+        """Сохранение верхней границы зарезервированного блока счётчика"""
+
+    def next_counter(self, state: Dict[str, Any], name: str) -> int:
+        """
+        Увеличение монотонного счётчика state[name].
+        Диск затрагивается только при исчерпании зарезервированного блока.
+        """
+        state[name] += 1
+        if state[name] >= self._reserved.get(name, 0):
+            self.reset_counter(name, state[name])
+        return state[name]
+
+    def reset_counter(self, name: str, value: int):
+        """Резервирование нового блока, начиная с value (например, после получения нового окна nonce)"""
+        self._reserved[name] = value + self.counter_block
+        self._persist_reservation(name, self._reserved[name])
+
+    def _apply_reservations(self, state: Dict[str, Any], reserved: Dict[str, int]):
+        """Продолжение счётчиков с границы блока, зарезервированного до перезапуска"""
+        for name, limit in reserved.items():
+            if name in state and state[name] is not None and limit > state[name]:
+                state[name] = limit
+        self._reserved = dict(reserved)
+
+    @abstractmethod
+    def add_measurement(self, value: float, timestamp: int):
+        """Добавление измерения (запись может быть отложена до flush)"""
+
+    @abstractmethod
+    def get_unsent_measurements(self, limit: Optional[int] = None) -> List[Dict]:
+        """Неотправленные измерения в порядке времени: [{'id', 'value', 'timestamp'}]"""
+
+    @abstractmethod
+    def count_unsent_measurements(self) -> int:
+        """Количество неотправленных измерений"""
+
+    @abstractmethod
+    def mark_measurements_sent(self, measurement_ids: List[int]):
+        """Отметка измерений как отправленных"""
+
+    def flush(self):
+        """Запись отложенных измерений"""
+
+    def close(self):
+        """Запись отложенных данных и освобождение ресурсов"""
+        self.flush()
+
+
+class MemoryStateStore(DeviceStateStore):
+    """Состояние в памяти процесса, без записи на диск"""
+
+    def __init__(self, counter_block: int = COUNTER_BLOCK_SIZE):
+        super().__init__(counter_block)
+        self._state: Dict[str, Any] = {}
+        self._measurements: Dict[int, Dict] = {}
+        self._next_id = 1
+
+    def load_state(self, defaults: Dict[str, Any]) -> Dict[str, Any]:
+        return {**defaults, **self._state}
+
+    def save_state(self, state: Dict[str, Any]):
+        self._state = dict(state)
+
+    def _persist_reservation(self, name: str, limit: int):
+        pass
+
+    def add_measurement(self, value: float, timestamp: int):
+        self._measurements[self._next_id] = {'id': self._next_id, 'value': value, 'timestamp': timestamp}
+        self._next_id += 1
+
+    def get_unsent_measurements(self, limit: Optional[int] = None) -> List[Dict]:
+        unsent = sorted(self._measurements.values(), key=lambda m: (m['timestamp'], m['id']))
+        return [dict(m) for m in (unsent[:limit] if limit else unsent)]
+
+    def count_unsent_measurements(self) -> int:
+        return len(self._measurements)
+
+    def mark_measurements_sent(self, measurement_ids: List[int]):
+        for measurement_id in measurement_ids:
+            self._measurements.pop(measurement_id, None)
+
+
+class SQLiteStateStore(DeviceStateStore):
+    """Состояние и измерения в одной SQLite-базе с постоянным соединением (WAL)"""
+
+    def __init__(self, db_file: str, counter_block: int = COUNTER_BLOCK_SIZE,
+                 flush_rows: int = 50, flush_seconds: float = 60.0, legacy_state_file: Optional[str] = None):
+        super().__init__(counter_block)
+        self.db_file = db_file
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.legacy_state_file = legacy_state_file
+
+        self._lock = threading.RLock()
+        self._pending: List[tuple] = []
+        self._pending_since = 0.0
+        self._saved: Dict[str, str] = {}
+
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._init_schema()
+
+    def _init_schema(self):
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS measurements (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    value REAL NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    sent BOOLEAN DEFAULT FALSE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_measurements_unsent
+                ON measurements (timestamp) WHERE sent = 0
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS device_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+
+    def load_state(self, defaults: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            rows = self.conn.execute('SELECT key, value FROM device_state').fetchall()
+
+        if not rows and self.legacy_state_file and os.path.exists(self.legacy_state_file):
+            # Однократный перенос состояния из pickle-файла предыдущих версий
+            with open(self.legacy_state_file, 'rb') as f:
+                state = {**defaults, **pickle.load(f)}
+            self.save_state(state)
+            logger.info(f"Состояние сенсора перенесено из {self.legacy_state_file}")
+            return state
+
+        state = dict(defaults)
+        reserved = {}
+        for key, value in rows:
+            if key.startswith(RESERVED_PREFIX):
+                reserved[key[len(RESERVED_PREFIX):]] = json.loads(value)
+            else:
+                state[key] = json.loads(value)
+                self._saved[key] = value
+
+        self._apply_reservations(state, reserved)
+        if rows:
+            logger.info("Состояние сенсора восстановлено из локальной БД")
+        return state
+
+    def save_state(self, state: Dict[str, Any]):
+        changed = []
+        for key, value in state.items():
+            encoded = json.dumps(value)
+            if self._saved.get(key) != encoded:
+                changed.append((key, encoded))
+        if not changed:
+            return
+
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO device_state (key, value) VALUES (?, ?)', changed
+            )
+        self._saved.update(changed)
+
+    def _persist_reservation(self, name: str, limit: int):
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO device_state (key, value) VALUES (?, ?)',
+                (RESERVED_PREFIX + name, json.dumps(limit))
+            )
+
+    def add_measurement(self, value: float, timestamp: int):
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append((value, timestamp))
+            if (len(self._pending) >= self.flush_rows
+                    or time.monotonic() - self._pending_since >= self.flush_seconds):
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT INTO measurements (value, timestamp) VALUES (?, ?)', self._pending
+                )
+            self._pending = []
+
+    def get_unsent_measurements(self, limit: Optional[int] = None) -> List[Dict]:
+        with self._lock:
+            self.flush()
+            query = 'SELECT id, value, timestamp FROM measurements WHERE sent = 0 ORDER BY timestamp ASC'
+            if limit:
+                rows = self.conn.execute(query + ' LIMIT ?', (limit,)).fetchall()
+            else:
+                rows = self.conn.execute(query).fetchall()
+
+        return [
+            {
+                'id': row[0],
+                'value': row[1],
+                'timestamp': row[2]
+            }
+            for row in rows
+        ]
+
+    def count_unsent_measurements(self) -> int:
+        with self._lock:
+            self.flush()
+            return self.conn.execute('SELECT COUNT(*) FROM measurements WHERE sent = 0').fetchone()[0]
+
+    def mark_measurements_sent(self, measurement_ids: List[int]):
+        if not measurement_ids:
+            return
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'UPDATE measurements SET sent = 1 WHERE id = ?', [(measurement_id,) for measurement_id in measurement_ids]
+            )
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.conn.close()
+
+
+def create_state_store(config: Dict[str, Any], db_file: str, legacy_state_file: Optional[str] = None) -> DeviceStateStore:
+    """Хранилище состояния по конфигурации генератора (state_backend: 'sqlite' или 'memory')"""
+    backend = config.get('state_backend', 'sqlite')
+    counter_block = config.get('nonce_reserve_block', COUNTER_BLOCK_SIZE)
+    if backend == 'memory':
+        return MemoryStateStore(counter_block=counter_block)
+    if backend == 'sqlite':
+        return SQLiteStateStore(
+            db_file,
+            counter_block=counter_block,
+            flush_rows=config.get('state_flush_rows', 50),
+            flush_seconds=config.get('state_flush_seconds', 60),
+            legacy_state_file=legacy_state_file
+        )
+    raise ValueError(f"Неизвестный state_backend: {backend}")
@@ -0,0 +1,236 @@
+"""
+Оценка показаний на пороги гипо-/гипергликемии при приёме данных.
+
+Для каждого сенсора в кэше хранится небольшое состояние: последнее показание
+(для скорости изменения), счётчики подряд идущих выходов за порог (подавление
+дребезга) и время последней отправки каждого типа уведомления (подавление
+повторов). Состояние читается и записывается без блокировок, поэтому отправка
+уведомления дополнительно "захватывается" атомарным cache.add по ключу
+(сенсор, тип, эпизод), где эпизод - интервал ALERT_REPEAT_MINUTES, в который
+попало показание: при одновременной оценке в нескольких процессах
+уведомление эпизода отправляет только один. Уведомления публикуются в RabbitMQ (glucose.alert.*) отдельным
+потоком, поэтому недоступность брокера не замедляет запись показаний;
+накопившиеся в очереди уведомления отправляются одной пачкой.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .live import publish_alert
+from .models import Sensor
+from .rabbitmq_publisher import publisher
+from .rollups import DEFAULT_HIGH_THRESHOLD, DEFAULT_LOW_THRESHOLD, get_thresholds
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = 'glucose:alert_state:{}'
+CLAIM_KEY = 'glucose:alert_claim:{}:{}:{}'
+# Скорость изменения считается только по показаниям не дальше этого интервала
+RATE_MAX_GAP = 15 * 60
+# Максимум уведомлений в одной пачке публикации
+PUBLISH_BATCH_SIZE = 100
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def classify(value, rate, low, high):
+    """
+    Определение типа уведомления для одного показания.
+
+    Args:
+        value: Значение глюкозы (ммоль/л)
+        rate: Скорость изменения (ммоль/л в минуту) или None
+        low, high: Целевой диапазон сенсора
+
+    Returns:
+        tuple: (alert_type, reason, threshold) или (None, None, None)
+    """
+    critical_low = _setting('ALERT_CRITICAL_LOW', 3.0)
+    critical_high = _setting('ALERT_CRITICAL_HIGH', 13.9)
+    if value <= critical_low:
+        return 'critical', 'critical_low', critical_low
+    if value >= critical_high:
+        return 'critical', 'critical_high', critical_high
+    if value < low:
+        return 'low', 'below_threshold', low
+    if value > high:
+        return 'high', 'above_threshold', high
+
+    if rate is not None:
+        projected = value + rate * _setting('ALERT_PREDICTION_MINUTES', 20)
+        if projected < low:
+            return 'low', 'predicted_low', low
+        if projected > high:
+            return 'high', 'predicted_high', high
+    return None, None, None
+
+
+class AlertEngine:
+    """
+    Оценка вставленных показаний и асинхронная публикация уведомлений.
+
+    Оценка ограничена по времени: показания старше ALERT_MAX_READING_AGE
+    секунд не оцениваются (выгрузка накопленной истории не вызывает поток
+    уведомлений), а на один вызов evaluate отводится не более
+    ALERT_EVALUATION_BUDGET_MS миллисекунд.
+    """
+
+    def __init__(self, queue_size):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def evaluate(self, readings):
+        """
+        Оценка только что записанных показаний.
+
+        Args:
+            readings: Список (sensor_id, measured_at, value)
+
+        Returns:
+            int: Количество поставленных в очередь уведомлений
+        """
+        if not readings or not _setting('GLUCOSE_ALERTS_ENABLED', True):
+            return 0
+
+        started = time.monotonic()
+        budget = _setting('ALERT_EVALUATION_BUDGET_MS', 50) / 1000
+        oldest = timezone.now() - timedelta(seconds=_setting('ALERT_MAX_READING_AGE', 900))
+
+        by_sensor = defaultdict(list)
+        for sensor_id, measured_at, value in readings:
+            if measured_at >= oldest:
+                by_sensor[sensor_id].append((measured_at, value))
+        if not by_sensor:
+            return 0
+
+        recipients = dict(Sensor.objects.filter(
+            pk__in=by_sensor.keys(), user__isnull=False
+        ).values_list('id', 'user_id'))
+        if not recipients:
+            return 0
+        thresholds = get_thresholds(recipients.keys())
+
+        keys = {sensor_id: STATE_KEY.format(sensor_id) for sensor_id in recipients}
+        states = cache.get_many(keys.values())
+        updated = {}
+        queued = 0
+
+        for sensor_id, user_id in recipients.items():
+            if time.monotonic() - started > budget:
+                logger.warning(f"Alert evaluation budget exceeded, "
+                               f"{len(recipients) - len(updated)} sensors skipped")
+                break
+            state = states.get(keys[sensor_id]) or {'t': None, 'v': None, 'pending': {}, 'sent': {}}
+            low, high = thresholds.get(sensor_id, (DEFAULT_LOW_THRESHOLD, DEFAULT_HIGH_THRESHOLD))
+            for alert in self._evaluate_sensor(state, sorted(by_sensor[sensor_id]), low, high):
+                if self._claim(sensor_id, alert):
+                    queued += self._enqueue(user_id, sensor_id, alert)
+            updated[keys[sensor_id]] = state
+
+        cache.set_many(updated, _setting('ALERT_STATE_TTL', 86400))
+        return queued
+
+    def _evaluate_sensor(self, state, points, low, high):
+        confirm = _setting('ALERT_CONFIRM_READINGS', 2)
+        repeat = _setting('ALERT_REPEAT_MINUTES', 30) * 60
+        alerts = []
+
+        for measured_at, value in points:
+            ts = measured_at.timestamp()
+            if state['t'] is not None and ts <= state['t']:
+                continue  # показание старше уже оценённого
+
+            rate = None
+            if state['t'] is not None and ts - state['t'] <= RATE_MAX_GAP:
+                rate = (value - state['v']) / ((ts - state['t']) / 60)
+            state['t'], state['v'] = ts, value
+
+            alert_type, reason, threshold = classify(value, rate, low, high)
+            if alert_type is None:
+                state['pending'] = {}
+                continue
+
+            count = state['pending'].get(alert_type, 0) + 1
+            state['pending'] = {alert_type: count}
+            if alert_type != 'critical' and count < confirm:
+                continue
+
+            last_sent = state['sent'].get(alert_type)
+            if last_sent is not None and ts - last_sent < repeat:
+                continue
+            state['sent'][alert_type] = ts
+
+            alerts.append({
+                'alert_type': alert_type,
+                'glucose_value': value,
+                'measured_at': measured_at,
+                'rate': round(rate, 3) if rate is not None else None,
+                'reason': reason,
+                'threshold': threshold,
+            })
+        return alerts
+
+    def _claim(self, sensor_id, alert):
+        """Атомарный захват отправки уведомления эпизода (False - уже отправлено другим процессом)"""
+        repeat = max(_setting('ALERT_REPEAT_MINUTES', 30) * 60, 1)
+        episode = int(alert['measured_at'].timestamp() // repeat)
+        return cache.add(CLAIM_KEY.format(sensor_id, alert['alert_type'], episode), 1, 2 * repeat)
+
+    def _enqueue(self, user_id, sensor_id, alert):
+        try:
+            self._queue.put_nowait((user_id, sensor_id, alert))
+        except queue.Full:
+            logger.warning(f"Alert queue is full, {alert['alert_type']} alert for sensor {sensor_id} dropped")
+            return 0
+        self._ensure_started()
+        return 1
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='glucose-alert-publisher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < PUBLISH_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            repeat = timedelta(minutes=_setting('ALERT_REPEAT_MINUTES', 30))
+            events = [
+                (f"glucose.alert.{alert['alert_type']}", {
+                    'user_id': str(user_id),
+                    'data': {'sensor_id': str(sensor_id), **alert},
+                    'expires_at': (alert['measured_at'] + repeat).isoformat(),
+                })
+                for user_id, sensor_id, alert in batch
+            ]
+            try:
+                publisher.publish_many(events)
+            except Exception as e:
+                logger.error(f"Error publishing {len(events)} glucose alerts: {str(e)}")
+
+            for _, sensor_id, alert in batch:
+                try:
+                    publish_alert(sensor_id, alert)
+                except Exception as e:
+                    logger.warning(f"Live alert publish failed for sensor {sensor_id}: {str(e)}")
+
+
+alert_engine = AlertEngine(queue_size=getattr(settings, 'ALERT_QUEUE_SIZE', 1000))
@@ -0,0 +1,176 @@
+import numpy as np
+
+AGP_PERCENTILES = (5, 25, 50, 75, 95)
+AGP_SLOT_MINUTES = 15
+
+# Международный консенсус по времени в диапазонах (ммоль/л):
+# <3.0, 3.0-3.8, 3.9-10.0, 10.1-13.9, >13.9 (верхние границы включительно)
+RANGE_BOUNDS = (3.0, 3.9, np.nextafter(10.0, np.inf), np.nextafter(13.9, np.inf))
+RANGE_NAMES = ('very_low', 'low', 'in_range', 'high', 'very_high')
+
+MMOL_TO_MGDL = 18.016
+
+
+def to_arrays(rows):
+    """Преобразование [(measured_at, value)] в массивы unix time и значений"""
+    timestamps = np.fromiter((measured_at.timestamp() for measured_at, _ in rows), dtype=np.float64, count=len(rows))
+    values = np.fromiter((value for _, value in rows), dtype=np.float64, count=len(rows))
+    return timestamps, values
+
+
+def grouped_percentiles(groups, values, group_count, percentiles):
+    """
+    Перцентили значений для каждой группы без цикла по группам.
+    Значения сортируются по (группа, значение), границы групп находятся через
+    bincount, перцентиль берётся линейной интерполяцией как в np.percentile.
+
+    Returns:
+        ndarray: shape (len(percentiles), group_count), NaN для пустых групп
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    result = np.full((len(percentiles), group_count), np.nan)
+    filled = counts > 0
+    for row, q in enumerate(percentiles):
+        position = starts[filled] + (counts[filled] - 1) * (q / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, starts[filled] + counts[filled] - 1)
+        fraction = position - lower
+        result[row, filled] = sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+    return result
+
+
+def ambulatory_glucose_profile(timestamps, values, utc_offset_minutes=0):
+    """Перцентили 5/25/50/75/95 по времени суток с шагом AGP_SLOT_MINUTES"""
+    slot_count = 24 * 60 // AGP_SLOT_MINUTES
+    minute_of_day = ((timestamps // 60 + utc_offset_minutes) % (24 * 60)).astype(np.int64)
+    slots = minute_of_day // AGP_SLOT_MINUTES
+    bands = grouped_percentiles(slots, values, slot_count, AGP_PERCENTILES)
+
+    profile = {'minute_of_day': list(range(0, 24 * 60, AGP_SLOT_MINUTES))}
+    for q, band in zip(AGP_PERCENTILES, bands):
+        profile[f'p{q}'] = [None if np.isnan(v) else round(float(v), 2) for v in band]
+    return profile
+
+
+def time_in_ranges(values, low, high):
+    """Доли показаний (%) в консенсусных диапазонах и в целевом диапазоне сенсора"""
+    counts = np.bincount(np.digitize(values, RANGE_BOUNDS, right=False), minlength=len(RANGE_NAMES))
+    total = len(values)
+    ranges = {name: round(float(count) * 100 / total, 1) for name, count in zip(RANGE_NAMES, counts)}
+    target = {
+        'below': round(float(np.count_nonzero(values < low)) * 100 / total, 1),
+        'in_range': round(float(np.count_nonzero((values >= low) & (values <= high))) * 100 / total, 1),
+        'above': round(float(np.count_nonzero(values > high)) * 100 / total, 1),
+    }
+    return ranges, target
+
+
+def local_extrema(values):
+    """
+    Индексы локальных экстремумов ряда (по смене знака np.diff) вместе с краями.
+    Для площадки из равных значений берётся её первый индекс.
+    """
+    diff = np.diff(values)
+    changed = np.flatnonzero(diff)
+    if not len(changed):
+        return changed
+    signs = np.sign(diff[changed])
+    turns = np.flatnonzero(signs[1:] != signs[:-1])
+    return np.concatenate(([0], changed[turns] + 1, [changed[-1] + 1]))
+
+
+def glycemic_turning_points(values, threshold):
+    """
+    Чередующиеся надиры и пики, между которыми размах больше threshold.
+    Колебания меньше threshold (шум сенсора) не разрывают подъём или спад:
+    экстремум фиксируется, только когда от него значения отошли дальше порога.
+    Экстремумы на краях периода (оборванные колебания) не учитываются.
+
+    Между соседними локальными экстремумами ряд монотонен, поэтому порог
+    проверяется только на них: цикл идёт по сокращённому ряду экстремумов.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    indices = local_extrema(values)
+    extrema = values[indices].tolist()
+    points = []
+    trend = 0
+    low = high = candidate = 0  # позиции в extrema
+    for index in range(1, len(extrema)):
+        value = extrema[index]
+        if trend == 0:
+            low = index if value < extrema[low] else low
+            high = index if value > extrema[high] else high
+            if value - extrema[low] > threshold:
+                points, trend, candidate = [low], 1, index
+            elif extrema[high] - value > threshold:
+                points, trend, candidate = [high], -1, index
+        elif trend > 0:
+            if value > extrema[candidate]:
+                candidate = index
+            elif extrema[candidate] - value > threshold:
+                points.append(candidate)
+                trend, candidate = -1, index
+        else:
+            if value < extrema[candidate]:
+                candidate = index
+            elif value - extrema[candidate] > threshold:
+                points.append(candidate)
+                trend, candidate = 1, index
+    if trend != 0:
+        points.append(candidate)
+    return [extrema[point] for point in points if 0 < indices[point] < len(values) - 1]
+
+
+def mage(values, sd):
+    """
+    Средняя амплитуда гликемических колебаний (MAGE): среднее размахов
+    надир-пик (или пик-надир), превышающих одно стандартное отклонение.
+    Учитываются колебания одного направления - направления первого из них.
+    """
+    if len(values) < 3 or sd == 0:
+        return 0.0
+    points = glycemic_turning_points(values, sd)
+    if len(points) < 2:
+        return 0.0
+    # Размахи от первой точки через одну: все подъёмы или все спады
+    excursions = np.abs(np.diff(points))[::2]
+    return round(float(excursions.mean()), 2)
+
+
+def glucose_report(timestamps, values, low, high, expected_readings=None, utc_offset_minutes=0):
+    """
+    Сводный отчёт по показаниям за период за один проход по массивам.
+
+    Args:
+        timestamps: ndarray unix time, отсортированный по возрастанию
+        values: ndarray значений глюкозы (ммоль/л)
+        low, high: Целевой диапазон сенсора
+        expected_readings: Ожидаемое число показаний за период (для полноты данных)
+        utc_offset_minutes: Смещение часового пояса пациента для AGP
+    """
+    count = len(values)
+    if count == 0:
+        return {'readings': 0}
+
+    mean = float(values.mean())
+    sd = float(values.std(ddof=1)) if count > 1 else 0.0
+    ranges, target = time_in_ranges(values, low, high)
+
+    return {
+        'readings': count,
+        'coverage': round(min(count * 100 / expected_readings, 100.0), 1) if expected_readings else None,
+        'mean': round(mean, 2),
+        'sd': round(sd, 2),
+        'cv': round(sd * 100 / mean, 1) if mean else None,
+        'gmi': round(3.31 + 0.02392 * mean * MMOL_TO_MGDL, 2),
+        'mage': mage(values, sd),
+        'min': round(float(values.min()), 2),
+        'max': round(float(values.max()), 2),
+        'time_in_ranges': ranges,
+        'time_in_target': target,
+        'agp': ambulatory_glucose_profile(timestamps, values, utc_offset_minutes),
+    }
@@ -0,0 +1,131 @@
+"""
+Сборка многочастных batch-отправок (enhanced-batch).
+
+Каждая часть расшифровывается и записывается в момент получения, в памяти
+одновременно находится только одна часть. В SensorBatchData хранится лишь
+квитанция части (batch_id, part_number, количество измерений), по которой
+определяется полнота batch. Когда получены финальная часть и все предыдущие,
+batch закрывается одним UPDATE по всем его частям.
+
+Благодаря идемпотентной записи показаний (уникальность sensor + measured_at)
+повторная отправка части не создаёт дубликатов.
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import SensorBatchData
+from .security import decrypt_batch_data
+
+logger = logging.getLogger(__name__)
+
+
+def record_part(sensor, batch_id, part_number, measurements_count, is_final):
+    """
+    Сохранение квитанции о полученной и записанной части.
+
+    Returns:
+        bool: False, если часть уже была получена ранее
+    """
+    try:
+        with transaction.atomic():
+            SensorBatchData.objects.create(
+                sensor=sensor,
+                batch_id=batch_id,
+                part_number=part_number,
+                is_final=is_final,
+                measurements_count=measurements_count,
+                is_processed=False
+            )
+    except IntegrityError:
+        logger.info(f"Duplicate part {part_number} of batch {batch_id} from {sensor.serial_number}")
+        return False
+    return True
+
+
+def next_part_number(sensor, batch_id):
+    """Номер части для клиентов, не передающих part_number (по порядку получения)"""
+    last = SensorBatchData.objects.filter(sensor=sensor, batch_id=batch_id).aggregate(
+        last=Max('part_number')
+    )['last']
+    return 0 if last is None else last + 1
+
+
+def record_next_part(sensor, batch_id, measurements_count, is_final, attempts=5):
+    """
+    Сохранение квитанции части под следующим свободным номером.
+    Одновременные запросы могут получить один номер - уникальное ограничение
+    (sensor, batch_id, part_number) отклоняет второй, и он берёт следующий.
+
+    Returns:
+        int: номер сохранённой части
+    """
+    for _ in range(attempts):
+        part_number = next_part_number(sensor, batch_id)
+        if record_part(sensor, batch_id, part_number, measurements_count, is_final):
+            return part_number
+    raise IntegrityError(f"No free part number for batch {batch_id} after {attempts} attempts")
+
+
+def batch_progress(sensor, batch_id):
+    """
+    Состояние сборки batch.
+
+    Returns:
+        tuple: (количество полученных частей, ожидаемое количество частей или None,
+                список недостающих номеров частей)
+    """
+    parts = SensorBatchData.objects.filter(
+        sensor=sensor, batch_id=batch_id
+    ).values_list('part_number', 'is_final')
+
+    received = set()
+    expected = None
+    for part_number, is_final in parts:
+        received.add(part_number)
+        if is_final:
+            expected = part_number + 1
+
+    if expected is None:
+        return len(received), None, []
+    return len(received), expected, [number for number in range(expected) if number not in received]
+
+
+def finalize_batch(sensor, batch_id):
+    """Закрытие batch одним UPDATE. Возвращает количество ещё не закрытых частей."""
+    return SensorBatchData.objects.filter(
+        sensor=sensor, batch_id=batch_id, is_processed=False
+    ).update(is_processed=True, processed_at=timezone.now())
+
+
+def iter_pending_parts(sensor):
+    """
+    Части без batch_id, ожидающие финальной отправки.
+    Части, сохранённые с зашифрованными данными, расшифровываются по одной.
+
+    Yields:
+        tuple: (id части, список измерений)
+    """
+    parts = SensorBatchData.objects.filter(
+        sensor=sensor, batch_id='', is_processed=False
+    ).order_by('created_at').only('id', 'encrypted_payload')
+
+    for part in parts.iterator(chunk_size=100):
+        if not part.encrypted_payload:
+            yield part.id, []
+            continue
+        try:
+            yield part.id, decrypt_batch_data(part.encrypted_payload, sensor.secret_key)
+        except Exception as e:
+            logger.error(f"Failed to process batch {part.id}: {str(e)}")
+
+
+def mark_parts_processed(part_ids):
+    """Отметка частей обработанными одним UPDATE"""
+    if not part_ids:
+        return 0
+    return SensorBatchData.objects.filter(id__in=part_ids).update(
+        is_processed=True, processed_at=timezone.now()
+    )
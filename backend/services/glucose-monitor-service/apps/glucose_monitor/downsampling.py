@@ -0,0 +1,86 @@
+def lttb(points, threshold):
+    """
+    Прореживание ряда алгоритмом Largest-Triangle-Three-Buckets.
+    Сохраняет визуальную форму графика (пики и провалы) при threshold точках.
+
+    Args:
+        points: Список (timestamp, value), отсортированный по времени
+        threshold: Требуемое количество точек (>= 3)
+
+    Returns:
+        list: Подмножество исходных точек
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Среднее следующей корзины - третья вершина треугольника
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_count = next_end - next_start
+        avg_t = sum(points[j][0] for j in range(next_start, next_end)) / next_count
+        avg_v = sum(points[j][1] for j in range(next_start, next_end)) / next_count
+
+        # Точка текущей корзины с наибольшей площадью треугольника
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        a_t, a_v = points[a]
+        max_area = -1.0
+        max_index = start
+        for j in range(start, end):
+            area = abs((a_t - avg_t) * (points[j][1] - a_v) - (a_t - points[j][0]) * (avg_v - a_v))
+            if area > max_area:
+                max_area = area
+                max_index = j
+
+        sampled.append(points[max_index])
+        a = max_index
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def bucket_stats(points, bucket_count, start_ts, end_ts):
+    """
+    Агрегация ряда по равным интервалам времени (min/max/mean на корзину).
+
+    Args:
+        points: Список (timestamp, value), отсортированный по времени
+        bucket_count: Количество корзин
+        start_ts, end_ts: Границы периода (unix time)
+
+    Returns:
+        list: [{'t', 'min', 'max', 'mean', 'count'}] для непустых корзин
+    """
+    if not points or bucket_count < 1:
+        return []
+
+    width = max((end_ts - start_ts) / bucket_count, 1)
+    buckets = []
+    current_index = None
+
+    for ts, value in points:
+        index = min(int((ts - start_ts) // width), bucket_count - 1)
+        if index != current_index:
+            buckets.append({
+                't': int(start_ts + index * width),
+                'min': value,
+                'max': value,
+                'sum': 0.0,
+                'count': 0,
+            })
+            current_index = index
+        bucket = buckets[-1]
+        bucket['min'] = min(bucket['min'], value)
+        bucket['max'] = max(bucket['max'], value)
+        bucket['sum'] += value
+        bucket['count'] += 1
+
+    for bucket in buckets:
+        bucket['mean'] = round(bucket.pop('sum') / bucket['count'], 2)
+    return buckets
@@ -0,0 +1,121 @@
+"""
+Обзор парка сенсоров для администраторов.
+
+Список строится одним запросом: сенсор, его настройки (LEFT JOIN) и последнее
+показание из коррелированных подзапросов к GlucoseData, каждый из которых
+читает одну строку по уникальному индексу (sensor_id, measured_at).
+Строки выбираются через values() без создания моделей.
+
+Пагинация - по ключу serial_number (уникальный индекс): следующая страница
+начинается после последнего серийного номера предыдущей, без OFFSET.
+Так же (keyset_page) постранично отдаётся и административный список сенсоров.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import GlucoseData, Sensor
+
+FLEET_FIELDS = (
+    'id', 'serial_number', 'name', 'active', 'user_id', 'sync_status', 'last_request', 'created_at',
+    'settings__battery_level', 'settings__low_glucose_threshold', 'settings__high_glucose_threshold',
+    'settings__polling_interval_minutes', 'settings__expiration_time',
+    'last_value', 'last_measured_at',
+)
+
+
+def with_latest_reading(queryset):
+    """Аннотация last_value и last_measured_at - последнее показание сенсора"""
+    latest = GlucoseData.objects.filter(
+        sensor=OuterRef('pk'), is_deleted=False, measured_at__isnull=False
+    ).order_by('-measured_at')
+    return queryset.annotate(
+        last_value=Subquery(latest.values('value')[:1]),
+        last_measured_at=Subquery(latest.values('measured_at')[:1]),
+    )
+
+
+def stale_condition(cutoff):
+    """Нет показаний или последнее показание старше cutoff"""
+    return Q(last_measured_at__isnull=True) | Q(last_measured_at__lt=cutoff)
+
+
+def fleet_overview(params, now=None):
+    """
+    Страница обзора парка сенсоров.
+
+    Args:
+        params: проверенные параметры FleetOverviewQuerySerializer
+        now: текущее время (для расчёта устаревания)
+
+    Returns:
+        tuple: (список словарей сенсоров, курсор следующей страницы или None)
+    """
+    now = now or timezone.now()
+    stale_minutes = params.get('stale_minutes') or getattr(settings, 'FLEET_STALE_MINUTES', 30)
+    cutoff = now - timedelta(minutes=stale_minutes)
+
+    queryset = with_latest_reading(Sensor.objects.filter(is_deleted=False))
+
+    if params.get('active') is not None:
+        queryset = queryset.filter(active=params['active'])
+    if params.get('serial'):
+        queryset = queryset.filter(serial_number__startswith=params['serial'])
+    if params.get('needs_sync') is not None:
+        condition = Q(sync_status='needs_sync')
+        queryset = queryset.filter(condition if params['needs_sync'] else ~condition)
+    if params.get('low_battery') is not None:
+        condition = Q(settings__battery_level__lte=getattr(settings, 'FLEET_LOW_BATTERY_LEVEL', 20))
+        queryset = queryset.filter(condition if params['low_battery'] else ~condition)
+    if params.get('stale') is not None:
+        condition = stale_condition(cutoff)
+        queryset = queryset.filter(condition if params['stale'] else ~condition)
+
+    rows, next_cursor = keyset_page(queryset.values(*FLEET_FIELDS), params.get('cursor'), params['limit'])
+    return [format_fleet_row(row, now, cutoff) for row in rows], next_cursor
+
+
+def keyset_page(queryset, cursor, limit):
+    """
+    Страница queryset по ключу serial_number.
+
+    Returns:
+        tuple: (строки страницы, курсор следующей страницы или None)
+    """
+    if cursor:
+        queryset = queryset.filter(serial_number__gt=cursor)
+    rows = list(queryset.order_by('serial_number')[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, (last['serial_number'] if isinstance(last, dict) else last.serial_number)
+
+
+def format_fleet_row(row, now, cutoff):
+    last_measured_at = row['last_measured_at']
+    return {
+        'id': str(row['id']),
+        'serial_number': row['serial_number'],
+        'name': row['name'],
+        'active': row['active'],
+        'user_id': str(row['user_id']) if row['user_id'] else None,
+        'sync_status': row['sync_status'],
+        'last_request': row['last_request'],
+        'created_at': row['created_at'],
+        'battery_level': row['settings__battery_level'],
+        'low_glucose_threshold': row['settings__low_glucose_threshold'],
+        'high_glucose_threshold': row['settings__high_glucose_threshold'],
+        'polling_interval_minutes': row['settings__polling_interval_minutes'],
+        'expiration_time': row['settings__expiration_time'],
+        'last_reading': {
+            'value': row['last_value'],
+            'measured_at': last_measured_at,
+        } if last_measured_at else None,
+        'minutes_since_last_reading': (
+            int((now - last_measured_at).total_seconds() // 60) if last_measured_at else None
+        ),
+        'stale': last_measured_at is None or last_measured_at < cutoff,
+    }
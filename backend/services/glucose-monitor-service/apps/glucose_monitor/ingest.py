@@ -0,0 +1,350 @@
+import io
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection, transaction
+from django.utils import timezone
+
+from .alerts import alert_engine
+from .live import publish_readings
+from .models import GlucoseData
+from .rollups import update_rollups
+
+logger = logging.getLogger(__name__)
+
+MIN_GLUCOSE_VALUE = 0.1
+MAX_GLUCOSE_VALUE = 33.3
+MAX_FUTURE_SKEW = 300  # секунд, допустимое опережение часов устройства
+
+STAGING_TABLE = 'glucose_ingest_staging'
+
+
+class IngestBufferFull(Exception):
+    """Буфер приёма переполнен - клиент должен повторить запрос позже"""
+
+
+class IngestFlushError(Exception):
+    """Не удалось записать показания в БД"""
+
+
+def is_transient_error(error):
+    """Ошибка соединения или блокировки, после которой запись можно повторить"""
+    return isinstance(error, (OperationalError, InterfaceError))
+
+
+def validate_measurements(items):
+    """
+    Пакетная валидация показаний без сериализатора на каждый элемент.
+
+    Args:
+        items: Список измерений в формате [{'value': float, 'timestamp': int}, ...]
+
+    Returns:
+        tuple: (список (value, timestamp), количество отклонённых)
+    """
+    readings = []
+    rejected = 0
+    max_timestamp = int(time.time()) + MAX_FUTURE_SKEW
+    for item in items:
+        try:
+            value = float(item['value'])
+            timestamp = int(item['timestamp'])
+        except (KeyError, TypeError, ValueError):
+            rejected += 1
+            continue
+        if math.isnan(value) or not MIN_GLUCOSE_VALUE <= value <= MAX_GLUCOSE_VALUE:
+            rejected += 1
+            continue
+        if not 0 < timestamp <= max_timestamp:
+            rejected += 1
+            continue
+        readings.append((value, timestamp))
+    return readings, rejected
+
+
+def validate_reading_arrays(timestamps, values):
+    """
+    Векторная валидация показаний, разобранных из двоичного формата.
+
+    Args:
+        timestamps: ndarray unix time
+        values: ndarray значений глюкозы
+
+    Returns:
+        tuple: (список (value, timestamp), количество отклонённых)
+    """
+    max_timestamp = int(time.time()) + MAX_FUTURE_SKEW
+    valid = ((values >= MIN_GLUCOSE_VALUE) & (values <= MAX_GLUCOSE_VALUE)
+             & (timestamps > 0) & (timestamps <= max_timestamp))
+    readings = list(zip(values[valid].tolist(), timestamps[valid].tolist()))
+    return readings, len(values) - len(readings)
+
+
+class IngestTicket:
+    """Подтверждение записи показаний, переданных в буфер"""
+
+    def __init__(self, count):
+        self.count = count
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout):
+        """Ожидание записи в БД. Возвращает False при истечении таймаута."""
+        if not self._done.wait(timeout):
+            return False
+        if self.error is not None:
+            raise IngestFlushError(str(self.error))
+        return True
+
+
+class IngestBuffer:
+    """
+    Ограниченный буфер показаний с отложенной записью.
+    Показания копятся в памяти процесса и записываются одной командой
+    COPY ... FROM STDIN при достижении flush_rows или раз в flush_interval секунд.
+    Запись идемпотентна: COPY идёт во временную таблицу, откуда строки переносятся
+    через INSERT ... ON CONFLICT (sensor_id, measured_at) DO NOTHING, поэтому
+    повторная отправка тех же измерений не создаёт дубликатов.
+    В той же транзакции вставленные показания добавляются в агрегаты (rollups.py),
+    после фиксации они проверяются на пороги уведомлений (alerts.py).
+    При переполнении max_rows новые показания отклоняются (backpressure).
+
+    Если общая запись не удалась из-за самих данных (нарушение ограничения,
+    недопустимое значение), показания каждого запроса записываются отдельно:
+    запрос с ошибкой отбрасывается, остальные сохраняются. При временной
+    ошибке БД запросы в режиме requeue_on_failure возвращаются в очередь,
+    но не более INGEST_MAX_ATTEMPTS раз.
+    """
+
+    def __init__(self, max_rows, flush_rows, flush_interval):
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._entries = deque()
+        self._pending_rows = 0
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def pending_rows(self):
+        return self._pending_rows
+
+    def submit(self, sensor, readings, requeue_on_failure=False):
+        """
+        Постановка показаний сенсора в очередь на запись.
+        При requeue_on_failure показания возвращаются в очередь, если запись не удалась.
+
+        Raises:
+            IngestBufferFull: если буфер заполнен
+        """
+        ticket = IngestTicket(len(readings))
+        if not readings:
+            ticket.resolve()
+            return ticket
+
+        received_at = timezone.now()
+        rows = [
+            (uuid.uuid4(), sensor.pk, value, datetime.fromtimestamp(timestamp, tz=dt_timezone.utc), received_at)
+            for value, timestamp in readings
+        ]
+
+        with self._condition:
+            if self._pending_rows + len(rows) > self.max_rows:
+                raise IngestBufferFull(f"Ingest buffer is full ({self._pending_rows} rows pending)")
+            self._entries.append((rows, ticket, requeue_on_failure, 0))
+            self._pending_rows += len(rows)
+            if self._pending_rows >= self.flush_rows:
+                self._condition.notify()
+
+        self._ensure_started()
+        return ticket
+
+    def flush(self):
+        """Запись всех накопленных показаний. Возвращает количество вставленных строк."""
+        with self._flush_lock:
+            with self._condition:
+                entries = list(self._entries)
+                self._entries.clear()
+                self._pending_rows = 0
+
+            if not entries:
+                return 0
+
+            rows = [row for entry_rows, _, _, _ in entries for row in entry_rows]
+            try:
+                inserted = self._commit(rows)
+            except Exception as e:
+                logger.error(f"Ingest flush of {len(rows)} rows failed: {str(e)}")
+                if is_transient_error(e):
+                    self._fail(entries, e)
+                    raise
+                inserted = self._flush_separately(entries)
+            else:
+                for _, ticket, _, _ in entries:
+                    ticket.resolve()
+
+            try:
+                alert_engine.evaluate(inserted)
+            except Exception as e:
+                logger.error(f"Glucose alert evaluation failed: {str(e)}")
+
+            try:
+                publish_readings(inserted)
+            except Exception as e:
+                logger.warning(f"Live glucose publish failed: {str(e)}")
+
+            logger.debug(f"Flushed {len(rows)} glucose readings from {len(entries)} requests, "
+                         f"{len(rows) - len(inserted)} duplicates skipped")
+            return len(inserted)
+
+    def _commit(self, rows):
+        with transaction.atomic():
+            inserted = self._write(rows)
+            if getattr(settings, 'GLUCOSE_ROLLUPS_ON_INGEST', True):
+                update_rollups(inserted)
+        return inserted
+
+    def _flush_separately(self, entries):
+        """Запись показаний каждого запроса отдельной транзакцией; запросы с ошибкой в данных отбрасываются"""
+        inserted = []
+        for index, (rows, ticket, _, _) in enumerate(entries):
+            try:
+                inserted.extend(self._commit(rows))
+            except Exception as e:
+                if is_transient_error(e):
+                    self._fail(entries[index:], e)
+                    break
+                logger.error(f"Dropping {len(rows)} readings of sensor {rows[0][1]}: {str(e)}")
+                ticket.resolve(e)
+            else:
+                ticket.resolve()
+        return inserted
+
+    def _fail(self, entries, error):
+        max_attempts = getattr(settings, 'INGEST_MAX_ATTEMPTS', 5)
+        retry = []
+        for rows, ticket, requeue, attempts in entries:
+            if requeue and attempts + 1 < max_attempts:
+                retry.append((rows, ticket, requeue, attempts + 1))
+                continue
+            if requeue:
+                logger.error(f"Dropping {len(rows)} readings of sensor {rows[0][1]} "
+                             f"after {attempts + 1} failed flushes")
+            ticket.resolve(error)
+        with self._condition:
+            self._entries.extendleft(reversed(retry))
+            self._pending_rows += sum(len(entry[0]) for entry in retry)
+
+    def _write(self, rows):
+        """
+        Запись строк с пропуском уже сохранённых измерений.
+        Возвращает вставленные показания: [(sensor_id, measured_at, value)].
+        """
+        if connection.vendor != 'postgresql':
+            existing = set(GlucoseData.objects.filter(
+                sensor_id__in={row[1] for row in rows},
+                measured_at__in={row[3] for row in rows}
+            ).values_list('sensor_id', 'measured_at'))
+            new_rows = {}
+            for row_id, sensor_id, value, measured_at, created_at in rows:
+                if (sensor_id, measured_at) not in existing:
+                    new_rows.setdefault((sensor_id, measured_at), (row_id, value, created_at))
+            GlucoseData.objects.bulk_create([
+                GlucoseData(id=row_id, sensor_id=sensor_id, value=value,
+                            measured_at=measured_at, created_at=created_at)
+                for (sensor_id, measured_at), (row_id, value, created_at) in new_rows.items()
+            ], batch_size=1000)
+            return [(sensor_id, measured_at, value)
+                    for (sensor_id, measured_at), (_, value, _) in new_rows.items()]
+
+        stream = io.StringIO()
+        for row_id, sensor_id, value, measured_at, created_at in rows:
+            stream.write(f"{row_id}\t{sensor_id}\t{value!r}\t{measured_at.isoformat()}\t"
+                         f"{created_at.isoformat()}\tf\n")
+        stream.seek(0)
+
+        opts = GlucoseData._meta
+        columns = ', '.join(
+            opts.get_field(name).column
+            for name in ('id', 'sensor', 'value', 'measured_at', 'created_at', 'is_deleted')
+        )
+        conflict_columns = ', '.join(opts.get_field(name).column for name in ('sensor', 'measured_at'))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+                f"(LIKE {opts.db_table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+            cursor.copy_expert(f"COPY {STAGING_TABLE} ({columns}) FROM STDIN", stream)
+            cursor.execute(
+                f"INSERT INTO {opts.db_table} ({columns}) "
+                f"SELECT {columns} FROM {STAGING_TABLE} "
+                f"ON CONFLICT ({conflict_columns}) DO NOTHING "
+                f"RETURNING {conflict_columns}, {opts.get_field('value').column}"
+            )
+            return cursor.fetchall()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='glucose-ingest-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while self._pending_rows < self.flush_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                # Соединение пересоздаётся; пауза, чтобы не нагружать недоступную БД
+                connection.close()
+                time.sleep(self.flush_interval)
+
+
+ingest_buffer = IngestBuffer(
+    max_rows=getattr(settings, 'INGEST_BUFFER_MAX_ROWS', 50000),
+    flush_rows=getattr(settings, 'INGEST_FLUSH_ROWS', 2000),
+    flush_interval=getattr(settings, 'INGEST_FLUSH_INTERVAL', 0.5),
+)
+
+
+def store_readings(sensor, readings):
+    """
+    Передача проверенных показаний в буфер приёма.
+
+    В режиме INGEST_ACK_MODE='flush' ожидает записи в БД (групповой коммит),
+    в режиме 'buffered' возвращается сразу после постановки в очередь.
+
+    Returns:
+        bool: True, если показания уже записаны в БД
+
+    Raises:
+        IngestBufferFull: буфер переполнен
+        IngestFlushError: запись завершилась ошибкой или не уложилась в таймаут
+    """
+    wait_for_flush = getattr(settings, 'INGEST_ACK_MODE', 'flush') == 'flush'
+    ticket = ingest_buffer.submit(sensor, readings, requeue_on_failure=not wait_for_flush)
+    if not wait_for_flush:
+        return False
+    if not ticket.wait(getattr(settings, 'INGEST_ACK_TIMEOUT', 10)):
+        raise IngestFlushError("Timed out waiting for readings to be stored")
+    return True
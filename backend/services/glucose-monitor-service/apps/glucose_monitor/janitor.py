@@ -0,0 +1,143 @@
+"""
+Очистка служебных таблиц безопасности (janitor).
+
+Истёкшие nonce, обработанные и брошенные части batch удаляются не одним
+DELETE на всю таблицу, а порциями по первичному ключу: каждая порция -
+отдельная короткая транзакция, которая не держит блокировки и не раздувает
+WAL. Между порциями выполняется пауза, чтобы не конкурировать с приёмом
+показаний, а весь проход ограничен бюджетом времени - незавершённая задача
+продолжится при следующем запуске.
+
+После массового удаления на PostgreSQL выполняется VACUUM (ANALYZE) таблицы,
+чтобы освободившееся место переиспользовалось, а статистика планировщика
+соответствовала новому размеру таблицы.
+
+Запуск: management-команда run_security_janitor (однократно или --continuous).
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import SensorBatchData, SensorNonceTracking
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def cleanup_tasks(now=None):
+    """
+    Задачи очистки.
+
+    Returns:
+        list: [(имя задачи, queryset удаляемых записей)]
+    """
+    now = now or timezone.now()
+    return [
+        ('nonces', SensorNonceTracking.objects.filter(expires_at__lt=now)),
+        ('batches', SensorBatchData.objects.filter(
+            is_processed=True,
+            processed_at__lt=now - timedelta(hours=_setting('JANITOR_BATCH_RETENTION_HOURS', 24))
+        )),
+        ('stale_parts', SensorBatchData.objects.filter(
+            is_processed=False,
+            created_at__lt=now - timedelta(hours=_setting('JANITOR_STALE_PART_HOURS', 168))
+        )),
+    ]
+
+
+def delete_in_chunks(queryset, chunk_size, deadline=None, pause=0.0):
+    """
+    Удаление записей queryset порциями в порядке первичного ключа.
+
+    Args:
+        queryset: удаляемые записи
+        chunk_size: размер порции
+        deadline: момент time.monotonic(), после которого новые порции не начинаются
+        pause: пауза между порциями в секундах
+
+    Returns:
+        tuple: (количество удалённых записей, удалено ли всё)
+    """
+    model = queryset.model
+    deleted = 0
+    last_pk = None
+
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            return deleted, False
+
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return deleted, True
+
+        deleted += model.objects.filter(pk__in=pks).delete()[0]
+        last_pk = pks[-1]
+
+        if len(pks) < chunk_size:
+            return deleted, True
+        if pause:
+            time.sleep(pause)
+
+
+def vacuum_table(model):
+    """VACUUM (ANALYZE) таблицы модели (только PostgreSQL, вне транзакции)"""
+    if connection.vendor != 'postgresql' or connection.in_atomic_block:
+        return False
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"VACUUM (ANALYZE) {table}")
+    return True
+
+
+def run_janitor(chunk_size=None, time_budget=None, pause=None, vacuum=True):
+    """
+    Один проход очистки по всем задачам в пределах бюджета времени.
+
+    Returns:
+        dict: {имя задачи: {'deleted', 'seconds', 'rows_per_sec', 'complete'}}
+    """
+    chunk_size = chunk_size or _setting('JANITOR_CHUNK_SIZE', 5000)
+    time_budget = time_budget if time_budget is not None else _setting('JANITOR_TIME_BUDGET', 60)
+    pause = pause if pause is not None else _setting('JANITOR_CHUNK_PAUSE', 0.1)
+    vacuum_threshold = _setting('JANITOR_VACUUM_THRESHOLD', 10000)
+
+    deadline = time.monotonic() + time_budget if time_budget else None
+    deleted_by_table = {}
+    stats = {}
+
+    for name, queryset in cleanup_tasks():
+        started = time.monotonic()
+        deleted, complete = delete_in_chunks(queryset, chunk_size, deadline, pause)
+        seconds = time.monotonic() - started
+        stats[name] = {
+            'deleted': deleted,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': round(deleted / seconds, 1) if seconds > 0 else 0.0,
+            'complete': complete,
+        }
+        deleted_by_table[queryset.model] = deleted_by_table.get(queryset.model, 0) + deleted
+        logger.info(
+            f"Janitor {name}: deleted {deleted} rows in {seconds:.2f}s "
+            f"({stats[name]['rows_per_sec']} rows/s){'' if complete else ', budget exhausted'}"
+        )
+
+    if vacuum:
+        for model, deleted in deleted_by_table.items():
+            if deleted >= vacuum_threshold:
+                try:
+                    if vacuum_table(model):
+                        logger.info(f"Vacuumed {model._meta.db_table} after deleting {deleted} rows")
+                except Exception as e:
+                    logger.warning(f"Failed to vacuum {model._meta.db_table}: {str(e)}")
+
+    return stats
@@ -0,0 +1,373 @@
+"""
+Поток показаний в реальном времени (Server-Sent Events).
+
+Приём показаний после коммита публикует новые показания и уведомления в
+канал Redis сенсора (glucose:live:<sensor_id>) - одна команда PUBLISH на
+сенсор за сброс буфера, через pipeline. Поэтому показание видно подписчикам
+любого процесса сервиса, а не только того, который его принял.
+
+В каждом процессе (event loop) работает один LiveHub: одно соединение
+Redis pub/sub на все SSE-подключения процесса. Hub подписывается на канал
+сенсора при первом подписчике и отписывается при уходе последнего, а каждое
+сообщение декодируется один раз и раскладывается по ограниченным очередям
+подписчиков. Медленный клиент теряет самые старые события, но не задерживает
+остальных.
+
+Без Redis (REDIS_URL не задан) сообщения передаются в hub текущего процесса
+напрямую - этого достаточно для разработки с одним процессом.
+
+Поток открывается с access-токеном в заголовке Authorization или, для
+EventSource в браузере (заголовки задать нельзя), с одноразовым билетом
+?ticket=, который выдаётся по access-токену на LIVE_TICKET_TTL секунд -
+сам токен в адрес запроса (и журналы прокси) не попадает.
+
+Доступ к сенсору (владелец, врач, доверенное лицо) проверяется при
+подключении, кэшируется и перепроверяется каждые LIVE_PERMISSION_TTL секунд
+в течение соединения: отзыв доступа закрывает поток.
+"""
+import asyncio
+import json
+import logging
+import secrets
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User
+from .permissions import can_view_sensor
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'glucose:live:'
+ACCESS_KEY = 'glucose:live_access:{}:{}'
+TICKET_KEY = 'glucose:live_ticket:{}'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def channel_name(sensor_id):
+    return f"{CHANNEL_PREFIX}{sensor_id}"
+
+
+def encode_message(event, data):
+    return json.dumps({'event': event, 'data': data}, cls=DjangoJSONEncoder)
+
+
+def format_event(event, data):
+    """Кадр SSE; data - уже сериализованный JSON"""
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+# Публикация (синхронная сторона: поток записи буфера, поток уведомлений)
+
+_redis_client = None
+_redis_lock = threading.Lock()
+
+
+def get_publish_client():
+    """Синхронный клиент Redis для PUBLISH или None, если Redis не настроен"""
+    global _redis_client
+    url = _setting('LIVE_REDIS_URL', None)
+    if not url:
+        return None
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                import redis
+                _redis_client = redis.Redis.from_url(url)
+    return _redis_client
+
+
+def publish_messages(messages):
+    """
+    Публикация сообщений [(sensor_id, event, data)] одной пачкой.
+    Ошибки Redis не должны влиять на приём показаний - вызывающий код их логирует.
+    """
+    if not messages or not _setting('GLUCOSE_LIVE_ENABLED', True):
+        return 0
+
+    encoded = [(channel_name(sensor_id), encode_message(event, data)) for sensor_id, event, data in messages]
+    client = get_publish_client()
+    if client is None:
+        for channel, message in encoded:
+            dispatch_local(channel, message)
+        return len(encoded)
+
+    pipe = client.pipeline(transaction=False)
+    for channel, message in encoded:
+        pipe.publish(channel, message)
+    pipe.execute()
+    return len(encoded)
+
+
+def publish_readings(inserted):
+    """
+    Публикация вставленных показаний [(sensor_id, measured_at, value)].
+    Выгрузка накопленной истории (показания старше LIVE_MAX_READING_AGE)
+    в поток не попадает; показания сенсора отправляются одним сообщением.
+    """
+    if not inserted:
+        return 0
+    cutoff = time.time() - _setting('LIVE_MAX_READING_AGE', 900)
+    by_sensor = defaultdict(list)
+    for sensor_id, measured_at, value in inserted:
+        if measured_at.timestamp() >= cutoff:
+            by_sensor[sensor_id].append((measured_at, value))
+
+    messages = []
+    for sensor_id, points in by_sensor.items():
+        points.sort()
+        messages.append((sensor_id, 'readings', {
+            'sensor_id': str(sensor_id),
+            'readings': [{'value': value, 'measured_at': measured_at} for measured_at, value in points],
+        }))
+    return publish_messages(messages)
+
+
+def publish_alert(sensor_id, alert):
+    return publish_messages([(sensor_id, 'alert', {'sensor_id': str(sensor_id), **alert})])
+
+
+# Раздача подписчикам (асинхронная сторона: SSE-подключения)
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    """Hub текущего event loop"""
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = LiveHub(loop)
+    return hub
+
+
+def dispatch_local(channel, message):
+    """Передача сообщения в hub всех event loop процесса (режим без Redis)"""
+    for loop, hub in list(_hubs.items()):
+        if loop.is_closed():
+            continue
+        try:
+            loop.call_soon_threadsafe(hub.dispatch, channel, message)
+        except RuntimeError:
+            pass  # loop закрылся между проверкой и вызовом
+
+
+class LiveHub:
+    """Одно соединение pub/sub на event loop; раздача сообщений очередям подписчиков"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.subscribers = defaultdict(set)
+        self._redis = None
+        self._pubsub = None
+        self._reader = None
+
+    @property
+    def uses_redis(self):
+        return bool(_setting('LIVE_REDIS_URL', None))
+
+    async def subscribe(self, sensor_id):
+        queue = asyncio.Queue(maxsize=_setting('LIVE_QUEUE_SIZE', 100))
+        channel = channel_name(sensor_id)
+        first = not self.subscribers[channel]
+        self.subscribers[channel].add(queue)
+
+        if first and self.uses_redis:
+            try:
+                pubsub = await self._get_pubsub()
+                await pubsub.subscribe(channel)
+            except Exception as e:
+                logger.warning(f"Live stream subscribe to {channel} failed: {str(e)}")
+                self._reset_pubsub()
+            self._ensure_reader()
+        return queue
+
+    async def unsubscribe(self, sensor_id, queue):
+        channel = channel_name(sensor_id)
+        queues = self.subscribers.get(channel)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if queues:
+            return
+
+        del self.subscribers[channel]
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.unsubscribe(channel)
+            except Exception as e:
+                logger.warning(f"Live stream unsubscribe from {channel} failed: {str(e)}")
+
+    def dispatch(self, channel, message):
+        queues = self.subscribers.get(channel)
+        if not queues:
+            return
+        try:
+            payload = json.loads(message)
+            item = (payload['event'], json.dumps(payload['data']))
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Malformed live message on {channel}")
+            return
+
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()  # медленный клиент теряет самое старое событие
+            queue.put_nowait(item)
+
+    async def _get_pubsub(self):
+        if self._pubsub is None:
+            import redis.asyncio as aioredis
+            self._redis = aioredis.Redis.from_url(_setting('LIVE_REDIS_URL', None))
+            self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        return self._pubsub
+
+    def _reset_pubsub(self):
+        pubsub, client = self._pubsub, self._redis
+        self._pubsub = self._redis = None
+        for resource in (pubsub, client):
+            if resource is not None:
+                self.loop.create_task(self._close_quietly(resource))
+
+    @staticmethod
+    async def _close_quietly(resource):
+        try:
+            await resource.aclose() if hasattr(resource, 'aclose') else await resource.close()
+        except Exception:
+            pass
+
+    def _ensure_reader(self):
+        if self._reader is None or self._reader.done():
+            self._reader = self.loop.create_task(self._read())
+
+    async def _read(self):
+        """Чтение сообщений pub/sub, пока у hub есть подписчики; переподключение при ошибках"""
+        while self.subscribers:
+            try:
+                pubsub = await self._get_pubsub()
+                if not pubsub.subscribed:
+                    await pubsub.subscribe(*self.subscribers.keys())
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Live stream pub/sub error, reconnecting: {str(e)}")
+                self._reset_pubsub()
+                await asyncio.sleep(_setting('LIVE_RECONNECT_DELAY', 1.0))
+                continue
+
+            if message and message.get('type') == 'message':
+                channel = message['channel']
+                data = message['data']
+                self.dispatch(
+                    channel.decode() if isinstance(channel, bytes) else channel,
+                    data.decode() if isinstance(data, bytes) else data,
+                )
+
+
+# Аутентификация и права доступа
+
+def issue_stream_ticket(user, sensor):
+    """Одноразовый билет на открытие потока сенсора, действует LIVE_TICKET_TTL секунд"""
+    ticket = secrets.token_urlsafe(32)
+    cache.set(TICKET_KEY.format(ticket), (user.id, sensor.id), _setting('LIVE_TICKET_TTL', 30))
+    return ticket
+
+
+def get_stream_user(request, sensor_id):
+    """
+    Пользователь по access-токену из заголовка Authorization или по билету
+    из параметра ticket, выданному на этот сенсор.
+
+    Returns:
+        tuple: (user или None, текст ошибки или None)
+    """
+    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+    ticket = request.GET.get('ticket')
+    if auth_header.startswith('Bearer '):
+        try:
+            # Проверяет подпись, срок действия и тип токена (refresh-токен не принимается)
+            user_id = AccessToken(auth_header.split(' ', 1)[1])[jwt_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            return None, 'Invalid token'
+    elif ticket:
+        key = TICKET_KEY.format(ticket)
+        entry = cache.get(key)
+        # Билет одноразовый: использовать его может только тот, кто удалил ключ
+        if entry is None or not cache.delete(key):
+            return None, 'Invalid ticket'
+        user_id, ticket_sensor_id = entry
+        if str(ticket_sensor_id) != str(sensor_id):
+            return None, 'Invalid ticket'
+    else:
+        return None, 'Authentication credentials were not provided'
+
+    user = User.objects.filter(id=user_id, is_deleted=False, is_active=True).first()
+    if user is None:
+        return None, 'Invalid token'
+    return user, None
+
+
+def has_stream_access(user, sensor, use_cache=True):
+    """Проверка доступа с кэшированием результата на LIVE_PERMISSION_TTL секунд"""
+    key = ACCESS_KEY.format(user.id, sensor.id)
+    if use_cache:
+        allowed = cache.get(key)
+        if allowed is not None:
+            return allowed
+    allowed = can_view_sensor(user, sensor)
+    cache.set(key, allowed, _setting('LIVE_PERMISSION_TTL', 60))
+    return allowed
+
+
+async def event_stream(user, sensor, snapshot=None):
+    """
+    Асинхронный генератор кадров SSE для одного подключения.
+
+    Поток завершается через LIVE_MAX_STREAM_SECONDS (клиент EventSource
+    переподключается сам) или при отзыве доступа.
+    """
+    from asgiref.sync import sync_to_async
+
+    hub = get_hub()
+    loop = asyncio.get_running_loop()
+    heartbeat = _setting('LIVE_HEARTBEAT_SECONDS', 15)
+    recheck = _setting('LIVE_PERMISSION_TTL', 60)
+    deadline = loop.time() + _setting('LIVE_MAX_STREAM_SECONDS', 600)
+    next_check = loop.time() + recheck
+    check_access = sync_to_async(has_stream_access)
+
+    queue = await hub.subscribe(sensor.id)
+    try:
+        yield f"retry: {_setting('LIVE_RETRY_MS', 3000)}\n\n"
+        if snapshot is not None:
+            yield format_event('snapshot', json.dumps(snapshot, cls=DjangoJSONEncoder))
+
+        while True:
+            now = loop.time()
+            if now >= deadline:
+                return
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=min(heartbeat, deadline - now))
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+            else:
+                yield format_event(event, data)
+
+            if loop.time() >= next_check:
+                if not await check_access(user, sensor):
+                    yield format_event('revoked', json.dumps({'sensor_id': str(sensor.id)}))
+                    return
+                next_check = loop.time() + recheck
+    finally:
+        await hub.unsubscribe(sensor.id, queue)
@@ -0,0 +1,64 @@
+import binascii
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from apps.glucose_monitor.models import Sensor, SensorSettings, User
+
+
+class Command(BaseCommand):
+    help = 'Create sensors for load testing and write their credentials for glucose_fleet_simulator.py'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            required=True,
+            help='Number of sensors to create',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='LOAD',
+            help='Serial number prefix (default: LOAD)',
+        )
+        parser.add_argument(
+            '--user',
+            help='Email of the user owning the sensors (default: no owner)',
+        )
+        parser.add_argument(
+            '--output',
+            default='fleet.json',
+            help='File to write serial numbers and secret keys to',
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f"User {options['user']} not found")
+
+        existing = Sensor.objects.filter(serial_number__startswith=f"{options['prefix']}-").count()
+        sensors = [
+            Sensor(
+                serial_number=f"{options['prefix']}-{existing + index:08d}",
+                secret_key=binascii.hexlify(os.urandom(32)).decode('utf-8'),
+                user=user,
+                name='Load test sensor',
+            )
+            for index in range(options['count'])
+        ]
+
+        with transaction.atomic():
+            Sensor.objects.bulk_create(sensors, batch_size=1000)
+            SensorSettings.objects.bulk_create(
+                [SensorSettings(sensor=sensor) for sensor in sensors], batch_size=1000
+            )
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump([
+                {'serial_number': sensor.serial_number, 'secret_key': sensor.secret_key}
+                for sensor in sensors
+            ], f, indent=2)
+
+        self.stdout.write(f"Created {len(sensors)} sensors, credentials written to {options['output']}")
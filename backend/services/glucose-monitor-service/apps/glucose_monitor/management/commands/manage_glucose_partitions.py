@@ -0,0 +1,74 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from apps.glucose_monitor import partitions
+
+
+class Command(BaseCommand):
+    help = 'Create future monthly glucose data partitions and detach expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert',
+            action='store_true',
+            help='Convert the existing glucose data table into a partitioned table (one-time)',
+        )
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help='Number of future monthly partitions to keep created',
+        )
+        parser.add_argument(
+            '--retention-months',
+            type=int,
+            default=None,
+            help='Detach partitions older than this number of months',
+        )
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Drop expired partitions instead of moving them to the archive schema',
+        )
+        parser.add_argument(
+            '--continuous',
+            action='store_true',
+            help='Run continuously, checking partitions once a day',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+
+        if options['convert']:
+            if partitions.is_partitioned():
+                self.stdout.write('Glucose data table is already partitioned')
+            else:
+                moved = partitions.convert_to_partitioned(options['months_ahead'])
+                self.stdout.write(f'Converted glucose data table, moved {moved} rows')
+        elif not partitions.is_partitioned():
+            raise CommandError('Glucose data table is not partitioned, run with --convert first')
+
+        if options['continuous']:
+            self.stdout.write('Starting continuous partition maintenance...')
+            try:
+                while True:
+                    self.run_maintenance(options)
+                    connection.close()
+                    time.sleep(86400)
+            except KeyboardInterrupt:
+                self.stdout.write('Stopping partition maintenance...')
+        else:
+            self.run_maintenance(options)
+
+    def run_maintenance(self, options):
+        created = partitions.ensure_partitions(options['months_ahead'])
+        self.stdout.write(f'Created {len(created)} partitions')
+
+        if options['retention_months'] is not None:
+            detached = partitions.detach_expired_partitions(
+                options['retention_months'],
+                archive=not options['drop']
+            )
+            action = 'Dropped' if options['drop'] else 'Archived'
+            self.stdout.write(f'{action} {len(detached)} partitions: {", ".join(detached) or "-"}')
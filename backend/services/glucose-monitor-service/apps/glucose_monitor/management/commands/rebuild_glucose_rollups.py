@@ -0,0 +1,47 @@
+from datetime import datetime, timezone as dt_timezone
+from django.core.management.base import BaseCommand, CommandError
+from apps.glucose_monitor.models import Sensor
+from apps.glucose_monitor.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild glucose rollups (5m/1h/1d) for a date range from raw readings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start',
+            required=True,
+            help='First day to rebuild (YYYY-MM-DD, UTC)',
+        )
+        parser.add_argument(
+            '--end',
+            required=True,
+            help='Last day to rebuild, inclusive (YYYY-MM-DD, UTC)',
+        )
+        parser.add_argument(
+            '--sensor',
+            action='append',
+            default=[],
+            help='Serial number of a sensor to rebuild (can be repeated, default: all sensors)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.strptime(options['start'], '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+            end = datetime.strptime(options['end'], '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if end < start:
+            raise CommandError('--end must not be earlier than --start')
+
+        sensor_ids = None
+        if options['sensor']:
+            sensor_ids = list(Sensor.objects.filter(
+                serial_number__in=options['sensor']
+            ).values_list('id', flat=True))
+            if len(sensor_ids) != len(set(options['sensor'])):
+                raise CommandError('Some sensors were not found')
+
+        self.stdout.write(f'Rebuilding rollups from {start:%Y-%m-%d} to {end:%Y-%m-%d}...')
+        created = rebuild_rollups(start, end.replace(hour=23, minute=59, second=59), sensor_ids)
+        self.stdout.write(f'Created {created} rollup rows')
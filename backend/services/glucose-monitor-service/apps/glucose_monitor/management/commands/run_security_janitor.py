@@ -0,0 +1,73 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from apps.glucose_monitor.janitor import run_janitor
+
+
+class Command(BaseCommand):
+    help = 'Delete expired nonces and old batch records in chunks within a time budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Rows deleted per transaction (default: JANITOR_CHUNK_SIZE)',
+        )
+        parser.add_argument(
+            '--time-budget',
+            type=float,
+            default=None,
+            help='Seconds per cleanup pass, 0 for unlimited (default: JANITOR_TIME_BUDGET)',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=None,
+            help='Seconds to sleep between chunks (default: JANITOR_CHUNK_PAUSE)',
+        )
+        parser.add_argument(
+            '--no-vacuum',
+            action='store_true',
+            help='Do not run VACUUM (ANALYZE) on tables after large deletes',
+        )
+        parser.add_argument(
+            '--continuous',
+            action='store_true',
+            help='Run continuously, repeating the cleanup every --interval seconds',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=None,
+            help='Seconds between cleanup passes in continuous mode (default: JANITOR_INTERVAL)',
+        )
+
+    def handle(self, *args, **options):
+        if options['continuous']:
+            interval = options['interval'] or getattr(settings, 'JANITOR_INTERVAL', 300)
+            self.stdout.write('Starting continuous security data cleanup...')
+            try:
+                while True:
+                    self.run_cleanup(options)
+                    connection.close()
+                    time.sleep(interval)
+            except KeyboardInterrupt:
+                self.stdout.write('Stopping security data cleanup...')
+        else:
+            self.run_cleanup(options)
+
+    def run_cleanup(self, options):
+        stats = run_janitor(
+            chunk_size=options['chunk_size'],
+            time_budget=options['time_budget'],
+            pause=options['pause'],
+            vacuum=not options['no_vacuum'],
+        )
+        for name, task in stats.items():
+            status = '' if task['complete'] else ' (time budget exhausted)'
+            self.stdout.write(
+                f"{name}: deleted {task['deleted']} rows in {task['seconds']}s, "
+                f"{task['rows_per_sec']} rows/s{status}"
+            )
@@ -69,6 +69,10 @@ class Sensor(models.Model):
         ('needs_sync', 'Needs Sync'),
         ('syncing', 'Syncing'),
     ]
+    SIGNATURE_VERSION_CHOICES = [
+        (1, 'v1 (canonical JSON)'),
+        (2, 'v2 (raw body)'),
+    ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     serial_number = models.CharField(max_length=255, unique=True)
@@ -94,6 +98,10 @@ class Sensor(models.Model):
     last_sync_timestamp = models.BigIntegerField(default=0, help_text="Последняя синхронизация времени с устройством")
     device_clock_offset = models.IntegerField(default=0, help_text="Смещение часов устройства (секунды)")
     sync_status = models.CharField(max_length=20, choices=SYNC_STATUS_CHOICES, default='synchronized')
+    signature_version = models.PositiveSmallIntegerField(
+        choices=SIGNATURE_VERSION_CHOICES, default=1,
+        help_text="Схема подписи запросов: 1 - принимаются v1 и v2, 2 - только v2 (подпись сырого тела)"
+    )
     
     claim_token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     claim_used_at = models.DateTimeField(null=True, blank=True)
@@ -125,17 +133,59 @@ class GlucoseData(models.Model):
             MaxValueValidator(33.3)
         ]
     )
+    measured_at = models.DateTimeField(null=True, blank=True, help_text="Время измерения по часам устройства")
     created_at = models.DateTimeField(auto_now_add=True)
     is_deleted = models.BooleanField(default=False)
 
     class Meta:
         db_table = 'main_app_sensordata'  # Исправлено название таблицы
-        ordering = ['-created_at']
+        # Таблица секционирована по measured_at (см. partitions.py)
+        ordering = ['-measured_at']
+        constraints = [
+            # Повторная отправка того же измерения не создаёт дубликат
+            models.UniqueConstraint(fields=['sensor', 'measured_at'], name='uniq_sensordata_sensor_measured_at'),
+        ]
 
     def __str__(self):
         return f"{self.sensor.serial_number} - {self.value} mmol/L at {self.created_at}"
 
 
+class GlucoseRollup(models.Model):
+    """Агрегаты показаний сенсора за интервал времени (5 минут, час, сутки)"""
+    RESOLUTION_CHOICES = [
+        ('5m', '5 minutes'),
+        ('1h', '1 hour'),
+        ('1d', '1 day'),
+    ]
+    RESOLUTION_SECONDS = {'5m': 300, '1h': 3600, '1d': 86400}
+
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='rollups')
+    resolution = models.CharField(max_length=2, choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    sum_value = models.FloatField(default=0)
+    sum_squares = models.FloatField(default=0)
+    below_range_count = models.IntegerField(default=0, help_text="Показаний ниже low_glucose_threshold")
+    in_range_count = models.IntegerField(default=0)
+    above_range_count = models.IntegerField(default=0, help_text="Показаний выше high_glucose_threshold")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'main_app_glucose_rollup'
+        constraints = [
+            models.UniqueConstraint(fields=['sensor', 'resolution', 'bucket_start'], name='uniq_glucose_rollup_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.sensor_id} {self.resolution} {self.bucket_start}: {self.count} readings"
+
+    @property
+    def mean(self):
+        return self.sum_value / self.count if self.count else None
+
+
 class SensorSettings(models.Model):
     POLLING_MINUTE_CHOICES = [(i, f"{i} min") for i in range(1, 31)]
 
@@ -175,17 +225,26 @@ class SensorNonceTracking(models.Model):
         return f"Nonce {self.nonce_value} for {self.sensor.serial_number}"
 
     @classmethod
-    def cleanup_expired(cls):
-        """Удаление истёкших nonce"""
+    def cleanup_expired(cls, chunk_size=5000, time_budget=None):
+        """Удаление истёкших nonce порциями по первичному ключу"""
+        import time
         from django.utils import timezone
-        return cls.objects.filter(expires_at__lt=timezone.now()).delete()
+        from .janitor import delete_in_chunks
+        deadline = time.monotonic() + time_budget if time_budget else None
+        return delete_in_chunks(cls.objects.filter(expires_at__lt=timezone.now()), chunk_size, deadline)
 
 
 class SensorBatchData(models.Model):
     """Хранение накопленных данных для batch-обработки"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='batch_data')
-    encrypted_payload = models.TextField(help_text="Зашифрованные данные измерений")
+    encrypted_payload = models.TextField(
+        blank=True, default="",
+        help_text="Зашифрованные данные измерений (пусто, если часть уже записана при получении)"
+    )
+    batch_id = models.CharField(max_length=64, blank=True, default="", help_text="Идентификатор многочастного batch")
+    part_number = models.PositiveIntegerField(default=0, help_text="Порядковый номер части в batch")
+    is_final = models.BooleanField(default=False, help_text="Последняя часть batch")
     measurements_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
@@ -195,6 +254,14 @@ class SensorBatchData(models.Model):
         db_table = 'main_app_sensor_batch_data'
         indexes = [
             models.Index(fields=['sensor', 'is_processed', 'created_at']),
+            models.Index(fields=['sensor', 'batch_id']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sensor', 'batch_id', 'part_number'],
+                condition=~models.Q(batch_id=''),
+                name='uniq_sensor_batch_part'
+            ),
         ]
 
     def __str__(self):
@@ -207,3 +274,29 @@ class SensorBatchData(models.Model):
         self.is_processed = True
         self.processed_at = timezone.now()
         self.save()
+
+
+class DoctorPatient(models.Model):
+    """Связь врач - пациент (доступ врача к данным сенсоров пациента)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='patients')
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='doctors')
+    created_at = models.DateTimeField(auto_now_add=True)
+    is_deleted = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'main_app_doctorpatient'
+        managed = False  # This table is managed by another service
+
+
+class TrustedUser(models.Model):
+    """Доверенное лицо пациента (доступ к данным сенсоров пациента)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    trusted = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trusted_patients')
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trusted_persons')
+    created_at = models.DateTimeField(auto_now_add=True)
+    is_deleted = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'main_app_trusteduser'
+        managed = False  # This table is managed by another service
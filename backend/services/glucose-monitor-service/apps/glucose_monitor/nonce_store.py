@@ -0,0 +1,285 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseNonceStore:
+    """
+    Хранение использованных nonce в таблице SensorNonceTracking.
+    Используется как долговременный резерв, если общий кэш недоступен.
+    """
+    name = 'database'
+
+    def check_and_set(self, sensor, window_start, nonce):
+        from .models import SensorNonceTracking
+
+        expires_at = timezone.now() + timezone.timedelta(minutes=10)
+        try:
+            # unique_together (sensor, nonce_value) делает INSERT атомарной проверкой
+            with transaction.atomic():
+                SensorNonceTracking.objects.create(
+                    sensor=sensor,
+                    nonce_value=nonce,
+                    expires_at=expires_at
+                )
+        except IntegrityError:
+            return False
+        return True
+
+    def advance_window(self, sensor, old_window_start, new_window_start):
+        from .models import SensorNonceTracking
+
+        SensorNonceTracking.objects.filter(
+            sensor=sensor,
+            nonce_value__lt=new_window_start
+        ).delete()
+
+    def count_used(self, sensor, window_start):
+        from .models import SensorNonceTracking
+
+        return SensorNonceTracking.objects.filter(
+            sensor=sensor,
+            expires_at__gt=timezone.now()
+        ).count()
+
+    def recent_nonces(self, seconds):
+        """Nonce, принятые за последние seconds секунд: [(sensor_id, window_start, window_size, nonce)]"""
+        from .models import SensorNonceTracking
+
+        return list(SensorNonceTracking.objects.filter(
+            used_at__gte=timezone.now() - timezone.timedelta(seconds=seconds)
+        ).values_list('sensor_id', 'sensor__nonce_window_start', 'sensor__nonce_window_size', 'nonce_value'))
+
+
+class RedisNonceBitmap:
+    """
+    Окно nonce сенсора как битовая карта в Redis.
+    SETBIT атомарно возвращает предыдущее значение бита, поэтому проверка
+    и отметка nonce выполняются за одну команду без блокировок в БД.
+    """
+    name = 'redis'
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+
+    def _key(self, sensor, window_start):
+        return f"glucose:nonce:{sensor.id}:{window_start}"
+
+    def check_and_set(self, sensor, window_start, nonce):
+        key = self._key(sensor, window_start)
+        pipe = self.client.pipeline()
+        pipe.setbit(key, nonce - window_start, 1)
+        pipe.expire(key, self.ttl)
+        previous, _ = pipe.execute()
+        return previous == 0
+
+    def advance_window(self, sensor, old_window_start, new_window_start):
+        if old_window_start != new_window_start:
+            self.client.delete(self._key(sensor, old_window_start))
+
+    def count_used(self, sensor, window_start):
+        return self.client.bitcount(self._key(sensor, window_start))
+
+    def mark_used(self, entries):
+        """Отметка nonce [(sensor_id, window_start, window_size, nonce)] текущих окон сенсоров"""
+        pipe = self.client.pipeline()
+        pipe.ping()  # проверка доступности и при пустом списке
+        for sensor_id, window_start, window_size, nonce in entries:
+            if window_start <= nonce < window_start + window_size:
+                key = f"glucose:nonce:{sensor_id}:{window_start}"
+                pipe.setbit(key, nonce - window_start, 1)
+                pipe.expire(key, self.ttl)
+        pipe.execute()
+
+
+class LocalNonceBitmap:
+    """
+    Битовая карта окна nonce в памяти процесса.
+    Применяется, когда кэш не Redis (например, LocMemCache в разработке);
+    защита действует только в пределах одного процесса.
+    """
+    name = 'local'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        expired = [key for key, (_, expires) in self._windows.items() if expires < now]
+        for key in expired:
+            del self._windows[key]
+
+    def check_and_set(self, sensor, window_start, nonce):
+        offset = nonce - window_start
+        byte_index, mask = offset >> 3, 1 << (offset & 7)
+        key = (str(sensor.id), window_start)
+        now = time.monotonic()
+
+        with self._lock:
+            self._prune(now)
+            bitmap, _ = self._windows.get(key, (None, None))
+            if bitmap is None:
+                bitmap = bytearray((sensor.nonce_window_size + 7) // 8)
+            if byte_index >= len(bitmap):
+                bitmap.extend(bytes(byte_index + 1 - len(bitmap)))
+            self._windows[key] = (bitmap, now + self.ttl)
+
+            if bitmap[byte_index] & mask:
+                return False
+            bitmap[byte_index] |= mask
+            return True
+
+    def advance_window(self, sensor, old_window_start, new_window_start):
+        if old_window_start != new_window_start:
+            with self._lock:
+                self._windows.pop((str(sensor.id), old_window_start), None)
+
+    def count_used(self, sensor, window_start):
+        with self._lock:
+            bitmap, _ = self._windows.get((str(sensor.id), window_start), (b'', None))
+            return sum(bin(byte).count('1') for byte in bitmap)
+
+    def mark_used(self, entries):
+        """Отметка nonce [(sensor_id, window_start, window_size, nonce)] текущих окон сенсоров"""
+        now = time.monotonic()
+        with self._lock:
+            for sensor_id, window_start, window_size, nonce in entries:
+                if not window_start <= nonce < window_start + window_size:
+                    continue
+                offset = nonce - window_start
+                key = (str(sensor_id), window_start)
+                bitmap, _ = self._windows.get(key, (None, None))
+                if bitmap is None:
+                    bitmap = bytearray((window_size + 7) // 8)
+                if offset >> 3 >= len(bitmap):
+                    bitmap.extend(bytes((offset >> 3) + 1 - len(bitmap)))
+                bitmap[offset >> 3] |= 1 << (offset & 7)
+                self._windows[key] = (bitmap, now + self.ttl)
+
+
+class FallbackNonceStore:
+    """
+    Основное хранилище с переключением на резервное при ошибках.
+
+    Хранилища не разделяют состояние. Резервное не знает nonce, принятых
+    основным до сбоя, поэтому в течение replay_horizon секунд после сбоя
+    (пока временная метка уже принятого запроса ещё проходит проверку) nonce
+    в окнах, открытых до сбоя, отклоняются; окна, открытые во время сбоя,
+    резервное хранилище проверяет полностью. Перед возвратом к основному
+    хранилищу в него переносятся nonce, принятые резервным за последние
+    replay_horizon секунд; попытки возврата - не чаще раза в RECOVERY_INTERVAL секунд.
+    """
+    RECOVERY_INTERVAL = 5
+
+    def __init__(self, primary, fallback, replay_horizon):
+        self.primary = primary
+        self.fallback = fallback
+        self.replay_horizon = replay_horizon
+        self.name = f"{primary.name}+{fallback.name}"
+        self._lock = threading.Lock()
+        self._failed_at = None  # time.monotonic() первого сбоя
+        self._retry_at = 0
+        self._fallback_windows = set()  # (sensor_id, window_start), открытые во время сбоя
+
+    def _call(self, method, *args):
+        if self._failed_at is None or self._recover():
+            try:
+                return getattr(self.primary, method)(*args)
+            except Exception as e:
+                logger.error(f"Nonce store '{self.primary.name}' failed on {method}, "
+                             f"using '{self.fallback.name}': {str(e)}")
+                with self._lock:
+                    if self._failed_at is None:
+                        self._failed_at = time.monotonic()
+                        self._fallback_windows = set()
+                    self._retry_at = time.monotonic() + self.RECOVERY_INTERVAL
+        return getattr(self, f"_fallback_{method}")(*args)
+
+    def _recover(self):
+        """Перенос nonce, принятых резервным хранилищем, в основное; False, если основное ещё недоступно"""
+        if time.monotonic() < self._retry_at:
+            return False
+        self._retry_at = time.monotonic() + self.RECOVERY_INTERVAL
+        try:
+            self.primary.mark_used(self.fallback.recent_nonces(self.replay_horizon))
+        except Exception as e:
+            logger.debug(f"Nonce store '{self.primary.name}' is still unavailable: {str(e)}")
+            return False
+        with self._lock:
+            self._failed_at = None
+            self._fallback_windows = set()
+        logger.info(f"Nonce store '{self.primary.name}' recovered")
+        return True
+
+    def _fallback_check_and_set(self, sensor, window_start, nonce):
+        with self._lock:
+            unproven = ((str(sensor.id), window_start) not in self._fallback_windows
+                        and self._failed_at is not None
+                        and time.monotonic() - self._failed_at < self.replay_horizon)
+        if unproven:
+            # Nonce мог быть принят основным хранилищем до сбоя
+            logger.warning(f"Nonce {nonce} of sensor {sensor.id} rejected: "
+                           f"window {window_start} was opened in '{self.primary.name}'")
+            return False
+        return self.fallback.check_and_set(sensor, window_start, nonce)
+
+    def _fallback_advance_window(self, sensor, old_window_start, new_window_start):
+        self.fallback.advance_window(sensor, old_window_start, new_window_start)
+        with self._lock:
+            self._fallback_windows.add((str(sensor.id), new_window_start))
+
+    def _fallback_count_used(self, sensor, window_start):
+        return self.fallback.count_used(sensor, window_start)
+
+    def check_and_set(self, sensor, window_start, nonce):
+        return self._call('check_and_set', sensor, window_start, nonce)
+
+    def advance_window(self, sensor, old_window_start, new_window_start):
+        return self._call('advance_window', sensor, old_window_start, new_window_start)
+
+    def count_used(self, sensor, window_start):
+        return self._call('count_used', sensor, window_start)
+
+
+def _build_cache_store(ttl):
+    try:
+        from django_redis import get_redis_connection
+        return RedisNonceBitmap(get_redis_connection('default'), ttl)
+    except (ImportError, NotImplementedError):
+        logger.warning("Redis cache is not configured, nonce bitmap is process-local")
+        return LocalNonceBitmap(ttl)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_nonce_store():
+    """
+    Возвращает хранилище nonce, выбранное настройкой NONCE_BACKEND:
+    - 'cache': битовая карта в Redis (или в памяти процесса без Redis),
+      с таблицей SensorNonceTracking как резервом при NONCE_DB_FALLBACK
+    - 'database': только таблица SensorNonceTracking
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = getattr(settings, 'NONCE_BACKEND', 'cache')
+                if backend == 'database':
+                    _store = DatabaseNonceStore()
+                else:
+                    store = _build_cache_store(getattr(settings, 'NONCE_BITMAP_TTL', 86400))
+                    if getattr(settings, 'NONCE_DB_FALLBACK', True):
+                        store = FallbackNonceStore(store, DatabaseNonceStore(),
+                                                   getattr(settings, 'NONCE_REPLAY_HORIZON', 600))
+                    _store = store
+    return _store
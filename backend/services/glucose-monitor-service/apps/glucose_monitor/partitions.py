@@ -0,0 +1,230 @@
+"""
+Помесячное секционирование таблицы показаний (PostgreSQL RANGE partitioning).
+
+Таблица main_app_sensordata секционируется по measured_at. Первичный ключ
+секционированной таблицы - (id, measured_at), уникальное ограничение
+(sensor_id, measured_at) одновременно служит индексом для выборок по сенсору
+за период, которые затрагивают одну-две секции. Удаление старых данных
+выполняется отсоединением секции (DETACH PARTITION), а не DELETE.
+
+Показания вне созданных периодов попадают в секцию по умолчанию. Новая секция
+создаётся отдельной таблицей, в неё переносятся подходящие строки из секции
+по умолчанию, после чего она присоединяется (ATTACH PARTITION) - иначе
+CREATE TABLE ... PARTITION OF завершился бы ошибкой, если в секции по
+умолчанию уже есть строки этого периода.
+"""
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+from .models import GlucoseData
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = 'glucose_archive'
+
+
+def _table():
+    return GlucoseData._meta.db_table
+
+
+def default_partition_name():
+    return f"{_table()}_default"
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    month_index = value.year * 12 + value.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(start):
+    return f"{_table()}_{start:%Y_%m}"
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace",
+            [_table()]
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions():
+    """Список секций: [(имя, начало периода)] в порядке возрастания"""
+    prefix = f"{_table()}_"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s AND p.relnamespace = 'public'::regnamespace",
+            [_table()]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        try:
+            start = datetime.strptime(name[len(prefix):], '%Y_%m').replace(tzinfo=dt_timezone.utc)
+        except ValueError:
+            continue  # секция по умолчанию
+        partitions.append((name, start))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def _table_exists(name):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [f"public.{name}"])
+        return cursor.fetchone()[0]
+
+
+@transaction.atomic
+def create_partition(start):
+    """
+    Создание секции на месяц, начинающийся в start (если её ещё нет).
+    Строки этого месяца из секции по умолчанию переносятся в новую секцию.
+    """
+    table = _table()
+    name = partition_name(start)
+    end = add_months(start, 1)
+    if _table_exists(name):
+        return name
+
+    default = default_partition_name()
+    bounds = f"measured_at >= '{start.isoformat()}' AND measured_at < '{end.isoformat()}'"
+    columns = ', '.join(field.column for field in GlucoseData._meta.concrete_fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+        # Ограничение по границам периода избавляет ATTACH от проверки строк новой секции
+        cursor.execute(f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds CHECK ({bounds})")
+        if _table_exists(default):
+            cursor.execute(f"LOCK TABLE {default} IN ACCESS EXCLUSIVE MODE")
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {default} WHERE {bounds} RETURNING {columns}) "
+                f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved"
+            )
+            if cursor.rowcount:
+                logger.warning(f"Moved {cursor.rowcount} rows from {default} to {name}")
+        cursor.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+        cursor.execute(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds")
+    return name
+
+
+def ensure_partitions(months_ahead=3, now=None):
+    """
+    Создание секций на текущий месяц и months_ahead месяцев вперёд.
+    Непустая секция по умолчанию означает, что секции создаются с опозданием
+    (или пришли показания из далёкого прошлого/будущего) - об этом пишется ошибка в лог.
+    """
+    current = month_start(now or datetime.now(dt_timezone.utc))
+    existing = {name for name, _ in list_partitions()}
+    created = []
+    for offset in range(months_ahead + 1):
+        start = add_months(current, offset)
+        if partition_name(start) not in existing:
+            created.append(create_partition(start))
+            logger.info(f"Created partition {created[-1]}")
+
+    default = default_partition_name()
+    if _table_exists(default):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN(measured_at), MAX(measured_at) FROM {default}")
+            oldest, newest = cursor.fetchone()
+        if oldest is not None:
+            logger.error(f"Default partition {default} contains readings from {oldest} to {newest}")
+    return created
+
+
+@transaction.atomic
+def detach_expired_partitions(retention_months, archive=True, now=None):
+    """
+    Отсоединение секций старше retention_months месяцев.
+    При archive=True секция переносится в схему ARCHIVE_SCHEMA, иначе удаляется.
+    """
+    cutoff = add_months(month_start(now or datetime.now(dt_timezone.utc)), -retention_months)
+    detached = []
+
+    with connection.cursor() as cursor:
+        if archive:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+
+        for name, start in list_partitions():
+            if add_months(start, 1) > cutoff:
+                continue
+            cursor.execute(f"ALTER TABLE {_table()} DETACH PARTITION {name}")
+            if archive:
+                cursor.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+            else:
+                cursor.execute(f"DROP TABLE {name}")
+            detached.append(name)
+            logger.info(f"Partition {name} {'archived' if archive else 'dropped'}")
+
+    return detached
+
+
+@transaction.atomic
+def convert_to_partitioned(months_ahead=3):
+    """
+    Однократное преобразование обычной таблицы показаний в секционированную.
+    Строки без measured_at получают значение created_at.
+    """
+    table = _table()
+    legacy = f"{table}_legacy"
+    opts = GlucoseData._meta
+    sensor_column = opts.get_field('sensor').column
+    sensor_table = opts.get_field('sensor').related_model._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        # Освобождаем имена ограничений для новой таблицы
+        cursor.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+        cursor.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT IF EXISTS uniq_sensordata_sensor_measured_at")
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE (measured_at)"
+        )
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN measured_at SET NOT NULL")
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, measured_at)")
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT uniq_sensordata_sensor_measured_at "
+            f"UNIQUE ({sensor_column}, measured_at)"
+        )
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_sensor_fk "
+            f"FOREIGN KEY ({sensor_column}) REFERENCES {sensor_table} (id) DEFERRABLE INITIALLY DEFERRED"
+        )
+        # Секция по умолчанию принимает показания вне созданных периодов
+        cursor.execute(f"CREATE TABLE {default_partition_name()} PARTITION OF {table} DEFAULT")
+
+        cursor.execute(f"SELECT MIN(COALESCE(measured_at, created_at)) FROM {legacy}")
+        oldest = cursor.fetchone()[0]
+
+    current = month_start(datetime.now(dt_timezone.utc))
+    start = month_start(oldest) if oldest else current
+    while start <= add_months(current, months_ahead):
+        create_partition(start)
+        start = add_months(start, 1)
+
+    with connection.cursor() as cursor:
+        columns = ', '.join(field.column for field in opts.concrete_fields if field.column != 'measured_at')
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}, measured_at) "
+            f"SELECT {columns}, COALESCE(measured_at, created_at) FROM {legacy} "
+            f"ON CONFLICT DO NOTHING"
+        )
+        moved = cursor.rowcount
+        cursor.execute(f"DROP TABLE {legacy}")
+
+    logger.info(f"Converted {table} to monthly partitions, {moved} rows moved")
+    return moved
@@ -0,0 +1,154 @@
+"""
+Форматы полезной нагрузки batch-отправок.
+
+'json' - исходный формат: JSON {'salt', 'measurements': [{'value', 'timestamp'}], 'count'}.
+'binary-v1' - компактный формат (все поля little-endian):
+
+    заголовок (16 байт): magic b'GLB', версия (uint8), count (uint32), base_timestamp (uint64)
+    записи (по 6 байт): ts_delta (uint32, секунды от base_timestamp),
+                        value (uint16, сотые доли ммоль/л)
+
+Формат передаётся в поле payload_format запроса; шифрование AES-GCM одинаково для обоих.
+Двоичные записи разбираются без копирования через numpy.frombuffer.
+
+Перед шифрованием данные могут быть сжаты (поле compression: 'none' или 'zlib').
+Размер пакета ограничен BATCH_MAX_MEASUREMENTS измерений и BATCH_MAX_PAYLOAD_BYTES
+байт открытого текста; распаковка прерывается при превышении лимита. Лимиты
+сообщаются устройству в ответе sync и в ответе 413.
+"""
+import base64
+import math
+import struct
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from .ingest import validate_measurements, validate_reading_arrays
+from .security import decrypt_payload, parse_batch_json
+
+PAYLOAD_JSON = 'json'
+PAYLOAD_BINARY_V1 = 'binary-v1'
+PAYLOAD_FORMATS = (PAYLOAD_JSON, PAYLOAD_BINARY_V1)
+
+BINARY_MAGIC = b'GLB'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<3sBIQ')
+BINARY_RECORD = np.dtype([('ts_delta', '<u4'), ('value', '<u2')])
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_ZLIB)
+
+# nonce AES-GCM (12) + tag (16)
+ENCRYPTION_OVERHEAD = 28
+
+
+class PayloadTooLarge(ValueError):
+    """Пакет превышает лимиты сервера"""
+
+
+def batch_limits():
+    """Лимиты размера batch-отправки, сообщаемые устройству"""
+    return {
+        'max_measurements': settings.BATCH_MAX_MEASUREMENTS,
+        'max_payload_bytes': settings.BATCH_MAX_PAYLOAD_BYTES,
+    }
+
+
+def max_encrypted_length():
+    """Максимальная длина base64-строки зашифрованных данных при лимите BATCH_MAX_PAYLOAD_BYTES"""
+    return math.ceil((settings.BATCH_MAX_PAYLOAD_BYTES + ENCRYPTION_OVERHEAD) / 3) * 4
+
+
+def decompress_payload(data, compression, max_size):
+    """
+    Распаковка расшифрованных данных с ограничением размера результата.
+
+    Raises:
+        PayloadTooLarge: результат превышает max_size
+        ValueError: повреждённые или неполные сжатые данные
+    """
+    if compression == COMPRESSION_NONE:
+        if len(data) > max_size:
+            raise PayloadTooLarge(f"Payload exceeds {max_size} bytes")
+        return data
+
+    try:
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, max_size + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid compressed payload: {e}")
+    if len(result) > max_size or decompressor.unconsumed_tail:
+        raise PayloadTooLarge(f"Payload exceeds {max_size} bytes")
+    if not decompressor.eof:
+        raise ValueError("Truncated compressed payload")
+    return result
+
+
+def encode_binary_batch(timestamps, values):
+    """Упаковка показаний в формат binary-v1"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    base = int(timestamps.min()) if len(timestamps) else 0
+    records = np.empty(len(timestamps), dtype=BINARY_RECORD)
+    records['ts_delta'] = timestamps - base
+    records['value'] = np.rint(np.asarray(values, dtype=np.float64) * 100)
+    return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(records), base) + records.tobytes()
+
+
+def decode_binary_batch(data, max_count=None):
+    """
+    Разбор формата binary-v1.
+
+    Returns:
+        tuple: (ndarray unix time int64, ndarray значений float64)
+
+    Raises:
+        ValueError: неверный заголовок или длина данных
+        PayloadTooLarge: количество измерений больше max_count
+    """
+    view = memoryview(data)
+    if len(view) < BINARY_HEADER.size:
+        raise ValueError("Binary payload is too short")
+
+    magic, version, count, base = BINARY_HEADER.unpack_from(view)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Invalid binary payload magic")
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary payload version: {version}")
+    if max_count is not None and count > max_count:
+        raise PayloadTooLarge(f"Batch exceeds {max_count} measurements")
+    if len(view) != BINARY_HEADER.size + count * BINARY_RECORD.itemsize:
+        raise ValueError("Measurement count mismatch")
+
+    records = np.frombuffer(view, dtype=BINARY_RECORD, count=count, offset=BINARY_HEADER.size)
+    timestamps = records['ts_delta'].astype(np.int64) + base
+    values = records['value'] / 100.0
+    return timestamps, values
+
+
+def decrypt_readings(encrypted_data_b64, key, payload_format=PAYLOAD_JSON, compression=COMPRESSION_NONE):
+    """
+    Дешифрование, распаковка и валидация показаний batch-отправки в любом поддерживаемом формате.
+
+    Returns:
+        tuple: (список (value, timestamp), всего измерений, количество отклонённых)
+
+    Raises:
+        PayloadTooLarge: пакет превышает лимиты сервера
+    """
+    limits = batch_limits()
+    plaintext = decompress_payload(
+        decrypt_payload(base64.b64decode(encrypted_data_b64), key), compression, limits['max_payload_bytes']
+    )
+
+    if payload_format == PAYLOAD_BINARY_V1:
+        timestamps, values = decode_binary_batch(plaintext, limits['max_measurements'])
+        readings, rejected = validate_reading_arrays(timestamps, values)
+        return readings, len(values), rejected
+
+    measurements = parse_batch_json(plaintext)
+    if len(measurements) > limits['max_measurements']:
+        raise PayloadTooLarge(f"Batch exceeds {limits['max_measurements']} measurements")
+    readings, rejected = validate_measurements(measurements)
+    return readings, len(measurements), rejected
@@ -0,0 +1,13 @@
+"""Доступ пользователей к данным сенсоров"""
+from .models import DoctorPatient, TrustedUser
+
+
+def can_view_sensor(user, sensor):
+    """Владелец сенсора, его врач или доверенное лицо"""
+    if sensor.user_id is None:
+        return False
+    if sensor.user_id == user.id:
+        return True
+    if DoctorPatient.objects.filter(doctor=user, patient_id=sensor.user_id, is_deleted=False).exists():
+        return True
+    return TrustedUser.objects.filter(trusted=user, patient_id=sensor.user_id, is_deleted=False).exists()
@@ -0,0 +1,244 @@
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least
+
+from .models import GlucoseData, GlucoseRollup, SensorSettings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOW_THRESHOLD = 3.9
+DEFAULT_HIGH_THRESHOLD = 7.8
+
+# Порядок полей в накопителе: count, min, max, sum, sum_squares, below, in_range, above
+STAT_FIELDS = [
+    'count', 'min_value', 'max_value', 'sum_value', 'sum_squares',
+    'below_range_count', 'in_range_count', 'above_range_count',
+]
+
+
+def bucket_floor(measured_at, seconds):
+    epoch = int(measured_at.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=dt_timezone.utc)
+
+
+def get_thresholds(sensor_ids):
+    """Пороги гипо-/гипергликемии сенсоров: {sensor_id: (low, high)}"""
+    return {
+        sensor_id: (low, high)
+        for sensor_id, low, high in SensorSettings.objects.filter(sensor_id__in=sensor_ids).values_list(
+            'sensor_id', 'low_glucose_threshold', 'high_glucose_threshold'
+        )
+    }
+
+
+def accumulate(readings, thresholds, increments=None):
+    """
+    Накопление приращений агрегатов по всем разрешениям.
+
+    Args:
+        readings: Итерируемое (sensor_id, measured_at, value)
+        thresholds: {sensor_id: (low, high)}
+        increments: Существующий накопитель для дополнения
+
+    Returns:
+        dict: {(sensor_id, resolution, bucket_start): [count, min, max, sum, sum_squares, below, in, above]}
+    """
+    increments = {} if increments is None else increments
+    for sensor_id, measured_at, value in readings:
+        low, high = thresholds.get(sensor_id, (DEFAULT_LOW_THRESHOLD, DEFAULT_HIGH_THRESHOLD))
+        range_index = 5 if value < low else 7 if value > high else 6
+
+        for resolution, seconds in GlucoseRollup.RESOLUTION_SECONDS.items():
+            key = (sensor_id, resolution, bucket_floor(measured_at, seconds))
+            stats = increments.get(key)
+            if stats is None:
+                stats = increments[key] = [0, value, value, 0.0, 0.0, 0, 0, 0]
+            stats[0] += 1
+            if value < stats[1]:
+                stats[1] = value
+            if value > stats[2]:
+                stats[2] = value
+            stats[3] += value
+            stats[4] += value * value
+            stats[range_index] += 1
+    return increments
+
+
+def apply_increments(increments):
+    """Добавление приращений к таблице агрегатов (upsert с суммированием)"""
+    if not increments:
+        return 0
+
+    table = GlucoseRollup._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        from psycopg2.extras import execute_values
+
+        now = datetime.now(dt_timezone.utc)
+        rows = [(sensor_id, resolution, bucket_start, *stats, now)
+                for (sensor_id, resolution, bucket_start), stats in increments.items()]
+        columns = ', '.join(['sensor_id', 'resolution', 'bucket_start', *STAT_FIELDS, 'updated_at'])
+        with connection.cursor() as cursor:
+            execute_values(
+                cursor.cursor,
+                f"INSERT INTO {table} AS r ({columns}) VALUES %s "
+                f"ON CONFLICT (sensor_id, resolution, bucket_start) DO UPDATE SET "
+                f"count = r.count + EXCLUDED.count, "
+                f"min_value = LEAST(r.min_value, EXCLUDED.min_value), "
+                f"max_value = GREATEST(r.max_value, EXCLUDED.max_value), "
+                f"sum_value = r.sum_value + EXCLUDED.sum_value, "
+                f"sum_squares = r.sum_squares + EXCLUDED.sum_squares, "
+                f"below_range_count = r.below_range_count + EXCLUDED.below_range_count, "
+                f"in_range_count = r.in_range_count + EXCLUDED.in_range_count, "
+                f"above_range_count = r.above_range_count + EXCLUDED.above_range_count, "
+                f"updated_at = EXCLUDED.updated_at",
+                rows,
+                page_size=1000
+            )
+        return len(rows)
+
+    for (sensor_id, resolution, bucket_start), stats in increments.items():
+        updated = GlucoseRollup.objects.filter(
+            sensor_id=sensor_id, resolution=resolution, bucket_start=bucket_start
+        ).update(
+            count=F('count') + stats[0],
+            min_value=Least('min_value', Value(stats[1])),
+            max_value=Greatest('max_value', Value(stats[2])),
+            sum_value=F('sum_value') + stats[3],
+            sum_squares=F('sum_squares') + stats[4],
+            below_range_count=F('below_range_count') + stats[5],
+            in_range_count=F('in_range_count') + stats[6],
+            above_range_count=F('above_range_count') + stats[7],
+        )
+        if not updated:
+            GlucoseRollup.objects.create(
+                sensor_id=sensor_id, resolution=resolution, bucket_start=bucket_start,
+                **dict(zip(STAT_FIELDS, stats))
+            )
+    return len(increments)
+
+
+def update_rollups(readings):
+    """Обновление агрегатов по только что вставленным показаниям"""
+    if not readings:
+        return 0
+    thresholds = get_thresholds({sensor_id for sensor_id, _, _ in readings})
+    return apply_increments(accumulate(readings, thresholds))
+
+
+def rebuild_rollups(start, end, sensor_ids=None):
+    """
+    Пересчёт агрегатов за период (границы выравниваются по суткам UTC).
+    Используется для учёта поздно поступивших данных и после смены порогов.
+
+    Период пересчитывается по суткам, каждые сутки - отдельной короткой
+    транзакцией (rebuild_day), чтобы приём показаний ждал не весь пересчёт,
+    а только текущие сутки.
+
+    Returns:
+        int: Количество созданных строк агрегатов
+    """
+    start = bucket_floor(start, 86400)
+    end = bucket_floor(end - timedelta(microseconds=1), 86400) + timedelta(days=1)
+
+    created = 0
+    day = start
+    while day < end:
+        created += rebuild_day(day, sensor_ids)
+        day += timedelta(days=1)
+    return created
+
+
+@transaction.atomic
+def rebuild_day(day, sensor_ids=None):
+    """
+    Пересчёт агрегатов одних суток UTC, начинающихся в day.
+
+    В PostgreSQL таблица агрегатов блокируется в режиме SHARE ROW EXCLUSIVE
+    до конца транзакции: пересчёт дожидается транзакций приёма, уже обновивших
+    агрегаты, а новые приращения применяются после его фиксации - поэтому
+    показания не учитываются дважды и не теряются. Строки пересчёта
+    записываются через ON CONFLICT DO UPDATE с заменой значений.
+
+    Returns:
+        int: Количество созданных строк агрегатов
+    """
+    end = day + timedelta(days=1)
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {GlucoseRollup._meta.db_table} IN SHARE ROW EXCLUSIVE MODE")
+
+    existing = GlucoseRollup.objects.filter(bucket_start__gte=day, bucket_start__lt=end)
+    if sensor_ids:
+        existing = existing.filter(sensor_id__in=sensor_ids)
+    existing.delete()
+
+    if connection.vendor == 'postgresql':
+        return _rebuild_sql(day, end, sensor_ids)
+
+    readings = GlucoseData.objects.filter(measured_at__gte=day, measured_at__lt=end, is_deleted=False)
+    if sensor_ids:
+        readings = readings.filter(sensor_id__in=sensor_ids)
+    return update_rollups(list(readings.values_list('sensor_id', 'measured_at', 'value')))
+
+
+def _rebuild_sql(start, end, sensor_ids):
+    data_table = GlucoseData._meta.db_table
+    settings_table = SensorSettings._meta.db_table
+    columns = ', '.join(['sensor_id', 'resolution', 'bucket_start', *STAT_FIELDS, 'updated_at'])
+    replace = ', '.join(f"{field} = EXCLUDED.{field}" for field in [*STAT_FIELDS, 'updated_at'])
+    sensor_filter = "AND d.sensor_id = ANY(%s::uuid[])" if sensor_ids else ""
+
+    created = 0
+    with connection.cursor() as cursor:
+        for resolution, seconds in GlucoseRollup.RESOLUTION_SECONDS.items():
+            params = [resolution, seconds, seconds, start, end]
+            if sensor_ids:
+                params.append([str(sensor_id) for sensor_id in sensor_ids])
+            cursor.execute(
+                f"INSERT INTO {GlucoseRollup._meta.db_table} ({columns}) "
+                f"SELECT d.sensor_id, %s, "
+                f"to_timestamp(floor(extract(epoch FROM d.measured_at) / %s) * %s) AS bucket, "
+                f"count(*), min(d.value), max(d.value), sum(d.value), sum(d.value * d.value), "
+                f"count(*) FILTER (WHERE d.value < COALESCE(s.low_glucose_threshold, {DEFAULT_LOW_THRESHOLD})), "
+                f"count(*) FILTER (WHERE d.value >= COALESCE(s.low_glucose_threshold, {DEFAULT_LOW_THRESHOLD}) "
+                f"AND d.value <= COALESCE(s.high_glucose_threshold, {DEFAULT_HIGH_THRESHOLD})), "
+                f"count(*) FILTER (WHERE d.value > COALESCE(s.high_glucose_threshold, {DEFAULT_HIGH_THRESHOLD})), "
+                f"now() "
+                f"FROM {data_table} d LEFT JOIN {settings_table} s ON s.sensor_id = d.sensor_id "
+                f"WHERE d.measured_at >= %s AND d.measured_at < %s AND NOT d.is_deleted {sensor_filter} "
+                f"GROUP BY d.sensor_id, bucket "
+                f"ON CONFLICT (sensor_id, resolution, bucket_start) DO UPDATE SET "
+                f"{replace}",
+                params
+            )
+            created += cursor.rowcount
+    return created
+
+
+def merge_rollups(rollups, bucket_count, start_ts, end_ts):
+    """
+    Объединение строк агрегатов в bucket_count равных интервалов периода
+    (тот же формат, что и downsampling.bucket_stats).
+    """
+    width = max((end_ts - start_ts) / bucket_count, 1)
+    buckets = {}
+    for bucket_start, count, min_value, max_value, sum_value in rollups:
+        index = min(max(int((bucket_start.timestamp() - start_ts) // width), 0), bucket_count - 1)
+        bucket = buckets.get(index)
+        if bucket is None:
+            buckets[index] = {'t': int(start_ts + index * width), 'min': min_value, 'max': max_value,
+                              'sum': sum_value, 'count': count}
+            continue
+        bucket['min'] = min(bucket['min'], min_value)
+        bucket['max'] = max(bucket['max'], max_value)
+        bucket['sum'] += sum_value
+        bucket['count'] += count
+
+    result = [buckets[index] for index in sorted(buckets)]
+    for bucket in result:
+        bucket['mean'] = round(bucket.pop('sum') / bucket['count'], 2)
+    return result
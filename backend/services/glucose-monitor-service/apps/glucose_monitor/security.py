@@ -10,7 +10,6 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.exceptions import InvalidTag
 from django.core.cache import cache
 from django.utils import timezone
-from django.db import transaction
 
 
 def generate_hmac_signature(data, key):
@@ -39,6 +38,67 @@ def verify_signature(data, signature, key):
     return hmac.compare_digest(signature, expected_signature)
 
 
+# Подпись v2: HMAC-SHA512 над сырым телом запроса, параметры передаются в заголовках
+SIGNATURE_V1 = 1
+SIGNATURE_V2 = 2
+SIGNATURE_HEADER = 'HTTP_X_SENSOR_SIGNATURE'
+NONCE_HEADER = 'HTTP_X_SENSOR_NONCE'
+TIMESTAMP_HEADER = 'HTTP_X_SENSOR_TIMESTAMP'
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+class SignedBodyTooLarge(Exception):
+    """Тело подписанного запроса превышает допустимый размер"""
+
+
+def signature_v2_prefix(method, path, nonce, timestamp):
+    """Заголовок подписываемого сообщения v2, за ним следуют байты тела"""
+    return f"v2\n{method.upper()}\n{path}\n{nonce}\n{timestamp}\n".encode('utf-8')
+
+
+def signature_v2_mac(key, method, path, nonce, timestamp):
+    """HMAC-SHA512 подписи v2, инициализированный заголовком сообщения"""
+    return hmac.new(bytes.fromhex(key), signature_v2_prefix(method, path, nonce, timestamp), hashlib.sha512)
+
+
+def read_signed_body(stream, mac, max_size, chunk_size=BODY_CHUNK_SIZE):
+    """
+    Чтение тела запроса по частям с одновременным обновлением HMAC.
+
+    Args:
+        stream: Поток тела запроса (или None для пустого тела)
+        mac: Объект hmac, инициализированный заголовком подписываемого сообщения
+        max_size: Максимальный размер тела в байтах
+
+    Returns:
+        tuple: (тело запроса, HMAC digest)
+
+    Raises:
+        SignedBodyTooLarge: тело больше max_size
+    """
+    chunks = []
+    size = 0
+    while stream is not None:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise SignedBodyTooLarge(f"Request body exceeds {max_size} bytes")
+        mac.update(chunk)
+        chunks.append(chunk)
+    return b''.join(chunks), mac.digest()
+
+
+def verify_digest(signature, expected_signature):
+    """Сравнение base64-подписи с вычисленным digest за постоянное время"""
+    try:
+        signature = base64.b64decode(signature, validate=True)
+    except Exception:
+        return False
+    return hmac.compare_digest(signature, expected_signature)
+
+
 def encrypt_payload(payload, key):
     """Шифрование полезной нагрузки (AES-256-GCM)"""
     # Преобразуем полезную нагрузку в байты, если это словарь
@@ -94,7 +154,6 @@ def decrypt_payload(encrypted, key):
         raise ValueError("Authentication tag verification failed")
 
 
-@transaction.atomic
 def check_nonce_advanced(sensor, nonce, timestamp=None):
     """
     Продвинутая проверка nonce с поддержкой окон и восстановления связи
@@ -109,13 +168,14 @@ def check_nonce_advanced(sensor, nonce, timestamp=None):
     """
     logger = logging.getLogger(__name__)
     
-    # Импортируем модель здесь, чтобы избежать циклических импортов
-    from .models import SensorNonceTracking
+    # Импортируем модули здесь, чтобы избежать циклических импортов
+    from .models import Sensor
+    from .nonce_store import get_nonce_store
+    from .sensor_cache import invalidate_sensor_credentials
     
     logger.debug(f"Advanced nonce check for {sensor.serial_number}: nonce={nonce}, "
                 f"window_start={sensor.nonce_window_start}, window_size={sensor.nonce_window_size}")
     
-    current_time = timezone.now()
     current_timestamp = int(time.time())
     
     # 1. Проверка временной метки (если предоставлена)
@@ -127,24 +187,18 @@ def check_nonce_advanced(sensor, nonce, timestamp=None):
             logger.warning(f"Timestamp too far from current time: {time_diff}s > {max_time_drift}s")
             return False, f"Timestamp out of acceptable range: {time_diff}s"
     
+    store = get_nonce_store()
+
     # 2. Определяем текущее окно nonce
     window_start = sensor.nonce_window_start
     window_end = window_start + sensor.nonce_window_size
     
     # 3. Проверяем, находится ли nonce в текущем окне
     if window_start <= nonce < window_end:
-        # Nonce в текущем окне - проверяем, не использовался ли уже
-        if SensorNonceTracking.objects.filter(sensor=sensor, nonce_value=nonce).exists():
+        # Атомарная проверка и отметка nonce в хранилище
+        if not store.check_and_set(sensor, window_start, nonce):
             logger.warning(f"Nonce {nonce} already used in current window")
             return False, "Nonce already used"
-            
-        # Сохраняем nonce как использованный
-        expires_at = current_time + timezone.timedelta(minutes=10)
-        SensorNonceTracking.objects.create(
-            sensor=sensor,
-            nonce_value=nonce,
-            expires_at=expires_at
-        )
         
         logger.debug(f"Nonce {nonce} accepted in current window")
         return True, "OK"
@@ -157,24 +211,22 @@ def check_nonce_advanced(sensor, nonce, timestamp=None):
         logger.info(f"Moving nonce window for {sensor.serial_number}: "
                    f"{window_start} -> {new_window_start}")
         
-        # Очищаем старые nonce из предыдущего окна
-        SensorNonceTracking.objects.filter(
-            sensor=sensor,
-            nonce_value__lt=new_window_start
-        ).delete()
-        
-        # Обновляем окно
+        # Обновляем окно без блокировки строки: окно только сдвигается вперёд
+        Sensor.objects.filter(
+            pk=sensor.pk,
+            nonce_window_start__lt=new_window_start
+        ).update(nonce_window_start=new_window_start, sync_status='synchronized')
         sensor.nonce_window_start = new_window_start
         sensor.sync_status = 'synchronized'
-        sensor.save()
+        invalidate_sensor_credentials(sensor.serial_number)
+        
+        # Очищаем nonce предыдущего окна
+        store.advance_window(sensor, window_start, new_window_start)
         
         # Сохраняем новый nonce
-        expires_at = current_time + timezone.timedelta(minutes=10)
-        SensorNonceTracking.objects.create(
-            sensor=sensor,
-            nonce_value=nonce,
-            expires_at=expires_at
-        )
+        if not store.check_and_set(sensor, new_window_start, nonce):
+            logger.warning(f"Nonce {nonce} already used in new window")
+            return False, "Nonce already used"
         
         logger.debug(f"Nonce {nonce} accepted with window shift")
         return True, "OK"
@@ -258,8 +310,17 @@ def decrypt_batch_data(encrypted_data_b64, key):
         list: Список измерений
     """
     encrypted_data = base64.b64decode(encrypted_data_b64)
-    decrypted = decrypt_payload(encrypted_data, key)
-    data = json.loads(decrypted.decode('utf-8'))
+    return parse_batch_json(decrypt_payload(encrypted_data, key))
+
+
+def parse_batch_json(plaintext):
+    """
+    Разбор расшифрованных batch-данных в формате JSON
+    
+    Returns:
+        list: Список измерений
+    """
+    data = json.loads(plaintext.decode('utf-8'))
     
     # Проверяем структуру данных
     if 'measurements' not in data or 'count' not in data:
@@ -328,28 +389,15 @@ def verify_device_signature(device_data, signature_b64, secret_key, device_id, m
 
 def cleanup_security_data():
     """
-    Очистка устаревших данных безопасности
-    Должна вызываться периодически (например, через cron)
+    Очистка устаревших данных безопасности порциями (см. janitor.run_janitor)
+    Периодически вызывается командой run_security_janitor
     """
-    logger = logging.getLogger(__name__)
-    
-    from .models import SensorNonceTracking, SensorBatchData
-    
-    # Очищаем истёкшие nonce
-    deleted_nonces = SensorNonceTracking.cleanup_expired()[0]
-    logger.info(f"Cleaned up {deleted_nonces} expired nonces")
-    
-    # Очищаем старые обработанные batch-данные (старше 24 часов)
-    cleanup_time = timezone.now() - timezone.timedelta(hours=24)
-    deleted_batches = SensorBatchData.objects.filter(
-        is_processed=True,
-        processed_at__lt=cleanup_time
-    ).delete()[0]
-    logger.info(f"Cleaned up {deleted_batches} old batch records")
-    
+    from .janitor import run_janitor
+
+    stats = run_janitor()
     return {
-        'deleted_nonces': deleted_nonces,
-        'deleted_batches': deleted_batches
+        'deleted_nonces': stats['nonces']['deleted'],
+        'deleted_batches': stats['batches']['deleted'] + stats['stale_parts']['deleted']
     }
 
 
@@ -0,0 +1,135 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from .models import Sensor
+
+logger = logging.getLogger(__name__)
+
+# Поля, необходимые для аутентификации устройства
+CREDENTIAL_FIELDS = [
+    'id', 'serial_number', 'secret_key', 'active', 'user_id',
+    'nonce_window_start', 'nonce_window_size', 'sync_status', 'device_clock_offset',
+    'signature_version',
+]
+
+
+def _credentials_key(serial_number):
+    return f"glucose:sensor_credentials:{serial_number}"
+
+
+def get_sensor_credentials(serial_number):
+    """
+    Получение активного сенсора для аутентификации без блокировки строки.
+
+    Возвращает частично загруженный экземпляр Sensor (только CREDENTIAL_FIELDS),
+    поэтому save() на нём затрагивает только эти поля.
+    """
+    key = _credentials_key(serial_number)
+    data = cache.get(key)
+
+    # Запись, сохранённая до изменения CREDENTIAL_FIELDS, перечитывается из БД
+    if data is None or len(data) != len(CREDENTIAL_FIELDS):
+        data = Sensor.objects.filter(
+            serial_number=serial_number,
+            active=True
+        ).values(*CREDENTIAL_FIELDS).first()
+        if data is None:
+            return None
+        cache.set(key, data, timeout=getattr(settings, 'SENSOR_CREDENTIALS_TTL', 300))
+
+    return Sensor.from_db('default', CREDENTIAL_FIELDS, [data[field] for field in CREDENTIAL_FIELDS])
+
+
+def invalidate_sensor_credentials(*serial_numbers):
+    """Сброс закэшированных данных сенсора после изменения в БД"""
+    cache.delete_many([_credentials_key(serial) for serial in serial_numbers if serial])
+
+
+class SensorActivityBuffer:
+    """
+    Отложенная запись last_request/sync_status.
+    Вместо save() на каждый запрос отметки накапливаются в памяти и
+    записываются одним bulk_update раз в flush_interval секунд.
+    Оставшиеся отметки записываются при завершении процесса, если включён
+    SENSOR_ACTIVITY_FLUSH_ON_EXIT (в тестах база к этому моменту уже удалена).
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def touch(self, sensor_id, when=None):
+        with self._lock:
+            self._pending[sensor_id] = when or timezone.now()
+        self._ensure_started()
+
+    def flush(self, final=False):
+        """Запись накопленных отметок. При final=True неудачная запись не повторяется."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        sensors = [
+            Sensor(id=sensor_id, last_request=last_request, sync_status='synchronized')
+            for sensor_id, last_request in pending.items()
+        ]
+        try:
+            Sensor.objects.bulk_update(sensors, ['last_request', 'sync_status'], batch_size=500)
+        except Exception as e:
+            if final:
+                logger.warning(f"Dropping activity of {len(sensors)} sensors on exit: {str(e)}")
+                return 0
+            logger.error(f"Failed to flush activity for {len(sensors)} sensors: {str(e)}")
+            # Возвращаем отметки в буфер, не затирая более свежие
+            with self._lock:
+                for sensor_id, last_request in pending.items():
+                    self._pending.setdefault(sensor_id, last_request)
+            return 0
+
+        logger.debug(f"Flushed activity for {len(sensors)} sensors")
+        return len(sensors)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='sensor-activity-flusher', daemon=True
+                )
+                self._thread.start()
+                if getattr(settings, 'SENSOR_ACTIVITY_FLUSH_ON_EXIT', True):
+                    atexit.register(self._flush_on_exit)
+
+    def _flush_on_exit(self):
+        try:
+            self.flush(final=True)
+        finally:
+            connection.close()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            finally:
+                connection.close()
+
+
+activity_buffer = SensorActivityBuffer(getattr(settings, 'SENSOR_ACTIVITY_FLUSH_INTERVAL', 30))
+
+
+def record_sensor_activity(sensor):
+    """Отметка успешного запроса сенсора (записывается в БД отложенно)"""
+    activity_buffer.touch(sensor.id)
@@ -4,6 +4,7 @@ import time
 from rest_framework import serializers
 
 from .models import GlucoseData, Sensor, SensorSettings
+from .payloads import COMPRESSION_NONE, COMPRESSIONS, PAYLOAD_FORMATS, PAYLOAD_JSON, max_encrypted_length
 
 
 class SensorRegistrationSerializer(serializers.Serializer):
@@ -23,7 +24,10 @@ class SensorRegistrationSerializer(serializers.Serializer):
 class SensorAdminSerializer(serializers.ModelSerializer):
     class Meta:
         model = Sensor
-        fields = ['id', 'serial_number', 'name', 'active', 'user', 'created_at', 'updated_at', 'claim_token']
+        fields = [
+            'id', 'serial_number', 'name', 'active', 'user', 'signature_version',
+            'created_at', 'updated_at', 'claim_token'
+        ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'claim_token']
 
 
@@ -66,7 +70,9 @@ class BatchDataSerializer(serializers.Serializer):
     signature = serializers.CharField(max_length=88)
     nonce = serializers.IntegerField(min_value=1)
     timestamp = serializers.IntegerField()
-    encrypted_data = serializers.CharField()
+    encrypted_data = serializers.CharField(max_length=max_encrypted_length())
+    payload_format = serializers.ChoiceField(choices=PAYLOAD_FORMATS, default=PAYLOAD_JSON)
+    compression = serializers.ChoiceField(choices=COMPRESSIONS, default=COMPRESSION_NONE)
 
     def validate_signature(self, value):
         try:
@@ -88,10 +94,56 @@ class BatchDataSerializer(serializers.Serializer):
 class GlucoseDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = GlucoseData
-        fields = ['value', 'created_at']
+        fields = ['value', 'measured_at', 'created_at']
 
 
 class MeasurementItemSerializer(serializers.Serializer):
     value = serializers.FloatField(min_value=0.1, max_value=33.3)
     timestamp = serializers.IntegerField()
     sequence_id = serializers.IntegerField(min_value=0, required=False)  # Необязательное для новой системы
+
+
+class MeasurementHistoryQuerySerializer(serializers.Serializer):
+    RESOLUTION_CHOICES = ['raw', 'lttb', 'minmax']
+
+    start = serializers.DateTimeField(required=False, help_text="Начало периода (по умолчанию - сутки назад)")
+    end = serializers.DateTimeField(required=False, help_text="Конец периода (по умолчанию - сейчас)")
+    resolution = serializers.ChoiceField(choices=RESOLUTION_CHOICES, default='lttb')
+    max_points = serializers.IntegerField(min_value=10, max_value=5000, default=1000)
+    cursor = serializers.DateTimeField(
+        required=False, help_text="Время измерения последней полученной точки - next_cursor предыдущей страницы (raw)"
+    )
+    limit = serializers.IntegerField(min_value=1, max_value=5000, default=1000)
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError("start must be earlier than end")
+        return attrs
+
+
+class SensorPageQuerySerializer(serializers.Serializer):
+    cursor = serializers.CharField(max_length=255, required=False, help_text="Серийный номер последнего сенсора страницы")
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+
+class FleetOverviewQuerySerializer(SensorPageQuerySerializer):
+    active = serializers.BooleanField(required=False, allow_null=True, default=None)
+    stale = serializers.BooleanField(
+        required=False, allow_null=True, default=None,
+        help_text="Нет показаний дольше stale_minutes"
+    )
+    low_battery = serializers.BooleanField(
+        required=False, allow_null=True, default=None,
+        help_text="Заряд не выше FLEET_LOW_BATTERY_LEVEL"
+    )
+    needs_sync = serializers.BooleanField(required=False, allow_null=True, default=None)
+    stale_minutes = serializers.IntegerField(min_value=1, max_value=10080, required=False)
+    serial = serializers.CharField(max_length=255, required=False, help_text="Префикс серийного номера")
+
+
+class GlucoseReportQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=90, default=14)
+    utc_offset = serializers.IntegerField(
+        min_value=-720, max_value=840, default=0,
+        help_text="Смещение часового пояса пациента в минутах (для профиля по времени суток)"
+    )
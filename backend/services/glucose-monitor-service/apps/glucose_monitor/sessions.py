@@ -0,0 +1,315 @@
+"""
+Сессии сенсоров.
+
+Сенсор проходит полную аутентификацию на endpoint sync (request_session=true)
+и получает короткоживущий токен (create_secure_session_token). Последующие
+запросы подписываются HMAC-SHA256 ключом, производным от секрета и токена,
+и содержат монотонно растущий счётчик вместо nonce:
+
+    X-Sensor-Session: <токен>
+    X-Sensor-Counter: <счётчик>
+    X-Sensor-Timestamp: <unix time>
+    X-Sensor-Signature: base64(HMAC-SHA256(session_key, "s1\\n" METHOD "\\n" path "\\n" counter "\\n" timestamp "\\n" + тело))
+
+Последний принятый счётчик сессии и поколение сессий сенсора хранятся в
+общем хранилище (Redis; без Redis - в памяти процесса). Счётчик
+продвигается атомарно (сравнение и запись одним Lua-скриптом), поэтому
+запрос нельзя повторить ни в том же, ни в другом процессе. Отзыв сессий
+(смена ключа, деактивация, смена владельца) увеличивает поколение сенсора:
+сессии, выданные раньше, перестают приниматься во всех процессах сразу.
+Процесс, ещё не видевший токен, проверяет его подпись секретом сенсора и
+вычисляет ключ сессии; в памяти процесса кэшируется только ключ.
+Если состояние сессии в хранилище потеряно, сессия считается истёкшей.
+По истечении токена сенсор возвращается к полной аутентификации.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .security import create_secure_session_token, verify_session_token
+from .sensor_cache import get_sensor_credentials
+
+logger = logging.getLogger(__name__)
+
+SESSION_HEADER = 'HTTP_X_SENSOR_SESSION'
+COUNTER_HEADER = 'HTTP_X_SENSOR_COUNTER'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def derive_session_key(secret_key, token):
+    """Ключ сессии: HMAC-SHA256(секрет сенсора, токен)"""
+    return hmac.new(bytes.fromhex(secret_key), b'glucose-session\n' + token.encode('utf-8'), hashlib.sha256).digest()
+
+
+def session_mac(session_key, method, path, counter, timestamp):
+    """HMAC-SHA256 запроса сессии, инициализированный заголовком сообщения"""
+    prefix = f"s1\n{method.upper()}\n{path}\n{counter}\n{timestamp}\n".encode('utf-8')
+    return hmac.new(session_key, prefix, hashlib.sha256)
+
+
+class SessionExpired(Exception):
+    """Токен сессии истёк, недействителен или отозван - нужна полная аутентификация"""
+
+
+# Результаты операций хранилища состояния сессий
+STATE_OK = 1
+STATE_REPLAYED = 0
+STATE_UNKNOWN = -1
+STATE_REVOKED = -2
+
+
+class RedisSessionState:
+    """
+    Состояние сессий в Redis:
+        glucose:session:<sha256(токен)> - hash {gen, counter}, истекает вместе с токеном
+        glucose:session_gen:<serial_number> - поколение сессий сенсора
+    """
+    name = 'redis'
+
+    ISSUE_SCRIPT = """
+local gen = redis.call('GET', KEYS[2])
+if gen then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+else
+    gen = '0'
+end
+redis.call('HSET', KEYS[1], 'gen', gen, 'counter', 0)
+redis.call('EXPIREAT', KEYS[1], ARGV[1])
+return 1
+"""
+
+    # ARGV[1] - счётчик запроса; пустой - только проверка поколения
+    ADVANCE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'gen', 'counter')
+if not state[1] then
+    return -1
+end
+if state[1] ~= (redis.call('GET', KEYS[2]) or '0') then
+    return -2
+end
+if ARGV[1] == '' then
+    return 1
+end
+if tonumber(ARGV[1]) <= tonumber(state[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'counter', ARGV[1])
+return 1
+"""
+
+    def __init__(self, client):
+        self.client = client
+        self._issue = client.register_script(self.ISSUE_SCRIPT)
+        self._advance = client.register_script(self.ADVANCE_SCRIPT)
+
+    def _keys(self, token, serial_number):
+        return [f"glucose:session:{hashlib.sha256(token.encode('utf-8')).hexdigest()}",
+                f"glucose:session_gen:{serial_number}"]
+
+    def issue(self, token, serial_number, expires_at, ttl):
+        self._issue(keys=self._keys(token, serial_number), args=[expires_at, ttl])
+
+    def advance(self, token, serial_number, counter=None):
+        return int(self._advance(keys=self._keys(token, serial_number),
+                                 args=['' if counter is None else counter]))
+
+    def revoke(self, serial_number, ttl):
+        key = f"glucose:session_gen:{serial_number}"
+        pipe = self.client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+
+class LocalSessionState:
+    """
+    Состояние сессий в памяти процесса (кэш не Redis, например LocMemCache
+    в разработке); защита от повтора действует только в пределах процесса.
+    """
+    name = 'local'
+
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # токен -> [поколение, счётчик, истекает]
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def issue(self, token, serial_number, expires_at, ttl):
+        with self._lock:
+            self._sessions[token] = [self._generations.get(serial_number, 0), 0, expires_at]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def advance(self, token, serial_number, counter=None):
+        with self._lock:
+            state = self._sessions.get(token)
+            if state is None or state[2] <= time.time():
+                return STATE_UNKNOWN
+            if state[0] != self._generations.get(serial_number, 0):
+                return STATE_REVOKED
+            if counter is None:
+                return STATE_OK
+            if counter <= state[1]:
+                return STATE_REPLAYED
+            state[1] = counter
+            return STATE_OK
+
+    def revoke(self, serial_number, ttl):
+        with self._lock:
+            self._generations[serial_number] = self._generations.get(serial_number, 0) + 1
+
+
+def _build_session_state(max_sessions):
+    try:
+        from django_redis import get_redis_connection
+        return RedisSessionState(get_redis_connection('default'))
+    except (ImportError, NotImplementedError):
+        logger.warning("Redis cache is not configured, sensor session counters are process-local")
+        return LocalSessionState(max_sessions)
+
+
+class SensorSession:
+    __slots__ = ('token', 'sensor', 'key', 'expires_at')
+
+    def __init__(self, token, sensor, key, expires_at):
+        self.token = token
+        self.sensor = sensor
+        self.key = key
+        self.expires_at = expires_at
+
+
+class SensorSessionStore:
+    """
+    Сессии сенсоров: ключи сессий кэшируются в процессе (LRU с ограничением
+    размера), счётчики и поколения - в общем хранилище состояния.
+    """
+
+    def __init__(self, max_sessions, state=None):
+        self.max_sessions = max_sessions
+        self._state = state
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return _setting('SENSOR_SESSION_TTL', 3600)
+
+    @property
+    def state(self):
+        if self._state is None:
+            with self._lock:
+                if self._state is None:
+                    self._state = _build_session_state(self.max_sessions)
+        return self._state
+
+    def issue(self, sensor):
+        """
+        Выдача токена сессии после полной аутентификации.
+
+        Returns:
+            dict: {'token', 'expires_at'} или None, если хранилище состояния недоступно
+        """
+        token = create_secure_session_token(sensor.id, sensor.secret_key)
+        expires_at = int(time.time()) + self.ttl
+        try:
+            self.state.issue(token, sensor.serial_number, expires_at, self.ttl + 60)
+        except Exception as e:
+            logger.error(f"Failed to issue session for sensor {sensor.serial_number}: {str(e)}")
+            return None
+        self._put(token, SensorSession(token, sensor, derive_session_key(sensor.secret_key, token), expires_at))
+        return {'token': token, 'expires_at': expires_at}
+
+    def resolve(self, token, serial_number):
+        """
+        Сессия по токену. Токен, выданный другим процессом, проверяется по секрету сенсора;
+        отзыв сессии проверяется по поколению сенсора в общем хранилище.
+
+        Raises:
+            SessionExpired: токен истёк, недействителен, отозван или выдан другому сенсору
+        """
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is not None:
+                self._sessions.move_to_end(token)
+
+        if session is None:
+            sensor = get_sensor_credentials(serial_number)
+            if sensor is None:
+                raise SessionExpired("Invalid sensor")
+            data = verify_session_token(token, sensor.secret_key, max_age_hours=self.ttl / 3600)
+            if data is None or data.get('sensor_id') != str(sensor.id):
+                raise SessionExpired("Invalid session token")
+            session = SensorSession(token, sensor, derive_session_key(sensor.secret_key, token),
+                                    data['issued_at'] + self.ttl)
+            self._put(token, session)
+
+        if session.sensor.serial_number != serial_number:
+            raise SessionExpired("Invalid session token")
+        if session.expires_at <= time.time():
+            self._drop(token)
+            raise SessionExpired("Session expired")
+        self._check_state(session, self._call_state(session))
+        return session
+
+    def advance(self, session, counter):
+        """
+        Атомарное принятие счётчика, только если он больше последнего принятого
+        в любом процессе.
+
+        Raises:
+            SessionExpired: сессия отозвана или её состояние потеряно
+        """
+        result = self._call_state(session, counter)
+        self._check_state(session, result)
+        return result == STATE_OK
+
+    def revoke(self, *serial_numbers):
+        """Отзыв сессий сенсоров во всех процессах (смена ключа, деактивация)"""
+        serial_numbers = {serial for serial in serial_numbers if serial}
+        for serial_number in serial_numbers:
+            try:
+                self.state.revoke(serial_number, self.ttl + 60)
+            except Exception as e:
+                logger.error(f"Failed to revoke sessions of sensor {serial_number}: {str(e)}")
+        with self._lock:
+            for token in [token for token, session in self._sessions.items()
+                          if session.sensor.serial_number in serial_numbers]:
+                del self._sessions[token]
+
+    def _call_state(self, session, counter=None):
+        try:
+            return self.state.advance(session.token, session.sensor.serial_number, counter)
+        except Exception as e:
+            # Без общего состояния повтор нельзя исключить - сенсор проходит полную аутентификацию
+            logger.error(f"Session state store failed: {str(e)}")
+            raise SessionExpired("Session state unavailable")
+
+    def _check_state(self, session, result):
+        if result == STATE_UNKNOWN:
+            self._drop(session.token)
+            raise SessionExpired("Session expired")
+        if result == STATE_REVOKED:
+            self._drop(session.token)
+            raise SessionExpired("Session revoked")
+
+    def _put(self, token, session):
+        with self._lock:
+            self._sessions[token] = session
+            self._sessions.move_to_end(token)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _drop(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+
+session_store = SensorSessionStore(max_sessions=getattr(settings, 'SENSOR_SESSION_MAX_COUNT', 100000))
@@ -3,7 +3,8 @@ from .views import (
     SingleDataView, BatchDataView,
     SensorRegistrationView, SensorManagementView,
     AdminSensorView, SensorSettingsView, SensorBatteryView, SensorBatteryInfoView, SensorClaimView,
-    SensorSyncView, EnhancedBatchDataView, SensorStatusView
+    SensorSyncView, EnhancedBatchDataView, SensorStatusView, SensorMeasurementsView,
+    SensorReportView, FleetOverviewView, SensorLiveStreamView, SensorLiveTicketView
 )
 
 urlpatterns = [
@@ -24,9 +25,14 @@ urlpatterns = [
     # Административные endpoints
     path('admin/sensors/', AdminSensorView.as_view(), name='admin-sensor-list-create'),
     path('admin/sensors/<uuid:sensor_id>/', AdminSensorView.as_view(), name='admin-sensor-update-delete'),
+    path('admin/fleet/', FleetOverviewView.as_view(), name='admin-fleet-overview'),
     
     # Настройки и дополнительные функции
     path('sensors/<uuid:sensor_id>/settings/', SensorSettingsView.as_view(), name='sensor-settings'),
+    path('sensors/<uuid:sensor_id>/measurements/', SensorMeasurementsView.as_view(), name='sensor-measurements'),
+    path('sensors/<uuid:sensor_id>/report/', SensorReportView.as_view(), name='sensor-report'),
+    path('sensors/<uuid:sensor_id>/live/', SensorLiveStreamView.as_view(), name='sensor-live'),
+    path('sensors/<uuid:sensor_id>/live/ticket/', SensorLiveTicketView.as_view(), name='sensor-live-ticket'),
     path('sensor/<str:serial_number>/battery/', SensorBatteryView.as_view(), name='sensor-battery'),
     path('sensor/<str:serial_number>/battery-info/', SensorBatteryInfoView.as_view(), name='sensor-battery-info'),
     path('sensor/claim/<uuid:claim_token>/', SensorClaimView.as_view(), name='sensor-claim'),
@@ -1,43 +1,71 @@
 import binascii
 import binascii
+import json
 import logging
 import os
-
-from django.db import transaction
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.views import View
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from .serializers import SensorRegistrationSerializer, SensorAdminSerializer, SensorSettingsSerializer, \
-    MeasurementItemSerializer
+    MeasurementHistoryQuerySerializer, GlucoseReportQuerySerializer, FleetOverviewQuerySerializer, \
+    SensorPageQuerySerializer
 
 logger = logging.getLogger(__name__)
 
-from .models import Sensor, GlucoseData, SensorSettings, SensorBatchData
+from .models import Sensor, GlucoseData, GlucoseRollup, SensorSettings, SensorBatchData
 from .security import (
-    verify_signature, check_nonce_advanced, sync_sensor_time, decrypt_batch_data
+    verify_signature, check_nonce_advanced, sync_sensor_time, read_signed_body, signature_v2_mac,
+    verify_digest, SignedBodyTooLarge, SIGNATURE_HEADER, NONCE_HEADER, TIMESTAMP_HEADER, SIGNATURE_V2
+)
+from .analytics import glucose_report, to_arrays
+from .batches import (
+    batch_progress, finalize_batch, iter_pending_parts, mark_parts_processed, record_next_part, record_part
+)
+from .downsampling import lttb, bucket_stats
+from .fleet import fleet_overview, keyset_page, with_latest_reading
+from .ingest import IngestBufferFull, IngestFlushError, store_readings, validate_measurements
+from .live import event_stream, get_stream_user, has_stream_access, issue_stream_ticket
+from .nonce_store import get_nonce_store
+from .payloads import (
+    COMPRESSION_NONE, COMPRESSIONS, PAYLOAD_FORMATS, PAYLOAD_JSON, PayloadTooLarge, batch_limits, decrypt_readings,
+    max_encrypted_length
 )
+from .permissions import can_view_sensor
+from .rollups import bucket_floor, merge_rollups
+from .sensor_cache import get_sensor_credentials, invalidate_sensor_credentials, record_sensor_activity
 from .serializers import SingleDataSerializer, BatchDataSerializer
+from .sessions import COUNTER_HEADER, SESSION_HEADER, SessionExpired, session_mac, session_store
 
 logger = logging.getLogger(__name__)
 
 
 class BaseSensorView(APIView):
     AUTH_WINDOW = 300  # 5 минут в секундах
+    RETRY_AFTER = 5  # секунд до повтора при перегрузке приёма
 
-    @transaction.atomic
     def authenticate(self, request, serial_number, signature, nonce, timestamp):
-        try:
-            sensor = Sensor.objects.select_for_update().get(
-                serial_number=serial_number,
-                active=True
-            )
-        except Sensor.DoesNotExist:
+        # Данные сенсора берутся из кэша, без select_for_update
+        sensor = get_sensor_credentials(serial_number)
+        if sensor is None:
             logger.error(f"Sensor not found: {serial_number}")
             return None, "Invalid sensor"
 
+        if sensor.signature_version == SIGNATURE_V2:
+            logger.warning(f"Signature v1 used by v2-only sensor {serial_number}")
+            return None, "Invalid signature: scheme v1 is disabled for this sensor"
+
         # Проверка nonce с новой продвинутой системой
         nonce_valid, nonce_error = check_nonce_advanced(sensor, nonce, timestamp)
         if not nonce_valid:
@@ -63,91 +91,248 @@ class BaseSensorView(APIView):
             logger.warning(f"Invalid signature for sensor {serial_number}")
             return None, "Invalid signature"
 
-        # Обновление последнего запроса и статуса синхронизации
-        sensor.last_request = timezone.now()
-        if sensor.sync_status != 'synchronized':
-            sensor.sync_status = 'synchronized'
-        sensor.save()
+        # Обновление последнего запроса и статуса синхронизации (отложенная запись)
+        record_sensor_activity(sensor)
 
         return sensor, None
 
+    def authenticate_request(self, request, serial_number, serializer_class):
+        """
+        Разбор и аутентификация запроса сенсора.
+        Подпись v2 (заголовок X-Sensor-Signature) проверяется по сырому телу,
+        иначе используется подпись v1 по каноническому JSON.
+
+        Returns:
+            tuple: (sensor, проверенные данные, Response с ошибкой или None)
+        """
+        if SESSION_HEADER in request.META:
+            return self.authenticate_session(request, serial_number, serializer_class)
+
+        if SIGNATURE_HEADER not in request.META:
+            serializer = serializer_class(data=request.data)
+            if not serializer.is_valid():
+                return None, None, Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            data = serializer.validated_data
+            sensor, error = self.authenticate(
+                request,
+                serial_number,
+                data['signature'],
+                data['nonce'],
+                data['timestamp']
+            )
+            if error:
+                return None, None, Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+            return sensor, data, None
+
+        sensor = get_sensor_credentials(serial_number)
+        if sensor is None:
+            logger.error(f"Sensor not found: {serial_number}")
+            return None, None, Response({"error": "Invalid sensor"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        payload, error_response = self.read_signed_payload(request, sensor)
+        if error_response:
+            return None, None, error_response
+
+        serializer = serializer_class(data=payload)
+        if not serializer.is_valid():
+            return None, None, Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        nonce_valid, nonce_error = check_nonce_advanced(sensor, payload['nonce'], payload['timestamp'])
+        if not nonce_valid:
+            logger.warning(f"Nonce validation failed for {serial_number}: {nonce_error}")
+            return None, None, Response({"error": f"Invalid nonce: {nonce_error}"},
+                                        status=status.HTTP_401_UNAUTHORIZED)
+
+        record_sensor_activity(sensor)
+        return sensor, serializer.validated_data, None
+
+    def read_signed_payload(self, request, sensor):
+        """
+        Проверка подписи v2: HMAC-SHA512 считается по мере чтения тела,
+        JSON разбирается один раз и только после успешной проверки.
+
+        Returns:
+            tuple: (данные запроса с nonce/timestamp/signature из заголовков, Response с ошибкой или None)
+        """
+        signature = request.META[SIGNATURE_HEADER]
+        try:
+            nonce = int(request.META[NONCE_HEADER])
+            timestamp = int(request.META[TIMESTAMP_HEADER])
+        except (KeyError, ValueError):
+            return None, Response({"error": "Missing or invalid signature headers"},
+                                  status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            body, digest = read_signed_body(
+                request.stream,
+                signature_v2_mac(sensor.secret_key, request.method, request.path, nonce, timestamp),
+                settings.DATA_UPLOAD_MAX_MEMORY_SIZE or float('inf')
+            )
+        except SignedBodyTooLarge as e:
+            return None, Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        if not verify_digest(signature, digest):
+            logger.warning(f"Invalid v2 signature for sensor {sensor.serial_number}")
+            return None, Response({"error": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        return self.parse_signed_json(body, signature=signature, nonce=nonce, timestamp=timestamp)
+
+    def payload_too_large(self, serial_number, error):
+        """Ответ на пакет сверх лимитов: устройство уменьшает размер batch по лимитам из ответа"""
+        logger.warning(f"Batch from {serial_number} rejected: {str(error)}")
+        return Response({
+            "error": str(error),
+            "code": "batch_too_large",
+            "batch_limits": batch_limits()
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def parse_signed_json(self, body, **auth_fields):
+        """Разбор проверенного тела запроса и добавление полей аутентификации из заголовков"""
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            return None, Response({"error": "Invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST)
+
+        payload.update(auth_fields)
+        return payload, None
+
+    def authenticate_session(self, request, serial_number, serializer_class):
+        """
+        Аутентификация запроса в рамках сессии (sessions.py): подпись ключом сессии
+        и атомарная проверка счётчика в общем хранилище, без хранилища nonce и БД.
+
+        Returns:
+            tuple: (sensor, проверенные данные, Response с ошибкой или None)
+        """
+        signature = request.META.get(SIGNATURE_HEADER)
+        try:
+            counter = int(request.META[COUNTER_HEADER])
+            timestamp = int(request.META[TIMESTAMP_HEADER])
+        except (KeyError, ValueError):
+            signature = None
+        if not signature:
+            return None, None, Response({"error": "Missing or invalid session headers"},
+                                        status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            session = session_store.resolve(request.META[SESSION_HEADER], serial_number)
+        except SessionExpired as e:
+            return None, None, Response({"error": str(e), "code": "session_expired"},
+                                        status=status.HTTP_401_UNAUTHORIZED)
+
+        time_diff = abs(int(time.time()) - timestamp)
+        if time_diff > getattr(settings, 'SENSOR_SESSION_MAX_SKEW', self.AUTH_WINDOW):
+            return None, None, Response({"error": f"Timestamp out of acceptable range: {time_diff}s"},
+                                        status=status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            body, digest = read_signed_body(
+                request.stream,
+                session_mac(session.key, request.method, request.path, counter, timestamp),
+                settings.DATA_UPLOAD_MAX_MEMORY_SIZE or float('inf')
+            )
+        except SignedBodyTooLarge as e:
+            return None, None, Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        if not verify_digest(signature, digest):
+            logger.warning(f"Invalid session signature for sensor {serial_number}")
+            return None, None, Response({"error": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            accepted = session_store.advance(session, counter)
+        except SessionExpired as e:
+            return None, None, Response({"error": str(e), "code": "session_expired"},
+                                        status=status.HTTP_401_UNAUTHORIZED)
+        if not accepted:
+            logger.warning(f"Session counter {counter} replayed for {serial_number}")
+            return None, None, Response({"error": "Invalid counter: already used"},
+                                        status=status.HTTP_401_UNAUTHORIZED)
+
+        payload, error_response = self.parse_signed_json(body, signature=signature, nonce=counter,
+                                                         timestamp=timestamp)
+        if error_response:
+            return None, None, error_response
+
+        serializer = serializer_class(data=payload)
+        if not serializer.is_valid():
+            return None, None, Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        record_sensor_activity(session.sensor)
+        return session.sensor, serializer.validated_data, None
+
+    def store_measurements(self, sensor, readings):
+        """
+        Запись проверенных показаний через буфер приёма.
+
+        Returns:
+            tuple: (HTTP-статус успеха, Response с ошибкой или None)
+        """
+        try:
+            stored = store_readings(sensor, readings)
+        except IngestBufferFull as e:
+            logger.warning(f"Ingest backpressure for {sensor.serial_number}: {str(e)}")
+            return None, Response({"error": "Server is busy, retry later"},
+                                  status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                  headers={'Retry-After': str(self.RETRY_AFTER)})
+        except IngestFlushError as e:
+            logger.error(f"Failed to store measurements for {sensor.serial_number}: {str(e)}")
+            return None, Response({"error": "Failed to store measurements"},
+                                  status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                  headers={'Retry-After': str(self.RETRY_AFTER)})
+
+        return (status.HTTP_201_CREATED if stored else status.HTTP_202_ACCEPTED), None
+
 
 class SingleDataView(BaseSensorView):
     permission_classes = [AllowAny]
 
     def post(self, request, serial_number):
-        serializer = SingleDataSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        data = serializer.validated_data
-        sensor, error = self.authenticate(
-            request,
-            serial_number,
-            data['signature'],
-            data['nonce'],
-            data['timestamp']
-        )
-
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+        sensor, data, error_response = self.authenticate_request(request, serial_number, SingleDataSerializer)
+        if error_response:
+            return error_response
 
         # Сохранение данных
-        GlucoseData.objects.create(
-            sensor=sensor,
-            value=data['value']
-        )
+        success_status, error_response = self.store_measurements(sensor, [(data['value'], data['timestamp'])])
+        if error_response:
+            return error_response
 
-        return Response({"status": "success"}, status=status.HTTP_201_CREATED)
+        return Response({"status": "success"}, status=success_status)
 
 
 class BatchDataView(BaseSensorView):
     permission_classes = [AllowAny]
 
     def post(self, request, serial_number):
-        serializer = BatchDataSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        data = serializer.validated_data
-        sensor, error = self.authenticate(
-            request,
-            serial_number,
-            data['signature'],
-            data['nonce'],
-            data['timestamp']
-        )
-
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+        sensor, data, error_response = self.authenticate_request(request, serial_number, BatchDataSerializer)
+        if error_response:
+            return error_response
 
         try:
-            # Дешифровка данных с новой функцией
-            measurements = decrypt_batch_data(data['encrypted_data'], sensor.secret_key)
+            # Дешифровка и валидация данных в формате, указанном устройством
+            readings, total, rejected = decrypt_readings(
+                data['encrypted_data'], sensor.secret_key, data['payload_format'], data['compression']
+            )
+        except PayloadTooLarge as e:
+            return self.payload_too_large(serial_number, e)
         except Exception as e:
             logger.error(f"Batch decryption failed for {serial_number}: {str(e)}")
             return Response({"error": "Data decryption failed"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Валидация и сохранение данных
-        valid_measurements = []
-        for item in measurements:
-            item_serializer = MeasurementItemSerializer(data=item)
-            if item_serializer.is_valid():
-                item_data = item_serializer.validated_data
-                valid_measurements.append(GlucoseData(
-                    sensor=sensor,
-                    value=item_data['value']
-                ))
-            else:
-                logger.warning(f"Invalid measurement data from {serial_number}: {item_serializer.errors}")
+        if rejected:
+            logger.warning(f"Rejected {rejected} invalid measurements from {serial_number}")
 
-        GlucoseData.objects.bulk_create(valid_measurements, ignore_conflicts=True)
+        success_status, error_response = self.store_measurements(sensor, readings)
+        if error_response:
+            return error_response
 
         return Response({
             "status": "success",
-            "saved": len(valid_measurements),
-            "total": len(measurements)
-        }, status=status.HTTP_201_CREATED)
+            "saved": len(readings),
+            "total": total
+        }, status=success_status)
 
 
 class SensorRegistrationView(APIView):
@@ -244,19 +429,18 @@ class SensorManagementView(APIView):
                     status=status.HTTP_404_NOT_FOUND
                 )
         else:
-            # Получение списка всех сенсоров (активных и неактивных)
-            active_sensors = Sensor.objects.filter(
-                user=request.user,
-                active=True
-            ).select_related('settings')
-            
-            inactive_sensors = Sensor.objects.filter(
-                user=request.user,
-                active=False
-            ).select_related('settings')
+            # Получение списка всех сенсоров (активных и неактивных) одним запросом
+            sensors = list(with_latest_reading(
+                Sensor.objects.filter(user=request.user)
+            ).select_related('settings').order_by('created_at'))
+            active_sensors = [sensor for sensor in sensors if sensor.active]
+            inactive_sensors = [sensor for sensor in sensors if not sensor.active]
             
             def format_sensor(sensor):
-                settings_obj, _ = SensorSettings.objects.get_or_create(sensor=sensor)
+                # Настройки загружены через select_related, создаются только при отсутствии
+                settings_obj = getattr(sensor, 'settings', None)
+                if settings_obj is None:
+                    settings_obj, _ = SensorSettings.objects.get_or_create(sensor=sensor)
                 return {
                     'id': str(sensor.id),
                     'serial_number': sensor.serial_number,
@@ -271,13 +455,17 @@ class SensorManagementView(APIView):
                     'high_glucose_threshold': settings_obj.high_glucose_threshold,
                     'polling_interval_minutes': settings_obj.polling_interval_minutes,
                     'activation_time': settings_obj.activation_time,
-                    'expiration_time': settings_obj.expiration_time
+                    'expiration_time': settings_obj.expiration_time,
+                    'last_reading': {
+                        'value': sensor.last_value,
+                        'measured_at': sensor.last_measured_at
+                    } if sensor.last_measured_at else None
                 }
 
             return Response({
                 "active_sensors": [format_sensor(s) for s in active_sensors],
                 "inactive_sensors": [format_sensor(s) for s in inactive_sensors],
-                "has_active": active_sensors.exists()
+                "has_active": bool(active_sensors)
             })
 
     def patch(self, request, sensor_id):
@@ -309,6 +497,8 @@ class SensorManagementView(APIView):
             updated_fields['active'] = sensor.active
             
         sensor.save()
+        invalidate_sensor_credentials(sensor.serial_number)
+        session_store.revoke(sensor.serial_number)
         
         # Обновление настроек сенсора
         settings_obj, _ = SensorSettings.objects.get_or_create(sensor=sensor)
@@ -344,6 +534,8 @@ class SensorManagementView(APIView):
 
         sensor.is_active = False
         sensor.save()
+        invalidate_sensor_credentials(sensor.serial_number)
+        session_store.revoke(sensor.serial_number)
 
         return Response({
             "status": "success",
@@ -355,9 +547,17 @@ class AdminSensorView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request):
-        sensors = Sensor.objects.all().order_by('-created_at')
-        serializer = SensorAdminSerializer(sensors, many=True)
-        return Response(serializer.data)
+        query = SensorPageQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        sensors, next_cursor = keyset_page(Sensor.objects.all(), query.validated_data.get('cursor'),
+                                           query.validated_data['limit'])
+        return Response({
+            "count": len(sensors),
+            "sensors": SensorAdminSerializer(sensors, many=True).data,
+            "next_cursor": next_cursor,
+        })
 
     def post(self, request):
         serializer = SensorAdminSerializer(data=request.data)
@@ -382,9 +582,12 @@ class AdminSensorView(APIView):
             sensor = Sensor.objects.get(id=sensor_id)
         except Sensor.DoesNotExist:
             return Response({"error": "Sensor not found"}, status=status.HTTP_404_NOT_FOUND)
+        old_serial_number = sensor.serial_number
         serializer = SensorAdminSerializer(sensor, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        invalidate_sensor_credentials(old_serial_number, sensor.serial_number)
+        session_store.revoke(old_serial_number, sensor.serial_number)
         return Response(serializer.data)
 
     def delete(self, request, sensor_id):
@@ -394,9 +597,28 @@ class AdminSensorView(APIView):
             return Response({"error": "Sensor not found"}, status=status.HTTP_404_NOT_FOUND)
         sensor.is_active = False
         sensor.save()
+        invalidate_sensor_credentials(sensor.serial_number)
+        session_store.revoke(sensor.serial_number)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class FleetOverviewView(APIView):
+    """Обзор парка сенсоров: настройки, заряд, последнее показание, устаревание"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        query = FleetOverviewQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        sensors, next_cursor = fleet_overview(query.validated_data)
+        return Response({
+            "count": len(sensors),
+            "sensors": sensors,
+            "next_cursor": next_cursor,
+        })
+
+
 class SensorSettingsView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -454,15 +676,11 @@ class SensorBatteryView(APIView):
             timestamp = drf_serializers.IntegerField()
             battery_level = drf_serializers.IntegerField(min_value=0, max_value=100)
 
-        serializer = BatterySerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        data = serializer.validated_data
-
-        sensor, error = BaseSensorView().authenticate(
-            request, serial_number, data['signature'], data['nonce'], data['timestamp']
+        sensor, data, error_response = BaseSensorView().authenticate_request(
+            request, serial_number, BatterySerializer
         )
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+        if error_response:
+            return error_response
 
         settings_obj, _ = SensorSettings.objects.get_or_create(sensor=sensor)
         settings_obj.battery_level = data['battery_level']
@@ -481,6 +699,8 @@ class SensorClaimView(APIView):
         sensor.user = request.user
         sensor.claim_used_at = timezone.now()
         sensor.save()
+        invalidate_sensor_credentials(sensor.serial_number)
+        session_store.revoke(sensor.serial_number)
         return Response({"status": "claimed", "sensor_id": str(sensor.id)})
 
 
@@ -497,32 +717,44 @@ class SensorSyncView(BaseSensorView):
             timestamp = drf_serializers.IntegerField()
             device_timestamp = drf_serializers.IntegerField()
             request_new_window = drf_serializers.BooleanField(default=False)
+            request_session = drf_serializers.BooleanField(default=False)
 
-        serializer = SyncSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        data = serializer.validated_data
-        
         # Для синхронизации используем специальную аутентификацию
         try:
             sensor = Sensor.objects.get(serial_number=serial_number, active=True)
         except Sensor.DoesNotExist:
             return Response({"error": "Sensor not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Специальная проверка подписи для синхронизации
-        body_without_signature = request.data.copy()
-        body_without_signature.pop('signature', None)
-        
-        sign_data = {
-            'path': request.path,
-            'nonce': data['nonce'],
-            'timestamp': data['timestamp'],
-            'body': body_without_signature
-        }
+        if SIGNATURE_HEADER in request.META:
+            # Подпись v2 проверяется при чтении тела
+            payload, error_response = self.read_signed_payload(request, sensor)
+            if error_response:
+                return error_response
+            serializer = SyncSerializer(data=payload)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            data = serializer.validated_data
+        else:
+            serializer = SyncSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            data = serializer.validated_data
+
+            # Специальная проверка подписи для синхронизации
+            body_without_signature = request.data.copy()
+            body_without_signature.pop('signature', None)
 
-        if not verify_signature(sign_data, data['signature'], sensor.secret_key):
-            return Response({"error": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
+            sign_data = {
+                'path': request.path,
+                'nonce': data['nonce'],
+                'timestamp': data['timestamp'],
+                'body': body_without_signature
+            }
+
+            if sensor.signature_version == SIGNATURE_V2 or \
+                    not verify_signature(sign_data, data['signature'], sensor.secret_key):
+                return Response({"error": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
 
         # Выполняем синхронизацию времени
         sync_result = sync_sensor_time(sensor, data['device_timestamp'])
@@ -530,27 +762,34 @@ class SensorSyncView(BaseSensorView):
         # Если запрошено новое окно nonce
         if data.get('request_new_window', False):
             # Создаем новое окно, начинающееся с текущего nonce
+            old_window_start = sensor.nonce_window_start
             new_window_start = ((data['nonce'] // sensor.nonce_window_size) * sensor.nonce_window_size)
             sensor.nonce_window_start = new_window_start
             sensor.sync_status = 'synchronized'
             sensor.save()
             
             # Очищаем старые nonce
-            from .models import SensorNonceTracking
-            SensorNonceTracking.objects.filter(
-                sensor=sensor,
-                nonce_value__lt=new_window_start
-            ).delete()
+            get_nonce_store().advance_window(sensor, old_window_start, new_window_start)
 
-        return Response({
+        invalidate_sensor_credentials(sensor.serial_number)
+
+        response_data = {
             "status": "synchronized",
             "sync_info": sync_result,
             "nonce_window": {
                 "start": sensor.nonce_window_start,
                 "size": sensor.nonce_window_size,
                 "end": sensor.nonce_window_start + sensor.nonce_window_size
-            }
-        }, status=status.HTTP_200_OK)
+            },
+            "batch_limits": batch_limits()
+        }
+        # Токен сессии для последующих запросов без nonce
+        if data.get('request_session', False):
+            session = session_store.issue(sensor)
+            if session is not None:
+                response_data["session"] = session
+
+        return Response(response_data, status=status.HTTP_200_OK)
 
 
 class EnhancedBatchDataView(BaseSensorView):
@@ -564,39 +803,44 @@ class EnhancedBatchDataView(BaseSensorView):
             signature = drf_serializers.CharField(max_length=88)
             nonce = drf_serializers.IntegerField(min_value=1)
             timestamp = drf_serializers.IntegerField()
-            encrypted_data = drf_serializers.CharField()
+            encrypted_data = drf_serializers.CharField(max_length=max_encrypted_length())
             batch_id = drf_serializers.CharField(max_length=64, required=False)
+            part_number = drf_serializers.IntegerField(min_value=0, required=False)
             is_final = drf_serializers.BooleanField(default=True)
+            payload_format = drf_serializers.ChoiceField(choices=PAYLOAD_FORMATS, default=PAYLOAD_JSON)
+            compression = drf_serializers.ChoiceField(choices=COMPRESSIONS, default=COMPRESSION_NONE)
 
-        serializer = EnhancedBatchSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        data = serializer.validated_data
-        sensor, error = self.authenticate(
-            request,
-            serial_number,
-            data['signature'],
-            data['nonce'],
-            data['timestamp']
-        )
-
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+        sensor, data, error_response = self.authenticate_request(request, serial_number, EnhancedBatchSerializer)
+        if error_response:
+            return error_response
 
         try:
-            # Дешифровка данных
-            measurements = decrypt_batch_data(data['encrypted_data'], sensor.secret_key)
+            # Дешифровка и валидация данных
+            readings, part_total, rejected = decrypt_readings(
+                data['encrypted_data'], sensor.secret_key, data['payload_format'], data['compression']
+            )
+        except PayloadTooLarge as e:
+            return self.payload_too_large(serial_number, e)
         except Exception as e:
             logger.error(f"Enhanced batch decryption failed for {serial_number}: {str(e)}")
             return Response({"error": "Data decryption failed"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Если это не финальная часть batch - сохраняем для накопления
+        # Каждая часть записывается сразу при получении
+        if rejected:
+            logger.warning(f"Rejected {rejected} invalid measurements from {serial_number}")
+
+        success_status, error_response = self.store_measurements(sensor, readings)
+        if error_response:
+            return error_response
+
+        if data.get('batch_id'):
+            return self.assemble_part(sensor, data, readings, part_total, success_status)
+
+        # Части без batch_id накапливаются до финальной отправки
         if not data.get('is_final', True):
             SensorBatchData.objects.create(
                 sensor=sensor,
-                encrypted_payload=data['encrypted_data'],
-                measurements_count=len(measurements),
+                measurements_count=part_total,
                 is_processed=False
             )
             return Response({
@@ -604,44 +848,58 @@ class EnhancedBatchDataView(BaseSensorView):
                 "message": "Batch data stored for processing"
             }, status=status.HTTP_202_ACCEPTED)
 
-        # Если это финальная часть - обрабатываем все накопленные данные
-        all_measurements = measurements.copy()
-        
-        # Получаем все неообработанные batch-данные для этого сенсора
-        pending_batches = SensorBatchData.objects.filter(
-            sensor=sensor,
-            is_processed=False
-        ).order_by('created_at')
+        # Финальная часть: дописываем части, сохранённые в зашифрованном виде, и закрываем все
+        saved = len(readings)
+        total = part_total
+        processed_ids = []
+        for part_id, part_measurements in iter_pending_parts(sensor):
+            if part_measurements:
+                part_readings, rejected = validate_measurements(part_measurements)
+                part_status, error_response = self.store_measurements(sensor, part_readings)
+                if error_response:
+                    mark_parts_processed(processed_ids)
+                    return error_response
+                success_status = max(success_status, part_status)
+                saved += len(part_readings)
+                total += len(part_measurements)
+            processed_ids.append(part_id)
+        mark_parts_processed(processed_ids)
 
-        for batch in pending_batches:
-            try:
-                batch_measurements = decrypt_batch_data(batch.encrypted_payload, sensor.secret_key)
-                all_measurements.extend(batch_measurements)
-                batch.mark_processed()
-            except Exception as e:
-                logger.error(f"Failed to process batch {batch.id}: {str(e)}")
-
-        # Валидация и сохранение всех данных
-        valid_measurements = []
-        for item in all_measurements:
-            item_serializer = MeasurementItemSerializer(data=item)
-            if item_serializer.is_valid():
-                item_data = item_serializer.validated_data
-                valid_measurements.append(GlucoseData(
-                    sensor=sensor,
-                    value=item_data['value']
-                ))
-            else:
-                logger.warning(f"Invalid measurement data from {serial_number}: {item_serializer.errors}")
+        return Response({
+            "status": "success",
+            "saved": saved,
+            "total": total,
+            "processed_batches": len(processed_ids)
+        }, status=success_status)
+
+    def assemble_part(self, sensor, data, readings, total, success_status):
+        """Учёт части batch с batch_id и закрытие batch после получения всех частей"""
+        batch_id = data['batch_id']
+        part_number = data.get('part_number')
+        if part_number is None:
+            part_number = record_next_part(sensor, batch_id, total, data.get('is_final', True))
+        else:
+            record_part(sensor, batch_id, part_number, total, data.get('is_final', True))
 
-        GlucoseData.objects.bulk_create(valid_measurements, ignore_conflicts=True)
+        received, expected, missing = batch_progress(sensor, batch_id)
+        if expected is None or missing:
+            return Response({
+                "status": "part_stored",
+                "batch_id": batch_id,
+                "part_number": part_number,
+                "saved": len(readings),
+                "received_parts": received,
+                "missing_parts": missing
+            }, status=status.HTTP_202_ACCEPTED)
 
+        processed = finalize_batch(sensor, batch_id)
         return Response({
             "status": "success",
-            "saved": len(valid_measurements),
-            "total": len(all_measurements),
-            "processed_batches": pending_batches.count()
-        }, status=status.HTTP_201_CREATED)
+            "batch_id": batch_id,
+            "saved": len(readings),
+            "total": total,
+            "processed_batches": processed
+        }, status=success_status)
 
 
 class SensorStatusView(BaseSensorView):
@@ -661,11 +919,7 @@ class SensorStatusView(BaseSensorView):
         ).count()
 
         # Проверяем активные nonce
-        from .models import SensorNonceTracking
-        active_nonces_count = SensorNonceTracking.objects.filter(
-            sensor=sensor,
-            expires_at__gt=timezone.now()
-        ).count()
+        active_nonces_count = get_nonce_store().count_used(sensor, sensor.nonce_window_start)
 
         return Response({
             "sensor_id": str(sensor.id),
@@ -682,3 +936,220 @@ class SensorStatusView(BaseSensorView):
             "device_clock_offset": sensor.device_clock_offset,
             "last_sync": sensor.last_sync_timestamp
         })
+
+
+
+class SensorMeasurementsView(APIView):
+    """История показаний сенсора с прореживанием на сервере"""
+    permission_classes = [IsAuthenticated]
+    DEFAULT_PERIOD = timezone.timedelta(days=1)
+
+    def get(self, request, sensor_id):
+        try:
+            sensor = Sensor.objects.get(id=sensor_id, user=request.user)
+        except Sensor.DoesNotExist:
+            return Response({"error": "Sensor not found or access denied"}, status=status.HTTP_404_NOT_FOUND)
+
+        query = MeasurementHistoryQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query.validated_data
+
+        end = params.get('end') or timezone.now()
+        start = params.get('start') or end - self.DEFAULT_PERIOD
+        resolution = params['resolution']
+
+        # Фильтр по measured_at позволяет затронуть только секции периода
+        measurements = GlucoseData.objects.filter(
+            sensor=sensor,
+            is_deleted=False,
+            measured_at__gte=start,
+            measured_at__lt=end
+        ).order_by('measured_at')
+
+        response = {
+            "sensor_id": str(sensor.id),
+            "start": start,
+            "end": end,
+            "resolution": resolution,
+        }
+
+        if resolution == 'raw':
+            if 'cursor' in params:
+                # measured_at уникально в пределах сенсора - точное значение служит ключом страницы
+                measurements = measurements.filter(measured_at__gt=params['cursor'])
+            rows = list(measurements.values_list('measured_at', 'value')[:params['limit'] + 1])
+            has_more = len(rows) > params['limit']
+            rows = rows[:params['limit']]
+            points = [{'t': int(measured_at.timestamp()), 'v': value} for measured_at, value in rows]
+            response.update({
+                "count": len(points),
+                "points": points,
+                "next_cursor": rows[-1][0].isoformat().replace('+00:00', 'Z') if has_more else None,
+            })
+            return Response(response)
+
+        if resolution == 'minmax' and getattr(settings, 'GLUCOSE_ROLLUPS_ON_INGEST', True):
+            rollup_resolution = self.pick_rollup_resolution(start, end, params['max_points'])
+            if rollup_resolution:
+                # Широкие интервалы собираются из готовых агрегатов, без чтения сырых показаний;
+                # неполные агрегаты на краях периода заменяются сырыми показаниями
+                seconds = GlucoseRollup.RESOLUTION_SECONDS[rollup_resolution]
+                inner_start = bucket_floor(start - timezone.timedelta(microseconds=1), seconds) \
+                    + timezone.timedelta(seconds=seconds)
+                inner_end = bucket_floor(end, seconds)
+                stats = list(GlucoseRollup.objects.filter(
+                    sensor=sensor,
+                    resolution=rollup_resolution,
+                    bucket_start__gte=inner_start,
+                    bucket_start__lt=inner_end
+                ).values_list('bucket_start', 'count', 'min_value', 'max_value', 'sum_value'))
+                edges = measurements.filter(
+                    Q(measured_at__lt=inner_start) | Q(measured_at__gte=inner_end)
+                ).values_list('measured_at', 'value')
+                stats.extend((measured_at, 1, value, value, value) for measured_at, value in edges)
+                points = merge_rollups(stats, params['max_points'], start.timestamp(), end.timestamp())
+                response.update({
+                    "count": sum(point['count'] for point in points),
+                    "points": points,
+                    "next_cursor": None,
+                })
+                return Response(response)
+
+        series = [
+            (measured_at.timestamp(), value)
+            for measured_at, value in measurements.values_list('measured_at', 'value').iterator(chunk_size=5000)
+        ]
+
+        if resolution == 'lttb':
+            points = [{'t': int(ts), 'v': value} for ts, value in lttb(series, params['max_points'])]
+        else:
+            points = bucket_stats(series, params['max_points'], start.timestamp(), end.timestamp())
+
+        response.update({
+            "count": len(series),
+            "points": points,
+            "next_cursor": None,
+        })
+        return Response(response)
+
+    @staticmethod
+    def pick_rollup_resolution(start, end, bucket_count):
+        """Самое крупное разрешение агрегатов, не превышающее ширину корзины"""
+        width = (end - start).total_seconds() / bucket_count
+        suitable = [
+            (seconds, resolution) for resolution, seconds in GlucoseRollup.RESOLUTION_SECONDS.items()
+            if seconds <= width
+        ]
+        return max(suitable)[1] if suitable else None
+
+
+
+class SensorReportView(APIView):
+    """Амбулаторный гликемический профиль (AGP) и время в диапазонах"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, sensor_id):
+        sensor = Sensor.objects.filter(id=sensor_id, is_deleted=False).first()
+        if sensor is None or not can_view_sensor(request.user, sensor):
+            return Response({"error": "Sensor not found or access denied"}, status=status.HTTP_404_NOT_FOUND)
+
+        query = GlucoseReportQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query.validated_data
+
+        # Период выровнен по суткам UTC, чтобы ключ кэша не менялся каждый запрос
+        end = bucket_floor(timezone.now(), 86400) + timezone.timedelta(days=1)
+        start = end - timezone.timedelta(days=params['days'])
+        settings_obj, _ = SensorSettings.objects.get_or_create(sensor=sensor)
+
+        # Метка свежести данных: время последней записи показаний периода и их количество
+        # (не зависит от обновления агрегатов при приёме)
+        high_water_mark = GlucoseData.objects.filter(
+            sensor=sensor,
+            is_deleted=False,
+            measured_at__gte=start,
+            measured_at__lt=end
+        ).aggregate(mark=Max('created_at'), count=Count('id'))
+
+        cache_key = (
+            f"glucose:report:{sensor.id}:{int(start.timestamp())}:{params['days']}:{params['utc_offset']}:"
+            f"{high_water_mark['mark'].timestamp() if high_water_mark['mark'] else 0}:{high_water_mark['count']}:"
+            f"{settings_obj.updated_at.timestamp()}"
+        )
+        report = cache.get(cache_key)
+        if report is None:
+            rows = list(GlucoseData.objects.filter(
+                sensor=sensor,
+                is_deleted=False,
+                measured_at__gte=start,
+                measured_at__lt=end
+            ).order_by('measured_at').values_list('measured_at', 'value'))
+
+            timestamps, values = to_arrays(rows)
+            expected = params['days'] * 24 * 60 // settings_obj.polling_interval_minutes
+            report = glucose_report(
+                timestamps, values,
+                settings_obj.low_glucose_threshold, settings_obj.high_glucose_threshold,
+                expected_readings=expected,
+                utc_offset_minutes=params['utc_offset']
+            )
+            report.update({
+                "sensor_id": str(sensor.id),
+                "start": start,
+                "end": end,
+                "thresholds": {
+                    "low": settings_obj.low_glucose_threshold,
+                    "high": settings_obj.high_glucose_threshold
+                },
+            })
+            cache.set(cache_key, report, timeout=getattr(settings, 'GLUCOSE_REPORT_CACHE_TTL', 3600))
+
+        return Response(report)
+
+
+class SensorLiveTicketView(APIView):
+    """Одноразовый билет для открытия потока сенсора из EventSource (вместо токена в адресе)"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, sensor_id):
+        sensor = Sensor.objects.filter(id=sensor_id, is_deleted=False).first()
+        if sensor is None or not has_stream_access(request.user, sensor, use_cache=False):
+            return Response({"error": "Sensor not found or access denied"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            "ticket": issue_stream_ticket(request.user, sensor),
+            "expires_in": getattr(settings, 'LIVE_TICKET_TTL', 30),
+        }, status=status.HTTP_201_CREATED)
+
+
+class SensorLiveStreamView(View):
+    """
+    Поток новых показаний и уведомлений сенсора (Server-Sent Events).
+    Асинхронное представление: требует запуска под ASGI (config.asgi).
+    """
+
+    async def get(self, request, sensor_id):
+        user, error = await sync_to_async(get_stream_user)(request, sensor_id)
+        if user is None:
+            return JsonResponse({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+
+        sensor = await sync_to_async(
+            Sensor.objects.filter(id=sensor_id, is_deleted=False).first
+        )()
+        if sensor is None or not await sync_to_async(has_stream_access)(user, sensor, use_cache=False):
+            return JsonResponse({"error": "Sensor not found or access denied"}, status=status.HTTP_404_NOT_FOUND)
+
+        latest = await sync_to_async(
+            GlucoseData.objects.filter(sensor=sensor, is_deleted=False, measured_at__isnull=False)
+            .order_by('-measured_at').values('value', 'measured_at').first
+        )()
+        snapshot = {
+            "sensor_id": str(sensor.id),
+            "last_reading": latest,
+        }
+
+        response = StreamingHttpResponse(event_stream(user, sensor, snapshot), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # без буферизации на nginx
+        return response
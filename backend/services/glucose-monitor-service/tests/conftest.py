@@ -0,0 +1,118 @@
+"""
+Тесты и бенчмарки сервиса glucose-monitor (pytest-benchmark).
+
+Запуск из каталога сервиса:
+
+    BENCHMARK_DB=sqlite pytest tests --benchmark-disable   # тесты
+    BENCHMARK_DB=sqlite pytest tests --benchmark-only      # бенчмарки
+
+Базовая линия сохраняется в .benchmarks/ и сравнивается с последующими запусками:
+
+    pytest tests --benchmark-only --benchmark-autosave
+    pytest tests --benchmark-only --benchmark-compare --benchmark-compare-fail=mean:10%
+    pytest-benchmark compare --group-by=group --sort=name
+
+Без BENCHMARK_DB используется PostgreSQL из config.settings (переменные DB_*);
+таблицы сервиса не имеют миграций, поэтому тестовая база создаётся с --nomigrations.
+Тесты с меткой postgresql выполняются только на PostgreSQL.
+"""
+import base64
+import binascii
+import itertools
+import os
+import time
+
+import pytest
+from django.db import connection
+
+from apps.glucose_monitor import nonce_store
+from apps.glucose_monitor.models import Sensor, SensorSettings
+from apps.glucose_monitor.payloads import PAYLOAD_BINARY_V1, PAYLOAD_JSON, encode_binary_batch
+from apps.glucose_monitor.security import encrypt_batch_data, encrypt_payload, generate_hmac_signature
+
+
+def make_measurements(count, start=None, step=60):
+    """Показания [{'value', 'timestamp'}] с шагом step секунд, заканчивающиеся не позже текущего момента"""
+    start = start if start is not None else int(time.time()) - count * step
+    return [{'value': 4.0 + (i % 80) / 10, 'timestamp': start + i * step} for i in range(count)]
+
+
+def encrypt_measurements(measurements, key, payload_format):
+    """Зашифрованные batch-данные в формате устройства"""
+    if payload_format == PAYLOAD_BINARY_V1:
+        plaintext = encode_binary_batch([m['timestamp'] for m in measurements], [m['value'] for m in measurements])
+        return base64.b64encode(encrypt_payload(plaintext, key)).decode('utf-8')
+    return encrypt_batch_data(measurements, key)
+
+
+def sign(data, key):
+    return base64.b64encode(generate_hmac_signature(data, key)).decode('utf-8')
+
+
+class BatchRequests:
+    """Подписанные batch-запросы с новым nonce и непересекающимися показаниями на каждый вызов"""
+
+    def __init__(self, sensor, count, payload_format):
+        self.sensor = sensor
+        self.count = count
+        self.payload_format = payload_format
+        self.path = f"/api/v1/sensor/{sensor.serial_number}/batch/"
+        self.nonces = itertools.count(sensor.nonce_window_start + 1)
+        self.sent = 0
+        self.now = int(time.time())
+
+    def __call__(self):
+        """Аргументы вызова для benchmark.pedantic(setup=...)"""
+        return (self.payload(),), {}
+
+    def payload(self):
+        # Показания каждого запроса сдвинуты в прошлое, чтобы не попадать в дубликаты
+        self.sent += 1
+        measurements = make_measurements(self.count, start=self.now - self.sent * self.count * 60)
+        nonce = next(self.nonces)
+        timestamp = int(time.time())
+        payload = {
+            'nonce': nonce,
+            'timestamp': timestamp,
+            'encrypted_data': encrypt_measurements(measurements, self.sensor.secret_key, self.payload_format),
+        }
+        if self.payload_format != PAYLOAD_JSON:
+            payload['payload_format'] = self.payload_format
+        payload['signature'] = sign({
+            'path': self.path,
+            'nonce': nonce,
+            'timestamp': timestamp,
+            'body': dict(payload),
+        }, self.sensor.secret_key)
+        return payload
+
+
+@pytest.fixture
+def secret_key():
+    return binascii.hexlify(os.urandom(32)).decode('utf-8')
+
+
+@pytest.fixture
+def sensor(secret_key):
+    sensor = Sensor.objects.create(
+        serial_number=f"BENCH-{binascii.hexlify(os.urandom(4)).decode('utf-8')}",
+        secret_key=secret_key,
+        name='Benchmark sensor',
+    )
+    SensorSettings.objects.create(sensor=sensor)
+    return sensor
+
+
+@pytest.fixture(params=['cache', 'database'])
+def nonce_backend(request, settings, monkeypatch):
+    """Хранилище nonce, пересоздаваемое для выбранного NONCE_BACKEND"""
+    settings.NONCE_BACKEND = request.param
+    monkeypatch.setattr(nonce_store, '_store', None)
+    return request.param
+
+
+@pytest.fixture(autouse=True)
+def postgresql_only(request):
+    """Пропуск тестов с меткой postgresql на других СУБД"""
+    if request.node.get_closest_marker('postgresql') and connection.vendor != 'postgresql':
+        pytest.skip('requires PostgreSQL')
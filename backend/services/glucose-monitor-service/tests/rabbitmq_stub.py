@@ -0,0 +1,180 @@
+"""
+Брокер RabbitMQ в памяти для тестов публикации.
+
+StubBroker.connection_factory заменяет pika.SelectConnection: соединение
+выполняет обратные вызовы в своём ioloop (в потоке публикатора), как
+настоящий SelectConnection, и поддерживает подмножество API канала,
+которым пользуется RabbitMQPublisher.
+"""
+import queue
+import threading
+
+from pika import frame, spec
+
+
+class StubIOLoop:
+    def __init__(self):
+        self._callbacks = queue.Queue()
+        self._stopped = False
+
+    def add_callback_threadsafe(self, callback):
+        if self._stopped:
+            raise RuntimeError('ioloop is stopped')
+        self._callbacks.put(callback)
+
+    def call_soon(self, callback):
+        self._callbacks.put(callback)
+
+    def start(self):
+        while not self._stopped:
+            self._callbacks.get()()
+
+    def stop(self):
+        self._stopped = True
+        self._callbacks.put(lambda: None)
+
+
+class StubChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.is_open = True
+        self._close_callbacks = []
+        self._ack_nack_callback = None
+        self._delivery_tag = 0
+        self._unconfirmed = []  # [(delivery_tag, acked)]
+
+    def add_on_close_callback(self, callback):
+        self._close_callbacks.append(callback)
+
+    def exchange_declare(self, exchange, exchange_type='direct', durable=False, callback=None, **kwargs):
+        self.broker.exchanges[exchange] = (exchange_type, durable)
+        self.connection.ioloop.call_soon(lambda: callback(None))
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self._ack_nack_callback = ack_nack_callback
+        self.connection.ioloop.call_soon(lambda: callback(None))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if not self.is_open:
+            raise RuntimeError('channel is closed')
+        self._delivery_tag += 1
+        acked = self.broker.accept(exchange, routing_key, body, properties)
+        if acked is None:
+            # Брокер "упал": сообщение и неподтверждённые до него потеряны
+            self.connection.drop()
+            return
+        self._unconfirmed.append((self._delivery_tag, acked))
+        if len(self._unconfirmed) == 1 and not self.broker.hold_confirms:
+            self.connection.ioloop.call_soon(self._send_confirms)
+
+    def _send_confirms(self):
+        """Подтверждение накопленных сообщений; подряд идущие ack - одним фреймом с multiple"""
+        if not self.is_open:
+            return
+        unconfirmed, self._unconfirmed = self._unconfirmed, []
+        while unconfirmed:
+            tag, acked = unconfirmed.pop(0)
+            if acked:
+                while unconfirmed and unconfirmed[0][1] and unconfirmed[0][0] == tag + 1:
+                    tag, _ = unconfirmed.pop(0)
+                method = spec.Basic.Ack(delivery_tag=tag, multiple=True)
+            else:
+                method = spec.Basic.Nack(delivery_tag=tag, multiple=False)
+            self.broker.confirm_frames += 1
+            self._ack_nack_callback(frame.Method(1, method))
+
+    def close_from_broker(self, reason):
+        self.is_open = False
+        for callback in self._close_callbacks:
+            callback(self, reason)
+
+
+class StubConnection:
+    def __init__(self, broker, parameters, on_open_callback, on_open_error_callback, on_close_callback):
+        self.broker = broker
+        self.parameters = parameters
+        self.ioloop = StubIOLoop()
+        self.is_open = False
+        self._on_close_callback = on_close_callback
+        self.channels = []
+        if broker.available:
+            broker.connections.append(self)
+            self.is_open = True
+            self.ioloop.call_soon(lambda: on_open_callback(self))
+        else:
+            self.ioloop.call_soon(lambda: on_open_error_callback(self, ConnectionRefusedError('broker is down')))
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self, on_open_callback):
+        channel = StubChannel(self)
+        self.channels.append(channel)
+        self.ioloop.call_soon(lambda: on_open_callback(channel))
+        return channel
+
+    def close(self):
+        if not self.is_open:
+            return
+        self.is_open = False
+        for channel in self.channels:
+            channel.is_open = False
+        self.ioloop.call_soon(lambda: self._on_close_callback(self, 'closed by client'))
+
+    def drop(self):
+        """Обрыв соединения со стороны брокера"""
+        if not self.is_open:
+            return
+        self.is_open = False
+        for channel in self.channels:
+            channel.is_open = False
+        self._on_close_callback(self, ConnectionResetError('connection reset by broker'))
+
+
+class StubBroker:
+    """
+    Брокер: принимает сообщения, подтверждает их пачками.
+
+    nack_routing_keys - сообщения с этими ключами отклоняются (один раз
+    на сообщение, если nack_once); drop_after - соединение обрывается на
+    сообщении с этим порядковым номером (сообщение теряется);
+    hold_confirms - брокер принимает сообщения, но не подтверждает их.
+    """
+
+    def __init__(self):
+        self.available = True
+        self.connections = []
+        self.exchanges = {}
+        self.messages = []  # [(exchange, routing_key, body, properties)]
+        self.nack_routing_keys = set()
+        self.nack_once = True
+        self.drop_after = None
+        self.hold_confirms = False
+        self.confirm_frames = 0
+        self._received = 0
+        self._lock = threading.Lock()
+
+    def connection_factory(self, parameters=None, on_open_callback=None, on_open_error_callback=None,
+                           on_close_callback=None):
+        return StubConnection(self, parameters, on_open_callback, on_open_error_callback, on_close_callback)
+
+    def accept(self, exchange, routing_key, body, properties):
+        with self._lock:
+            self._received += 1
+            if self.drop_after is not None and self._received == self.drop_after:
+                self.drop_after = None
+                return None
+            if routing_key in self.nack_routing_keys:
+                if self.nack_once:
+                    self.nack_routing_keys.discard(routing_key)
+                return False
+            self.messages.append((exchange, routing_key, body, properties))
+            return True
+
+    def close_channels(self, reason='PRECONDITION_FAILED'):
+        for connection in self.connections:
+            for channel in connection.channels:
+                if channel.is_open:
+                    connection.ioloop.add_callback_threadsafe(lambda c=channel: c.close_from_broker(reason))
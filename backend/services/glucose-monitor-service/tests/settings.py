@@ -0,0 +1,36 @@
+"""
+Настройки для тестов и бенчмарков.
+
+BENCHMARK_DB=sqlite - локальная SQLite-база вместо PostgreSQL из config.settings.
+"""
+import os
+import tempfile
+
+from config.settings import *  # noqa: F401,F403
+from config.settings import REST_FRAMEWORK, env
+
+if env('BENCHMARK_DB', default='postgresql') == 'sqlite':
+    # Файловая база: буфер приёма пишет показания из собственного потока
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tempfile.gettempdir(), 'glucose_benchmark.sqlite3'),
+            'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'test_glucose_benchmark.sqlite3')},
+        }
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Все запросы бенчмарка приходят с одного адреса
+REST_FRAMEWORK = {**REST_FRAMEWORK, 'DEFAULT_THROTTLE_CLASSES': []}
+
+# Бенчмарки измеряют путь приёма без публикации уведомлений
+GLUCOSE_ALERTS_ENABLED = False
+INGEST_ACK_MODE = 'flush'
+
+# Тестовая база удаляется раньше, чем выполняются обработчики atexit
+SENSOR_ACTIVITY_FLUSH_ON_EXIT = False
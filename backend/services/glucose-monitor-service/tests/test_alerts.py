@@ -0,0 +1,83 @@
+"""Уведомления о выходе за пороги: подтверждение, подавление повторов и захват отправки"""
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.glucose_monitor.alerts import STATE_KEY, AlertEngine
+
+
+@pytest.fixture(autouse=True)
+def alerts_enabled(settings):
+    settings.GLUCOSE_ALERTS_ENABLED = True
+    settings.ALERT_REPEAT_MINUTES = 30
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def owned_sensor(sensor):
+    sensor.user = get_user_model().objects.create_user(email='owner@example.com', password='password')
+    sensor.save(update_fields=['user'])
+    return sensor
+
+
+class QueuedEngine(AlertEngine):
+    """Движок без потока публикации: уведомления остаются в очереди"""
+
+    def _ensure_started(self):
+        pass
+
+    def alerts(self):
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait()[2])
+        return items
+
+
+@pytest.mark.django_db
+def test_critical_reading_alerts_once_per_repeat_interval(owned_sensor):
+    engine = QueuedEngine(queue_size=10)
+    now = timezone.now()
+
+    assert engine.evaluate([(owned_sensor.pk, now - timedelta(minutes=5), 2.5)]) == 1
+    assert engine.evaluate([(owned_sensor.pk, now, 2.4)]) == 0
+    assert [alert['reason'] for alert in engine.alerts()] == ['critical_low']
+
+
+@pytest.mark.django_db
+def test_low_alert_needs_confirmation(owned_sensor):
+    engine = QueuedEngine(queue_size=10)
+    now = timezone.now()
+
+    assert engine.evaluate([(owned_sensor.pk, now - timedelta(minutes=5), 3.5)]) == 0
+    assert engine.evaluate([(owned_sensor.pk, now, 3.4)]) == 1
+
+
+@pytest.mark.django_db
+def test_concurrent_evaluations_publish_one_alert(owned_sensor):
+    # Два процесса прочитали одно и то же состояние до того, как первый его записал
+    first, second = QueuedEngine(queue_size=10), QueuedEngine(queue_size=10)
+    reading = [(owned_sensor.pk, timezone.now(), 2.5)]
+
+    assert first.evaluate(reading) == 1
+    cache.delete(STATE_KEY.format(owned_sensor.pk))
+
+    assert second.evaluate(reading) == 0
+    assert len(first.alerts()) == 1
+    assert second.alerts() == []
+
+
+@pytest.mark.django_db
+def test_claims_are_per_alert_type(owned_sensor):
+    engine = QueuedEngine(queue_size=10)
+    now = timezone.now()
+
+    assert engine.evaluate([(owned_sensor.pk, now - timedelta(minutes=10), 2.5)]) == 1
+    cache.delete(STATE_KEY.format(owned_sensor.pk))
+
+    assert engine.evaluate([(owned_sensor.pk, now - timedelta(minutes=5), 12.0), (owned_sensor.pk, now, 12.1)]) == 1
+    assert [alert['alert_type'] for alert in engine.alerts()] == ['critical', 'high']
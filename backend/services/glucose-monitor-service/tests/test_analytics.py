@@ -0,0 +1,42 @@
+"""Гликемическая вариабельность: точки разворота и MAGE"""
+import numpy as np
+import pytest
+
+from apps.glucose_monitor.analytics import glycemic_turning_points, local_extrema, mage
+
+
+def test_local_extrema_take_first_index_of_plateau():
+    values = np.array([5.0, 5.0, 7.0, 7.0, 7.0, 4.0, 6.0, 6.0])
+
+    assert local_extrema(values).tolist() == [0, 2, 5, 6]
+    assert local_extrema(np.full(5, 6.0)).tolist() == []
+
+
+@pytest.mark.parametrize('values, expected', [
+    ([5, 9, 5, 9, 5], [9, 5, 9]),
+    # Колебания меньше порога не разрывают подъём
+    ([5, 7, 6.5, 9, 8.5, 10, 6, 5], [10]),
+    # Экстремумы на краях периода не учитываются
+    ([10, 6, 6, 6, 11], [6]),
+    ([5, 6, 5.5, 6], []),
+])
+def test_turning_points(values, expected):
+    assert glycemic_turning_points(np.array(values, dtype=float), 2.0) == expected
+
+
+def test_turning_points_ignore_sensor_noise():
+    rng = np.random.default_rng(0)
+    wave = 7 + 3 * np.cos(np.arange(2000) / 50) + rng.uniform(-0.2, 0.2, 2000)
+
+    points = np.array(glycemic_turning_points(wave, 1.0))
+
+    # Шум не даёт лишних разворотов: остаются только пики ~10 и надиры ~4
+    assert len(points) > 10
+    assert np.all(np.abs(np.abs(np.diff(points[:-1])) - 6) < 0.5)
+
+
+def test_mage_of_regular_wave():
+    values = np.tile([5.0, 7.0, 11.0, 8.0], 10)
+
+    assert mage(values, values.std()) == 6.0
+    assert mage(np.full(10, 6.0), 0.0) == 0.0
@@ -0,0 +1,139 @@
+"""Сборка многочастных batch-отправок enhanced-batch"""
+import itertools
+import time
+
+import pytest
+from rest_framework.test import APIClient
+
+from apps.glucose_monitor.batches import batch_progress, record_next_part, record_part
+from apps.glucose_monitor.models import GlucoseData, SensorBatchData
+from apps.glucose_monitor.payloads import PAYLOAD_JSON
+from .conftest import encrypt_measurements, make_measurements, sign
+
+PART_SIZE = 10
+
+
+class EnhancedBatchClient:
+    """Подписанные части batch с batch_id; показания части определяются её номером"""
+
+    def __init__(self, sensor, batch_id='batch-1'):
+        self.sensor = sensor
+        self.batch_id = batch_id
+        self.path = f"/api/v1/sensor/{sensor.serial_number}/enhanced-batch/"
+        self.nonces = itertools.count(sensor.nonce_window_start + 1)
+        self.start = int(time.time()) - 86400
+
+    def measurements(self, part_number):
+        return make_measurements(PART_SIZE, start=self.start + part_number * PART_SIZE * 60)
+
+    def send(self, part_number, is_final=False, numbered=True):
+        nonce = next(self.nonces)
+        payload = {
+            'nonce': nonce,
+            'timestamp': int(time.time()),
+            'encrypted_data': encrypt_measurements(self.measurements(part_number), self.sensor.secret_key,
+                                                   PAYLOAD_JSON),
+            'batch_id': self.batch_id,
+            'is_final': is_final,
+        }
+        if numbered:
+            payload['part_number'] = part_number
+        payload['signature'] = sign({'path': self.path, 'nonce': nonce, 'timestamp': payload['timestamp'],
+                                     'body': dict(payload)}, self.sensor.secret_key)
+        response = APIClient().post(self.path, payload, format='json')
+        assert response.status_code in (201, 202), response.content
+        return response.json()
+
+
+@pytest.fixture
+def batch(sensor):
+    return EnhancedBatchClient(sensor)
+
+
+def processed_parts(sensor):
+    return SensorBatchData.objects.filter(sensor=sensor, is_processed=True).count()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parts_in_order(batch, sensor):
+    assert batch.send(0)['missing_parts'] == []
+    assert batch.send(1)['status'] == 'part_stored'
+
+    result = batch.send(2, is_final=True)
+
+    assert result['status'] == 'success'
+    assert result['processed_batches'] == 3
+    assert GlucoseData.objects.filter(sensor=sensor).count() == 3 * PART_SIZE
+
+
+@pytest.mark.django_db(transaction=True)
+def test_out_of_order_parts_wait_for_missing(batch, sensor):
+    # Финальная часть пришла первой: известно ожидаемое число частей
+    result = batch.send(3, is_final=True)
+    assert result['status'] == 'part_stored'
+    assert result['missing_parts'] == [0, 1, 2]
+
+    assert batch.send(1)['missing_parts'] == [0, 2]
+    assert batch.send(0)['missing_parts'] == [2]
+    assert processed_parts(sensor) == 0
+
+    result = batch.send(2)
+
+    assert result['status'] == 'success'
+    assert result['processed_batches'] == 4
+    assert processed_parts(sensor) == 4
+    assert GlucoseData.objects.filter(sensor=sensor).count() == 4 * PART_SIZE
+
+
+@pytest.mark.django_db(transaction=True)
+def test_resent_part_is_not_stored_twice(batch, sensor):
+    batch.send(0)
+    result = batch.send(0)
+
+    assert result['received_parts'] == 1
+    assert SensorBatchData.objects.filter(sensor=sensor).count() == 1
+    assert GlucoseData.objects.filter(sensor=sensor).count() == PART_SIZE
+
+
+@pytest.mark.django_db(transaction=True)
+def test_resent_final_part_after_finalization(batch, sensor):
+    batch.send(0)
+    assert batch.send(1, is_final=True)['processed_batches'] == 2
+
+    result = batch.send(1, is_final=True)
+
+    # Повтор закрытого batch ничего не закрывает повторно
+    assert result['status'] == 'success'
+    assert result['processed_batches'] == 0
+    assert GlucoseData.objects.filter(sensor=sensor).count() == 2 * PART_SIZE
+
+
+@pytest.mark.django_db(transaction=True)
+def test_unnumbered_parts_take_next_number(batch, sensor):
+    assert batch.send(0, numbered=False)['part_number'] == 0
+    assert batch.send(1, numbered=False)['part_number'] == 1
+
+    result = batch.send(2, is_final=True, numbered=False)
+
+    assert result['status'] == 'success'
+    assert processed_parts(sensor) == 3
+
+
+@pytest.mark.django_db
+def test_batch_progress_reports_missing_parts(sensor):
+    record_part(sensor, 'b', 4, 10, False)
+    assert batch_progress(sensor, 'b') == (1, None, [])
+
+    record_part(sensor, 'b', 2, 10, False)
+    record_part(sensor, 'b', 5, 10, True)
+
+    assert batch_progress(sensor, 'b') == (3, 6, [0, 1, 3])
+    assert not record_part(sensor, 'b', 2, 10, False)
+
+
+@pytest.mark.django_db
+def test_next_part_number_follows_highest_part(sensor):
+    record_part(sensor, 'b', 0, 10, False)
+    record_part(sensor, 'b', 3, 10, False)
+
+    assert record_next_part(sensor, 'b', 10, False) == 4
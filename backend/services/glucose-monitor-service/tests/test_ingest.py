@@ -0,0 +1,149 @@
+"""Буфер приёма показаний: backpressure, изоляция ошибочных запросов, повторы, режимы подтверждения"""
+import time
+import uuid
+
+import pytest
+from django.db import OperationalError
+from rest_framework.test import APIClient
+
+from apps.glucose_monitor import ingest
+from apps.glucose_monitor.ingest import IngestBuffer, IngestBufferFull, IngestFlushError, store_readings
+from apps.glucose_monitor.models import GlucoseData, Sensor
+from apps.glucose_monitor.payloads import PAYLOAD_JSON
+from .conftest import BatchRequests
+
+
+def readings(count, start=None):
+    start = start or int(time.time()) - 86400
+    return [(5.0 + i % 10, start + i * 60) for i in range(count)]
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    """Буфер, который сбрасывается только явным вызовом flush()"""
+    buffer = IngestBuffer(max_rows=100, flush_rows=10 ** 6, flush_interval=3600)
+    monkeypatch.setattr(ingest, 'ingest_buffer', buffer)
+    return buffer
+
+
+@pytest.fixture
+def missing_sensor():
+    """Сенсор, которого нет в БД: его показания нарушают внешний ключ"""
+    return Sensor(id=uuid.uuid4(), serial_number='MISSING')
+
+
+def test_full_buffer_rejects_readings(buffer, missing_sensor):
+    buffer.submit(missing_sensor, readings(80))
+
+    with pytest.raises(IngestBufferFull):
+        buffer.submit(missing_sensor, readings(30))
+    assert buffer.pending_rows == 80
+
+
+@pytest.mark.django_db(transaction=True)
+def test_full_buffer_returns_503_with_retry_after(buffer, sensor, settings):
+    settings.INGEST_ACK_MODE = 'buffered'
+    buffer.max_rows = 5
+    requests = BatchRequests(sensor, 10, PAYLOAD_JSON)
+
+    response = APIClient().post(requests.path, requests.payload(), format='json')
+
+    assert response.status_code == 503
+    assert response['Retry-After'] == '5'
+    assert buffer.pending_rows == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_request_is_isolated_from_the_flush(buffer, sensor, missing_sensor):
+    first = buffer.submit(sensor, readings(5))
+    bad = buffer.submit(missing_sensor, readings(5))
+    last = buffer.submit(sensor, readings(5, start=int(time.time()) - 3600))
+
+    assert buffer.flush() == 10
+
+    assert first.wait(0) and last.wait(0)
+    with pytest.raises(IngestFlushError):
+        bad.wait(0)
+    assert GlucoseData.objects.filter(sensor=sensor).count() == 10
+    assert buffer.pending_rows == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_transient_failures_are_requeued_up_to_max_attempts(buffer, sensor, settings, monkeypatch):
+    settings.INGEST_MAX_ATTEMPTS = 3
+
+    def unavailable(rows):
+        raise OperationalError('database is unavailable')
+
+    monkeypatch.setattr(buffer, '_commit', unavailable)
+    requeued = buffer.submit(sensor, readings(5), requeue_on_failure=True)
+    waiting = buffer.submit(sensor, readings(5, start=int(time.time()) - 3600))
+
+    for _ in range(2):
+        with pytest.raises(OperationalError):
+            buffer.flush()
+        assert buffer.pending_rows == 5
+    with pytest.raises(IngestFlushError):
+        waiting.wait(0)
+    assert not requeued.wait(0)
+
+    with pytest.raises(OperationalError):
+        buffer.flush()
+    assert buffer.pending_rows == 0
+    with pytest.raises(IngestFlushError):
+        requeued.wait(0)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_requeued_readings_are_stored_after_recovery(buffer, sensor, monkeypatch):
+    commit = buffer._commit
+    failures = iter([OperationalError('database is unavailable')])
+
+    def flaky(rows):
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        return commit(rows)
+
+    monkeypatch.setattr(buffer, '_commit', flaky)
+    ticket = buffer.submit(sensor, readings(5), requeue_on_failure=True)
+
+    with pytest.raises(OperationalError):
+        buffer.flush()
+    assert buffer.flush() == 5
+    assert ticket.wait(0)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_flush_ack_mode_waits_for_database(sensor, settings, monkeypatch):
+    settings.INGEST_ACK_MODE = 'flush'
+    monkeypatch.setattr(ingest, 'ingest_buffer', IngestBuffer(max_rows=100, flush_rows=10 ** 6,
+                                                              flush_interval=0.05))
+
+    assert store_readings(sensor, readings(5)) is True
+    assert GlucoseData.objects.filter(sensor=sensor).count() == 5
+
+
+@pytest.mark.django_db(transaction=True)
+def test_buffered_ack_mode_returns_before_flush(buffer, sensor, settings):
+    settings.INGEST_ACK_MODE = 'buffered'
+
+    assert store_readings(sensor, readings(5)) is False
+    assert not GlucoseData.objects.filter(sensor=sensor).exists()
+    assert buffer.flush() == 5
+    assert GlucoseData.objects.filter(sensor=sensor).count() == 5
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('ack_mode, status_code', [('flush', 201), ('buffered', 202)])
+def test_batch_view_status_follows_ack_mode(sensor, settings, monkeypatch, ack_mode, status_code):
+    settings.INGEST_ACK_MODE = ack_mode
+    monkeypatch.setattr(ingest, 'ingest_buffer', IngestBuffer(max_rows=100, flush_rows=10 ** 6,
+                                                              flush_interval=0.05))
+    requests = BatchRequests(sensor, 10, PAYLOAD_JSON)
+
+    response = APIClient().post(requests.path, requests.payload(), format='json')
+    ingest.ingest_buffer.flush()
+
+    assert response.status_code == status_code, response.content
+    assert GlucoseData.objects.filter(sensor=sensor).count() == 10
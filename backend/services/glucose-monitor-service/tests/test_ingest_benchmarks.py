@@ -0,0 +1,30 @@
+"""Бенчмарки полного пути BatchDataView: аутентификация, дешифрование, запись показаний"""
+import pytest
+from rest_framework.test import APIClient
+
+from apps.glucose_monitor.models import GlucoseData
+from apps.glucose_monitor.payloads import PAYLOAD_BINARY_V1, PAYLOAD_JSON
+from .conftest import BatchRequests
+
+ROUNDS = 20
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.benchmark(group='batch-view')
+@pytest.mark.parametrize('payload_format', [PAYLOAD_JSON, PAYLOAD_BINARY_V1])
+@pytest.mark.parametrize('count', [10, 1000])
+def test_batch_view(benchmark, sensor, count, payload_format):
+    client = APIClient()
+    requests = BatchRequests(sensor, count, payload_format)
+
+    responses = []
+
+    def post(payload):
+        responses.append(client.post(requests.path, payload, format='json'))
+
+    benchmark.pedantic(post, setup=requests, rounds=ROUNDS)
+    # С --benchmark-disable выполняется один раунд вместо ROUNDS
+    assert len(responses) == requests.sent
+    for response in responses:
+        assert response.status_code == 201, response.content
+    assert GlucoseData.objects.filter(sensor=sensor).count() == count * requests.sent
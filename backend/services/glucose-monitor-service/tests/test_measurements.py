@@ -0,0 +1,126 @@
+"""История показаний сенсора: прореживание lttb/minmax и постраничная выдача raw"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from apps.glucose_monitor.downsampling import bucket_stats
+from apps.glucose_monitor.models import GlucoseData, GlucoseRollup
+from apps.glucose_monitor.rollups import update_rollups
+
+START = datetime(2024, 3, 1, tzinfo=dt_timezone.utc)
+
+
+@pytest.fixture
+def client(sensor):
+    user = get_user_model().objects.create_user(email='owner@example.com', password='password')
+    sensor.user = user
+    sensor.save(update_fields=['user'])
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def ingest(sensor, readings, rollups=True):
+    GlucoseData.objects.bulk_create([
+        GlucoseData(sensor=sensor, value=value, measured_at=measured_at) for measured_at, value in readings
+    ])
+    if rollups:
+        update_rollups([(sensor.pk, measured_at, value) for measured_at, value in readings])
+
+
+def readings(count, step=300, start=START):
+    return [(start + timedelta(seconds=i * step), 4.0 + i % 40 / 5) for i in range(count)]
+
+
+def fetch(client, sensor, **params):
+    params = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in params.items()}
+    response = client.get(f'/api/v1/sensors/{sensor.id}/measurements/', params)
+    assert response.status_code == 200, response.content
+    return response.json()
+
+
+def raw_stats(series, start, end, bucket_count):
+    return bucket_stats([(measured_at.timestamp(), value) for measured_at, value in series
+                         if start <= measured_at < end], bucket_count, start.timestamp(), end.timestamp())
+
+
+@pytest.mark.django_db
+def test_lttb_keeps_period_edges(client, sensor):
+    ingest(sensor, readings(500))
+
+    data = fetch(client, sensor, start=START, end=START + timedelta(days=2), max_points=50)
+
+    assert data['count'] == 500
+    assert len(data['points']) == 50
+    assert data['points'][0]['t'] == int(START.timestamp())
+    assert data['points'][-1]['t'] == int((START + timedelta(seconds=499 * 300)).timestamp())
+
+
+@pytest.mark.django_db
+def test_minmax_from_rollups_matches_raw_readings(client, sensor):
+    series = readings(2000)
+    ingest(sensor, series)
+    # Корзины по 4 часа совпадают с границами часовых агрегатов
+    start = START + timedelta(hours=1)
+    end = start + timedelta(hours=4 * 40)
+
+    data = fetch(client, sensor, resolution='minmax', start=start, end=end, max_points=40)
+
+    expected = raw_stats(series, start, end, 40)
+    assert data['count'] == sum(point['count'] for point in expected)
+    assert [(p['t'], p['min'], p['max'], p['count']) for p in data['points']] == \
+        [(p['t'], p['min'], p['max'], p['count']) for p in expected]
+
+
+@pytest.mark.django_db
+def test_minmax_reads_partial_edge_buckets_from_raw_readings(client, sensor):
+    series = readings(2000)
+    ingest(sensor, series)
+    # Границы периода внутри часовых агрегатов: края берутся из сырых показаний
+    start = START + timedelta(minutes=50)
+    end = START + timedelta(days=6, minutes=20)
+
+    data = fetch(client, sensor, resolution='minmax', start=start, end=end, max_points=40)
+
+    inside = [value for measured_at, value in series if start <= measured_at < end]
+    assert data['count'] == len(inside)
+    assert min(p['min'] for p in data['points']) == min(inside)
+    assert max(p['max'] for p in data['points']) == max(inside)
+    assert data['points'][0]['t'] == int(start.timestamp())
+
+
+@pytest.mark.django_db
+def test_minmax_reads_raw_readings_when_rollups_are_disabled(client, sensor, settings):
+    settings.GLUCOSE_ROLLUPS_ON_INGEST = False
+    series = readings(2000)
+    ingest(sensor, series, rollups=False)
+    end = START + timedelta(days=7)
+
+    data = fetch(client, sensor, resolution='minmax', start=START, end=end, max_points=40)
+
+    assert not GlucoseRollup.objects.exists()
+    assert data['count'] == 2000
+    assert data['points'] == raw_stats(series, START, end, 40)
+
+
+@pytest.mark.django_db
+def test_raw_pages_return_every_reading_once(client, sensor):
+    # Несколько показаний в пределах одной секунды на границе страниц
+    series = [(START + timedelta(seconds=i // 4, microseconds=i % 4 * 200000), 5.0 + i / 100) for i in range(40)]
+    ingest(sensor, series, rollups=False)
+    params = {'resolution': 'raw', 'start': START, 'end': START + timedelta(hours=1), 'limit': 6}
+
+    values, pages = [], 0
+    cursor = None
+    while True:
+        data = fetch(client, sensor, **params, **({'cursor': cursor} if cursor else {}))
+        values.extend(point['v'] for point in data['points'])
+        pages += 1
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+
+    assert pages == 7
+    assert values == [value for _, value in series]
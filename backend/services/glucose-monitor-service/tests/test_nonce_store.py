@@ -0,0 +1,211 @@
+"""Хранилища nonce: битовые карты окна, переключение на резервное хранилище и возврат"""
+import time
+
+import pytest
+
+from apps.glucose_monitor.nonce_store import (
+    DatabaseNonceStore, FallbackNonceStore, LocalNonceBitmap, RedisNonceBitmap
+)
+from apps.glucose_monitor.security import check_nonce_advanced
+
+
+class StubRedis:
+    """Подмножество команд Redis, которыми пользуется RedisNonceBitmap"""
+
+    def __init__(self):
+        self.bitmaps = {}
+        self.ttls = {}
+
+    def pipeline(self):
+        return StubPipeline(self)
+
+    def setbit(self, key, offset, value):
+        bits = self.bitmaps.setdefault(key, set())
+        previous = int(offset in bits)
+        if value:
+            bits.add(offset)
+        else:
+            bits.discard(offset)
+        return previous
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+        return True
+
+    def delete(self, key):
+        self.ttls.pop(key, None)
+        return int(self.bitmaps.pop(key, None) is not None)
+
+    def bitcount(self, key):
+        return len(self.bitmaps.get(key, ()))
+
+    def ping(self):
+        return True
+
+
+class StubPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args) for name, args in self.commands]
+
+
+class FlakyStore(LocalNonceBitmap):
+    """Основное хранилище, которое можно "уронить" на время теста"""
+    name = 'flaky'
+
+    def __init__(self, ttl):
+        super().__init__(ttl)
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError('nonce store is down')
+
+    def check_and_set(self, *args):
+        self._check()
+        return super().check_and_set(*args)
+
+    def advance_window(self, *args):
+        self._check()
+        return super().advance_window(*args)
+
+    def count_used(self, *args):
+        self._check()
+        return super().count_used(*args)
+
+    def mark_used(self, entries):
+        self._check()
+        return super().mark_used(entries)
+
+
+@pytest.fixture(params=['local', 'redis'])
+def bitmap(request):
+    if request.param == 'redis':
+        return RedisNonceBitmap(StubRedis(), ttl=60)
+    return LocalNonceBitmap(ttl=60)
+
+
+@pytest.fixture
+def primary():
+    return FlakyStore(ttl=60)
+
+
+@pytest.fixture
+def store(primary):
+    store = FallbackNonceStore(primary, DatabaseNonceStore(), replay_horizon=600)
+    store.RECOVERY_INTERVAL = 0
+    return store
+
+
+@pytest.mark.django_db
+def test_replay_in_window_is_rejected(bitmap, sensor):
+    assert bitmap.check_and_set(sensor, 0, 5)
+    assert bitmap.check_and_set(sensor, 0, 6)
+    assert not bitmap.check_and_set(sensor, 0, 5)
+    assert bitmap.count_used(sensor, 0) == 2
+
+
+@pytest.mark.django_db
+def test_advance_window_drops_old_bitmap(bitmap, sensor):
+    bitmap.check_and_set(sensor, 0, 5)
+
+    bitmap.advance_window(sensor, 0, 1000)
+
+    assert bitmap.count_used(sensor, 0) == 0
+    assert bitmap.check_and_set(sensor, 1000, 1005)
+    assert not bitmap.check_and_set(sensor, 1000, 1005)
+
+
+@pytest.mark.django_db
+def test_mark_used_ignores_nonces_outside_current_window(bitmap, sensor):
+    bitmap.mark_used([(sensor.id, 1000, 1000, 1005), (sensor.id, 1000, 1000, 5)])
+
+    assert not bitmap.check_and_set(sensor, 1000, 1005)
+    assert bitmap.count_used(sensor, 1000) == 1
+
+
+@pytest.mark.django_db
+def test_fallback_rejects_windows_opened_before_failure(store, primary, sensor):
+    assert store.check_and_set(sensor, 0, 5)
+    primary.down = True
+
+    # Основное хранилище могло принять любой nonce этого окна до сбоя
+    assert not store.check_and_set(sensor, 0, 5)
+    assert not store.check_and_set(sensor, 0, 6)
+
+
+@pytest.mark.django_db
+def test_fallback_trusts_database_after_replay_horizon(store, primary, sensor, monkeypatch):
+    store.check_and_set(sensor, 0, 5)
+    primary.down = True
+    store.check_and_set(sensor, 0, 6)
+
+    now = time.monotonic() + store.replay_horizon
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+
+    assert store.check_and_set(sensor, 0, 6)
+    assert not store.check_and_set(sensor, 0, 6)
+
+
+@pytest.mark.django_db
+def test_fallback_checks_windows_opened_during_failure(store, primary, sensor):
+    store.check_and_set(sensor, 0, 5)
+    primary.down = True
+
+    store.advance_window(sensor, 0, 1000)
+
+    assert store.check_and_set(sensor, 1000, 1001)
+    assert not store.check_and_set(sensor, 1000, 1001)
+    assert store.count_used(sensor, 1000) == 1
+
+
+@pytest.mark.django_db
+def test_recovery_copies_fallback_nonces_to_primary(store, primary, sensor):
+    primary.down = True
+    store.advance_window(sensor, 0, 1000)
+    sensor.nonce_window_start = 1000
+    sensor.save(update_fields=['nonce_window_start'])
+    assert store.check_and_set(sensor, 1000, 1001)
+
+    primary.down = False
+
+    assert not store.check_and_set(sensor, 1000, 1001)
+    assert store.check_and_set(sensor, 1000, 1002)
+    # Проверка снова идёт через основное хранилище
+    assert primary.count_used(sensor, 1000) == 2
+
+
+@pytest.mark.django_db
+def test_recovery_waits_while_primary_is_down(store, primary, sensor):
+    primary.down = True
+    store.advance_window(sensor, 0, 1000)
+    store.check_and_set(sensor, 1000, 1001)
+
+    assert store.check_and_set(sensor, 1000, 1002)
+    assert store._failed_at is not None
+
+
+@pytest.mark.django_db
+def test_check_nonce_advanced_rejects_replay(sensor, nonce_backend):
+    timestamp = int(time.time())
+
+    assert check_nonce_advanced(sensor, 1, timestamp) == (True, "OK")
+    assert check_nonce_advanced(sensor, 1, timestamp) == (False, "Nonce already used")
+
+
+@pytest.mark.django_db
+def test_check_nonce_advanced_moves_window(sensor, nonce_backend):
+    nonce = sensor.nonce_window_start + sensor.nonce_window_size
+
+    accepted, _ = check_nonce_advanced(sensor, nonce, int(time.time()))
+
+    assert accepted
+    sensor.refresh_from_db()
+    assert sensor.nonce_window_start == nonce
+    assert not check_nonce_advanced(sensor, nonce, int(time.time()))[0]
@@ -0,0 +1,90 @@
+"""Помесячное секционирование таблицы показаний (только PostgreSQL)"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import pytest
+from django.db import connection
+
+from apps.glucose_monitor import partitions
+from apps.glucose_monitor.models import GlucoseData
+from apps.glucose_monitor.partitions import add_months, month_start, partition_name
+
+pytestmark = [pytest.mark.postgresql, pytest.mark.django_db]
+
+NOW = month_start(datetime.now(dt_timezone.utc))
+
+
+def row_count(table):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+
+def readings(sensor, month, count=3):
+    return [GlucoseData(sensor=sensor, value=5.0 + i, measured_at=month + timedelta(days=i, hours=1))
+            for i in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def immediate_constraints():
+    # DDL в транзакции теста невозможен при отложенных проверках внешних ключей
+    with connection.cursor() as cursor:
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+
+@pytest.fixture
+def partitioned(sensor):
+    """Таблица показаний за 14 месяцев, преобразованная в секционированную"""
+    months = [add_months(NOW, -offset) for offset in (14, 13, 1, 0)]
+    GlucoseData.objects.bulk_create([reading for month in months for reading in readings(sensor, month)])
+    assert not partitions.is_partitioned()
+
+    assert partitions.convert_to_partitioned(months_ahead=1) == 12
+    return months
+
+
+def test_convert_creates_monthly_partitions(partitioned):
+    assert partitions.is_partitioned()
+    names = [name for name, _ in partitions.list_partitions()]
+    assert names[0] == partition_name(add_months(NOW, -14))
+    assert names[-1] == partition_name(add_months(NOW, 1))
+    assert len(names) == 16
+    for month in partitioned:
+        assert row_count(partition_name(month)) == 3
+    assert row_count(partitions.default_partition_name()) == 0
+    assert GlucoseData.objects.count() == 12
+
+
+def test_create_partition_moves_rows_from_default(partitioned, sensor):
+    future = add_months(NOW, 6)
+    GlucoseData.objects.bulk_create(readings(sensor, future, count=2))
+    assert row_count(partitions.default_partition_name()) == 2
+
+    created = partitions.ensure_partitions(months_ahead=6)
+
+    assert partition_name(future) in created
+    assert row_count(partitions.default_partition_name()) == 0
+    assert row_count(partition_name(future)) == 2
+    # Уникальность (sensor, measured_at) действует и в присоединённой секции
+    assert GlucoseData.objects.filter(sensor=sensor, measured_at__gte=future).count() == 2
+
+
+def test_detach_expired_partitions_to_archive(partitioned):
+    expired = [partition_name(add_months(NOW, -14)), partition_name(add_months(NOW, -13))]
+
+    detached = partitions.detach_expired_partitions(retention_months=12)
+
+    assert detached == expired
+    assert GlucoseData.objects.count() == 6
+    for name in expired:
+        assert row_count(f"{partitions.ARCHIVE_SCHEMA}.{name}") == 3
+    assert partitions.detach_expired_partitions(retention_months=12) == []
+
+
+def test_detach_expired_partitions_drop(partitioned):
+    detached = partitions.detach_expired_partitions(retention_months=1, archive=False)
+
+    assert len(detached) == 13
+    assert [name for name, _ in partitions.list_partitions()] == [
+        partition_name(add_months(NOW, -1)), partition_name(NOW), partition_name(add_months(NOW, 1))
+    ]
+    assert GlucoseData.objects.count() == 6
@@ -0,0 +1,128 @@
+"""Форматы batch-данных: разбор binary-v1, ограничение распаковки и совместимость с генератором"""
+import os
+import sys
+import time
+import zlib
+
+import pytest
+from rest_framework.test import APIClient
+
+from apps.glucose_monitor.payloads import (
+    BINARY_HEADER, COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSIONS, PAYLOAD_BINARY_V1, PAYLOAD_FORMATS,
+    PayloadTooLarge, decode_binary_batch, decompress_payload, decrypt_readings, encode_binary_batch
+)
+from .conftest import make_measurements, sign
+
+# Генератор устройства лежит в каталоге backend/ репозитория
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+generator = pytest.importorskip('secure_glucose_generator')
+
+
+def binary_batch(count):
+    measurements = make_measurements(count)
+    return encode_binary_batch([m['timestamp'] for m in measurements], [m['value'] for m in measurements])
+
+
+def test_binary_round_trip():
+    measurements = make_measurements(50)
+
+    timestamps, values = decode_binary_batch(binary_batch(50))
+
+    assert timestamps.tolist() == [m['timestamp'] for m in measurements]
+    assert values.tolist() == [m['value'] for m in measurements]
+
+
+@pytest.mark.parametrize('size', [0, 1, BINARY_HEADER.size - 1])
+def test_truncated_binary_header(size):
+    with pytest.raises(ValueError, match='too short'):
+        decode_binary_batch(binary_batch(3)[:size])
+
+
+@pytest.mark.parametrize('data', [
+    binary_batch(3)[:-1],
+    binary_batch(3) + b'\0' * 6,
+    binary_batch(3)[:BINARY_HEADER.size],
+], ids=['truncated record', 'extra record', 'header only'])
+def test_count_disagreeing_with_length(data):
+    with pytest.raises(ValueError, match='count mismatch'):
+        decode_binary_batch(data)
+
+
+def test_invalid_binary_magic():
+    with pytest.raises(ValueError, match='magic'):
+        decode_binary_batch(b'XYZ' + binary_batch(3)[3:])
+
+
+def test_count_over_limit_is_rejected_before_reading_records():
+    # Проверка лимита не зависит от длины данных
+    with pytest.raises(PayloadTooLarge):
+        decode_binary_batch(binary_batch(10)[:BINARY_HEADER.size], max_count=5)
+
+
+def test_decompression_is_bounded():
+    bomb = zlib.compress(b'\0' * (10 * 1024 * 1024), 9)
+
+    with pytest.raises(PayloadTooLarge):
+        decompress_payload(bomb, COMPRESSION_ZLIB, 1024)
+
+
+def test_uncompressed_payload_over_limit():
+    with pytest.raises(PayloadTooLarge):
+        decompress_payload(b'x' * 1025, COMPRESSION_NONE, 1024)
+
+
+def test_truncated_compressed_payload():
+    with pytest.raises(ValueError, match='Truncated'):
+        decompress_payload(zlib.compress(b'x' * 1000)[:-4], COMPRESSION_ZLIB, 1024)
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+@pytest.mark.parametrize('payload_format', PAYLOAD_FORMATS)
+def test_generator_payload_round_trip(secret_key, payload_format, compression):
+    measurements = make_measurements(200)
+    encrypted = generator.encrypt_measurements(secret_key, measurements, payload_format, compression)
+
+    readings, total, rejected = decrypt_readings(encrypted, secret_key, payload_format, compression)
+
+    assert (total, rejected) == (200, 0)
+    assert readings == [(m['value'], m['timestamp']) for m in measurements]
+
+
+def test_generator_binary_encoding_matches_server():
+    measurements = make_measurements(20)
+
+    assert generator.encode_binary_measurements(measurements) == \
+        encode_binary_batch([m['timestamp'] for m in measurements], [m['value'] for m in measurements])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('payload_format', PAYLOAD_FORMATS)
+def test_oversized_batch_returns_limits(sensor, nonce_backend, settings, payload_format):
+    settings.BATCH_MAX_PAYLOAD_BYTES = 64 * 1024
+    if payload_format == PAYLOAD_BINARY_V1:
+        # Сжатый "нулевой" пакет: мал при передаче, огромен после распаковки
+        plaintext = b'GLB\1' + b'\0' * (10 * 1024 * 1024)
+        encrypted = generator.encrypt_bytes(sensor.secret_key, zlib.compress(plaintext, 9))
+    else:
+        encrypted = generator.encrypt_measurements(sensor.secret_key, make_measurements(5000), payload_format,
+                                                   COMPRESSION_ZLIB)
+    path = f"/api/v1/sensor/{sensor.serial_number}/batch/"
+    nonce = sensor.nonce_window_start + 1
+    payload = {
+        'nonce': nonce,
+        'timestamp': int(time.time()),
+        'encrypted_data': encrypted,
+        'payload_format': payload_format,
+        'compression': COMPRESSION_ZLIB,
+    }
+    payload['signature'] = sign({'path': path, 'nonce': nonce, 'timestamp': payload['timestamp'],
+                                 'body': dict(payload)}, sensor.secret_key)
+
+    response = APIClient().post(path, payload, format='json')
+
+    assert response.status_code == 413, response.content
+    assert response.json()['code'] == 'batch_too_large'
+    assert response.json()['batch_limits'] == {
+        'max_measurements': settings.BATCH_MAX_MEASUREMENTS,
+        'max_payload_bytes': 64 * 1024,
+    }
@@ -0,0 +1,79 @@
+"""Агрегаты показаний: приращения при приёме и посуточный пересчёт"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import pytest
+
+from apps.glucose_monitor import rollups
+from apps.glucose_monitor.models import GlucoseData, GlucoseRollup
+from apps.glucose_monitor.rollups import accumulate, get_thresholds, rebuild_rollups, update_rollups
+
+DAY = datetime(2024, 3, 1, tzinfo=dt_timezone.utc)
+
+
+def ingest(sensor, readings):
+    """Запись показаний и приращений агрегатов, как при сбросе буфера приёма"""
+    GlucoseData.objects.bulk_create([
+        GlucoseData(sensor=sensor, value=value, measured_at=measured_at) for measured_at, value in readings
+    ])
+    update_rollups([(sensor.pk, measured_at, value) for measured_at, value in readings])
+
+
+def stored_rollups():
+    return {
+        (row['sensor_id'], row['resolution'], row['bucket_start']): [row[field] for field in rollups.STAT_FIELDS]
+        for row in GlucoseRollup.objects.values('sensor_id', 'resolution', 'bucket_start', *rollups.STAT_FIELDS)
+    }
+
+
+def expected_rollups(sensor):
+    readings = GlucoseData.objects.filter(sensor=sensor).values_list('sensor_id', 'measured_at', 'value')
+    return accumulate(readings, get_thresholds({sensor.pk}))
+
+
+def readings_of_day(day, count, step=600, value=5.0):
+    return [(day + timedelta(seconds=i * step), value + i % 10) for i in range(count)]
+
+
+@pytest.mark.django_db
+def test_rebuild_matches_ingested_rollups(sensor):
+    ingest(sensor, readings_of_day(DAY, 50) + readings_of_day(DAY + timedelta(days=1), 50))
+    before = stored_rollups()
+
+    rebuild_rollups(DAY, DAY + timedelta(days=2))
+
+    assert stored_rollups() == before == expected_rollups(sensor)
+
+
+@pytest.mark.django_db
+def test_rebuild_replaces_stale_rollups(sensor):
+    ingest(sensor, readings_of_day(DAY, 20))
+    GlucoseRollup.objects.update(count=999)
+
+    rebuild_rollups(DAY, DAY + timedelta(days=1))
+
+    assert stored_rollups() == expected_rollups(sensor)
+
+
+@pytest.mark.django_db
+def test_ingest_between_rebuilt_days_is_counted_once(sensor, monkeypatch):
+    first, second = DAY, DAY + timedelta(days=1)
+    ingest(sensor, readings_of_day(first, 30) + readings_of_day(second, 30))
+    rebuild_day = rollups.rebuild_day
+    rebuilt = []
+
+    def rebuild_then_ingest(day, sensor_ids=None):
+        created = rebuild_day(day, sensor_ids)
+        rebuilt.append(day)
+        if day == first:
+            # Приём между транзакциями суток: уже пересчитанные и ещё не пересчитанные сутки
+            ingest(sensor, [(first + timedelta(hours=23, minutes=59), 12.0),
+                            (second + timedelta(hours=23, minutes=59), 3.0)])
+        return created
+
+    monkeypatch.setattr(rollups, 'rebuild_day', rebuild_then_ingest)
+    rebuild_rollups(first, second + timedelta(days=1))
+
+    assert rebuilt == [first, second]
+    assert stored_rollups() == expected_rollups(sensor)
+    daily = GlucoseRollup.objects.filter(resolution='1d').order_by('bucket_start')
+    assert list(daily.values_list('count', flat=True)) == [31, 31]
@@ -0,0 +1,151 @@
+"""Подпись v2 по сырому телу и выбор схемы подписи запроса сенсора"""
+import base64
+import hashlib
+import hmac
+import io
+import json
+import time
+
+import pytest
+from rest_framework.test import APIClient
+
+from apps.glucose_monitor.security import (
+    SIGNATURE_V2, SignedBodyTooLarge, read_signed_body, signature_v2_mac, signature_v2_prefix, verify_digest
+)
+from .conftest import sign
+
+
+def single_path(sensor):
+    return f"/api/v1/sensor/{sensor.serial_number}/single/"
+
+
+def single_body(nonce, timestamp=None):
+    return {'value': 6.5, 'nonce': nonce, 'timestamp': timestamp or int(time.time()), 'sequence_id': nonce}
+
+
+def v2_request(sensor, body, nonce, path=None, method='POST'):
+    """Тело и заголовки запроса с подписью v2"""
+    raw = json.dumps(body).encode('utf-8')
+    timestamp = body['timestamp']
+    mac = signature_v2_mac(sensor.secret_key, method, path or single_path(sensor), nonce, timestamp)
+    mac.update(raw)
+    return raw, {
+        'HTTP_X_SENSOR_SIGNATURE': base64.b64encode(mac.digest()).decode('utf-8'),
+        'HTTP_X_SENSOR_NONCE': str(nonce),
+        'HTTP_X_SENSOR_TIMESTAMP': str(timestamp),
+    }
+
+
+def post_v2(sensor, raw, headers, path=None):
+    return APIClient().post(path or single_path(sensor), raw, content_type='application/json', **headers)
+
+
+def post_v1(sensor, nonce):
+    body = single_body(nonce)
+    path = single_path(sensor)
+    body['signature'] = sign({'path': path, 'nonce': nonce, 'timestamp': body['timestamp'], 'body': dict(body)},
+                             sensor.secret_key)
+    return APIClient().post(path, body, format='json')
+
+
+def test_signed_body_is_read_in_chunks():
+    body = bytes(range(256)) * 40
+    key = '00' * 32
+
+    read, digest = read_signed_body(io.BytesIO(body), signature_v2_mac(key, 'post', '/p/', 1, 2), 10 ** 6,
+                                    chunk_size=1000)
+
+    assert read == body
+    assert digest == hmac.new(bytes(32), signature_v2_prefix('POST', '/p/', 1, 2) + body, hashlib.sha512).digest()
+
+
+def test_empty_signed_body():
+    mac = signature_v2_mac('00' * 32, 'POST', '/p/', 1, 2)
+    expected = mac.copy().digest()
+
+    assert read_signed_body(None, mac, 10) == (b'', expected)
+
+
+def test_signed_body_over_limit_is_rejected():
+    with pytest.raises(SignedBodyTooLarge):
+        read_signed_body(io.BytesIO(b'x' * 101), signature_v2_mac('00' * 32, 'POST', '/p/', 1, 2), 100,
+                         chunk_size=10)
+
+
+def test_verify_digest():
+    digest = hashlib.sha512(b'body').digest()
+    tampered = bytes([digest[0] ^ 1]) + digest[1:]
+
+    assert verify_digest(base64.b64encode(digest).decode('utf-8'), digest)
+    assert not verify_digest(base64.b64encode(tampered).decode('utf-8'), digest)
+    assert not verify_digest('not base64!', digest)
+
+
+@pytest.mark.parametrize('method, path', [('POST', '/a/'), ('PUT', '/b/')])
+def test_signature_v2_covers_method_and_path(method, path):
+    key = '11' * 32
+
+    assert signature_v2_mac(key, method, path, 1, 2).digest() != signature_v2_mac(key, 'POST', '/b/', 1, 2).digest()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_v2_request_is_accepted(sensor, nonce_backend):
+    nonce = sensor.nonce_window_start + 1
+    raw, headers = v2_request(sensor, single_body(nonce), nonce)
+
+    response = post_v2(sensor, raw, headers)
+
+    assert response.status_code == 201, response.content
+
+
+@pytest.mark.django_db
+def test_v2_tampered_body_is_rejected(sensor, nonce_backend):
+    nonce = sensor.nonce_window_start + 1
+    raw, headers = v2_request(sensor, single_body(nonce), nonce)
+
+    response = post_v2(sensor, raw.replace(b'6.5', b'9.5'), headers)
+
+    assert response.status_code == 401
+    assert response.json()['error'] == 'Invalid signature'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('method, path', [('POST', '/api/v1/sensor/OTHER/single/'), ('PUT', None)])
+def test_v2_signature_for_other_request_is_rejected(sensor, nonce_backend, method, path):
+    nonce = sensor.nonce_window_start + 1
+    raw, headers = v2_request(sensor, single_body(nonce), nonce, path=path, method=method)
+
+    response = post_v2(sensor, raw, headers)
+
+    assert response.status_code == 401
+    assert response.json()['error'] == 'Invalid signature'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_v2_nonce_replay_is_rejected(sensor, nonce_backend):
+    nonce = sensor.nonce_window_start + 1
+    raw, headers = v2_request(sensor, single_body(nonce), nonce)
+
+    assert post_v2(sensor, raw, headers).status_code == 201
+    response = post_v2(sensor, raw, headers)
+
+    assert response.status_code == 401
+    assert 'Invalid nonce' in response.json()['error']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_v1_request_is_accepted(sensor, nonce_backend):
+    response = post_v1(sensor, sensor.nonce_window_start + 1)
+
+    assert response.status_code == 201, response.content
+
+
+@pytest.mark.django_db
+def test_v1_is_disabled_for_v2_only_sensor(sensor, nonce_backend):
+    sensor.signature_version = SIGNATURE_V2
+    sensor.save(update_fields=['signature_version'])
+
+    response = post_v1(sensor, sensor.nonce_window_start + 1)
+
+    assert response.status_code == 401
+    assert 'scheme v1 is disabled' in response.json()['error']
@@ -0,0 +1,85 @@
+"""Бенчмарки примитивов безопасности: подпись, шифрование, разбор batch, проверка nonce"""
+import itertools
+import time
+
+import pytest
+
+from apps.glucose_monitor.payloads import PAYLOAD_BINARY_V1, PAYLOAD_JSON, decrypt_readings
+from apps.glucose_monitor.security import (
+    check_nonce_advanced, decrypt_batch_data, decrypt_payload, encrypt_batch_data, encrypt_payload,
+    generate_hmac_signature, verify_signature
+)
+from .conftest import encrypt_measurements, make_measurements
+
+READING_COUNTS = [10, 1000, 10000]
+
+
+@pytest.fixture
+def sign_data():
+    return {
+        'path': '/api/v1/sensor/BENCH-1/single/',
+        'nonce': 1001,
+        'timestamp': int(time.time()),
+        'body': {'value': 5.6, 'timestamp': int(time.time()), 'nonce': 1001, 'sequence_id': 1001},
+    }
+
+
+@pytest.mark.benchmark(group='signature')
+def test_generate_hmac_signature(benchmark, sign_data, secret_key):
+    benchmark(generate_hmac_signature, sign_data, secret_key)
+
+
+@pytest.mark.benchmark(group='signature')
+def test_verify_signature(benchmark, sign_data, secret_key):
+    signature = generate_hmac_signature(sign_data, secret_key)
+    assert benchmark(verify_signature, sign_data, signature, secret_key)
+
+
+@pytest.mark.benchmark(group='encryption')
+def test_encrypt_payload(benchmark, secret_key):
+    benchmark(encrypt_payload, {'measurements': make_measurements(100), 'count': 100}, secret_key)
+
+
+@pytest.mark.benchmark(group='encryption')
+def test_decrypt_payload(benchmark, secret_key):
+    encrypted = encrypt_payload({'measurements': make_measurements(100), 'count': 100}, secret_key)
+    benchmark(decrypt_payload, encrypted, secret_key)
+
+
+@pytest.mark.benchmark(group='decrypt-batch')
+@pytest.mark.parametrize('count', READING_COUNTS)
+def test_decrypt_batch_data(benchmark, secret_key, count):
+    encrypted = encrypt_batch_data(make_measurements(count), secret_key)
+    assert len(benchmark(decrypt_batch_data, encrypted, secret_key)) == count
+
+
+@pytest.mark.benchmark(group='decrypt-readings')
+@pytest.mark.parametrize('payload_format', [PAYLOAD_JSON, PAYLOAD_BINARY_V1])
+@pytest.mark.parametrize('count', READING_COUNTS)
+def test_decrypt_readings(benchmark, settings, secret_key, payload_format, count):
+    settings.BATCH_MAX_MEASUREMENTS = max(count, settings.BATCH_MAX_MEASUREMENTS)
+    encrypted = encrypt_measurements(make_measurements(count), secret_key, payload_format)
+    readings, total, rejected = benchmark(decrypt_readings, encrypted, secret_key, payload_format)
+    assert total == count and not rejected
+
+
+@pytest.mark.django_db
+@pytest.mark.benchmark(group='nonce')
+def test_check_nonce_in_window(benchmark, sensor, nonce_backend):
+    # Окно достаточно велико, чтобы все итерации проходили без сдвига окна
+    sensor.nonce_window_size = 10 ** 9
+    sensor.save(update_fields=['nonce_window_size'])
+    nonces = itertools.count(sensor.nonce_window_start + 1)
+
+    accepted, _ = benchmark(lambda: check_nonce_advanced(sensor, next(nonces), int(time.time())))
+    assert accepted
+
+
+@pytest.mark.django_db
+@pytest.mark.benchmark(group='nonce')
+def test_check_nonce_window_shift(benchmark, sensor, nonce_backend):
+    # Каждый nonce открывает новое окно: обновление сенсора и сброс предыдущего окна
+    nonces = itertools.count(sensor.nonce_window_start + sensor.nonce_window_size, sensor.nonce_window_size)
+
+    accepted, _ = benchmark(lambda: check_nonce_advanced(sensor, next(nonces), int(time.time())))
+    assert accepted
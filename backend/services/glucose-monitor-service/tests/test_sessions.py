@@ -0,0 +1,199 @@
+"""Сессии сенсоров: выдача, продвижение счётчика, отзыв поколением и запросы с ключом сессии"""
+import base64
+import json
+import time
+
+import pytest
+from rest_framework.test import APIClient
+
+from apps.glucose_monitor import views
+from apps.glucose_monitor.sensor_cache import invalidate_sensor_credentials
+from apps.glucose_monitor.sessions import (
+    STATE_OK, STATE_REPLAYED, STATE_REVOKED, STATE_UNKNOWN,
+    LocalSessionState, RedisSessionState, SensorSessionStore, SessionExpired, session_mac
+)
+
+
+class BrokenState:
+    """Недоступное хранилище состояния сессий"""
+
+    def __getattr__(self, name):
+        def fail(*args):
+            raise ConnectionError('session state is down')
+        return fail
+
+
+@pytest.fixture(params=['local', 'redis'])
+def state(request):
+    if request.param == 'redis':
+        # Lua-скрипты выполняются во встроенном интерпретаторе fakeredis
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        return RedisSessionState(fakeredis.FakeRedis())
+    return LocalSessionState(max_sessions=100)
+
+
+@pytest.fixture
+def store(state):
+    return SensorSessionStore(max_sessions=100, state=state)
+
+
+def expires_at():
+    return int(time.time()) + 3600
+
+
+def test_counter_must_grow(state):
+    state.issue('token', 'SN-1', expires_at(), 3660)
+
+    assert state.advance('token', 'SN-1', 1) == STATE_OK
+    assert state.advance('token', 'SN-1', 5) == STATE_OK
+    assert state.advance('token', 'SN-1', 5) == STATE_REPLAYED
+    assert state.advance('token', 'SN-1', 3) == STATE_REPLAYED
+    assert state.advance('token', 'SN-1', 6) == STATE_OK
+
+
+def test_unknown_session(state):
+    assert state.advance('missing', 'SN-1', 1) == STATE_UNKNOWN
+    assert state.advance('missing', 'SN-1') == STATE_UNKNOWN
+
+
+def test_revoke_invalidates_issued_sessions(state):
+    state.issue('old', 'SN-1', expires_at(), 3660)
+    state.issue('other', 'SN-2', expires_at(), 3660)
+
+    state.revoke('SN-1', 3660)
+
+    assert state.advance('old', 'SN-1') == STATE_REVOKED
+    assert state.advance('old', 'SN-1', 1) == STATE_REVOKED
+    assert state.advance('other', 'SN-2', 1) == STATE_OK
+    # Сессия, выданная после отзыва, принадлежит новому поколению
+    state.issue('new', 'SN-1', expires_at(), 3660)
+    assert state.advance('new', 'SN-1', 1) == STATE_OK
+
+
+@pytest.mark.django_db
+def test_session_is_shared_between_processes(state, sensor):
+    issued = SensorSessionStore(max_sessions=100, state=state).issue(sensor)
+    # Другой процесс не видел токен: ключ сессии вычисляется по секрету сенсора
+    other = SensorSessionStore(max_sessions=100, state=state)
+
+    session = other.resolve(issued['token'], sensor.serial_number)
+
+    assert other.advance(session, 1)
+    assert not SensorSessionStore(max_sessions=100, state=state).advance(session, 1)
+
+
+@pytest.mark.django_db
+def test_revoked_session_expires(store, sensor):
+    token = store.issue(sensor)['token']
+    session = store.resolve(token, sensor.serial_number)
+
+    store.revoke(sensor.serial_number)
+
+    with pytest.raises(SessionExpired, match='revoked'):
+        store.advance(session, 1)
+    with pytest.raises(SessionExpired, match='revoked'):
+        store.resolve(token, sensor.serial_number)
+
+
+@pytest.mark.django_db
+def test_token_of_other_sensor_is_rejected(store, sensor):
+    token = store.issue(sensor)['token']
+
+    with pytest.raises(SessionExpired):
+        store.resolve(token, 'OTHER')
+
+
+@pytest.mark.django_db
+def test_unavailable_state_forces_full_authentication(sensor):
+    store = SensorSessionStore(max_sessions=100, state=BrokenState())
+
+    assert store.issue(sensor) is None
+
+
+@pytest.mark.django_db
+def test_state_failure_during_request_expires_session(state, sensor):
+    store = SensorSessionStore(max_sessions=100, state=state)
+    token = store.issue(sensor)['token']
+    store._state = BrokenState()
+
+    with pytest.raises(SessionExpired, match='unavailable'):
+        store.resolve(token, sensor.serial_number)
+
+
+class SessionClient:
+    """Запросы сенсора в рамках сессии на endpoint одиночного показания"""
+
+    def __init__(self, sensor, store):
+        self.sensor = sensor
+        self.token = store.issue(sensor)['token']
+        self.key = store.resolve(self.token, sensor.serial_number).key
+        self.path = f"/api/v1/sensor/{sensor.serial_number}/single/"
+
+    def headers(self, counter, raw, **extra):
+        timestamp = int(time.time())
+        mac = session_mac(self.key, 'POST', self.path, counter, timestamp)
+        mac.update(raw)
+        return {
+            'HTTP_X_SENSOR_SESSION': self.token,
+            'HTTP_X_SENSOR_COUNTER': str(counter),
+            'HTTP_X_SENSOR_TIMESTAMP': str(timestamp),
+            'HTTP_X_SENSOR_SIGNATURE': base64.b64encode(mac.digest()).decode('utf-8'),
+            **extra,
+        }
+
+    def post(self, counter, value=6.5):
+        raw = json.dumps({'value': value, 'sequence_id': counter}).encode('utf-8')
+        return APIClient().post(self.path, raw, content_type='application/json', **self.headers(counter, raw))
+
+
+@pytest.fixture
+def session_client(sensor, monkeypatch):
+    store = SensorSessionStore(max_sessions=100, state=LocalSessionState(max_sessions=100))
+    monkeypatch.setattr(views, 'session_store', store)
+    return SessionClient(sensor, store)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_session_request_counter_replay(session_client):
+    assert session_client.post(1).status_code == 201
+    assert session_client.post(3).status_code == 201
+
+    for counter in (3, 2):
+        response = session_client.post(counter)
+        assert response.status_code == 401
+        assert response.json()['error'] == 'Invalid counter: already used'
+
+
+@pytest.mark.django_db
+def test_session_request_with_tampered_body(session_client):
+    headers = session_client.headers(1, b'{"value": 6.5, "sequence_id": 1}')
+
+    response = APIClient().post(session_client.path, b'{"value": 9.5, "sequence_id": 1}',
+                                content_type='application/json', **headers)
+
+    assert response.status_code == 401
+    assert response.json()['error'] == 'Invalid signature'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_session_request_after_revoke(session_client, sensor):
+    assert session_client.post(1).status_code == 201
+
+    views.session_store.revoke(sensor.serial_number)
+    invalidate_sensor_credentials(sensor.serial_number)
+    response = session_client.post(2)
+
+    assert response.status_code == 401
+    assert response.json()['code'] == 'session_expired'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_session_header_takes_precedence_over_nonce_signature(session_client):
+    raw = b'{"value": 6.5, "sequence_id": 1}'
+    # Заголовок nonce подписи v2 присутствует, но запрос проверяется ключом сессии
+    headers = session_client.headers(1, raw, HTTP_X_SENSOR_NONCE='1')
+
+    response = APIClient().post(session_client.path, raw, content_type='application/json', **headers)
+
+    assert response.status_code == 201, response.content
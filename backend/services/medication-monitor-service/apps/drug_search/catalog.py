@@ -0,0 +1,268 @@
+"""
+Локальный каталог названий лекарств для автодополнения.
+
+Названия берутся из справочника Drug и из результатов tabletka.by
+(таблица medication_drug_catalog). Каждый процесс держит индекс каталога
+в памяти:
+    - отсортированный список ключей (название целиком и с каждого слова) -
+      поиск по префиксу двоичным поиском;
+    - инвертированный индекс триграмм (как в pg_trgm) - нечёткий поиск,
+      устойчивый к опечаткам.
+
+Автодополнение отвечает только из индекса. Если совпадений по префиксу
+мало, запрос ставится в очередь на обогащение: фоновый поток запрашивает
+tabletka.by и добавляет новые названия в таблицу и индекс - они появятся
+в следующих ответах. Названия, добавленные другими процессами, подгружаются
+по id не чаще раза в DRUG_CATALOG_RELOAD_INTERVAL секунд.
+"""
+import bisect
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .exceptions import DrugSearchException
+from .models import Drug, DrugCatalogEntry
+
+logger = logging.getLogger(__name__)
+
+ENRICHED_KEY = 'drug_catalog:enriched:{}'
+WORD_RE = re.compile(r'[0-9a-zа-я]+')
+# Сколько совпадений по префиксу просматривается для ранжирования
+PREFIX_SCAN_LIMIT = 500
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def normalize_name(name):
+    """Нижний регистр, ё -> е, только буквы и цифры, слова через один пробел"""
+    return ' '.join(WORD_RE.findall(name.lower().replace('ё', 'е')))
+
+
+def trigrams(text, prefix=False):
+    """
+    Триграммы слов с дополнением пробелами, как в pg_trgm.
+    prefix=True - последнее слово может быть недописано (без пробела в конце).
+    """
+    words = text.split()
+    result = set()
+    for i, word in enumerate(words):
+        padded = f"  {word}" if prefix and i == len(words) - 1 else f"  {word} "
+        result.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return result
+
+
+class CatalogIndex:
+    """Индекс названий в памяти: префиксы и триграммы"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.names = []  # номер записи -> название для ответа
+        self._normalized = []  # номер записи -> нормализованное название
+        self._entries = {}  # нормализованное название -> номер записи
+        self._keys = []  # отсортированные пары (ключ, номер записи)
+        self._trigrams = defaultdict(set)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return normalize_name(name) in self._entries
+
+    def add(self, names):
+        """Добавление названий. Возвращает названия, которых в индексе ещё не было."""
+        added = []
+        with self._lock:
+            keys = []
+            for name in names:
+                name = ' '.join(name.split())
+                normalized = normalize_name(name)
+                if not normalized or normalized in self._entries:
+                    continue
+                entry = len(self.names)
+                self.names.append(name)
+                self._normalized.append(normalized)
+                self._entries[normalized] = entry
+
+                words = normalized.split(' ')
+                keys.extend((' '.join(words[i:]), entry) for i in range(len(words)))
+                for gram in trigrams(normalized):
+                    self._trigrams[gram].add(entry)
+                added.append(name)
+
+            if len(keys) > 100:
+                self._keys.extend(keys)
+                self._keys.sort()
+            else:
+                for key in keys:
+                    bisect.insort(self._keys, key)
+        return added
+
+    def prefix_search(self, query, limit):
+        """Названия, начинающиеся с query или содержащие слово, начинающееся с query"""
+        with self._lock:
+            position = bisect.bisect_left(self._keys, (query,))
+            found = set()
+            while position < len(self._keys) and len(found) < PREFIX_SCAN_LIMIT:
+                key, entry = self._keys[position]
+                if not key.startswith(query):
+                    break
+                found.add(entry)
+                position += 1
+
+            ranked = sorted(found, key=lambda e: (
+                not self._normalized[e].startswith(query), len(self._normalized[e]), self._normalized[e]
+            ))
+            return [self.names[entry] for entry in ranked[:limit]]
+
+    def fuzzy_search(self, query, limit, threshold):
+        """
+        Названия, содержащие большую часть триграмм запроса
+        (доля общих триграмм не ниже threshold, аналог word_similarity в pg_trgm).
+        """
+        grams = trigrams(query, prefix=True)
+        if not grams:
+            return []
+        with self._lock:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._trigrams.get(gram, ()))
+            scored = [
+                (-count / len(grams), len(self._normalized[entry]), entry)
+                for entry, count in shared.items()
+                if count / len(grams) >= threshold
+            ]
+            scored.sort()
+            return [self.names[entry] for _, _, entry in scored[:limit]]
+
+
+class DrugCatalog:
+    """Каталог процесса: индекс, подгрузка из БД и фоновое обогащение с tabletka.by"""
+
+    def __init__(self):
+        self.index = CatalogIndex()
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        self._last_entry_id = 0
+        self._last_drug_created = None
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._executor = None
+
+    def ensure_loaded(self):
+        """Первичная загрузка и периодическая подгрузка новых названий"""
+        interval = _setting('DRUG_CATALOG_RELOAD_INTERVAL', 60)
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < interval:
+            return
+        with self._load_lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < interval:
+                return
+
+            drugs = Drug.objects.all()
+            if self._last_drug_created is not None:
+                drugs = drugs.filter(created_at__gt=self._last_drug_created)
+            for name, created_at in drugs.order_by('created_at').values_list('name', 'created_at').iterator():
+                self.index.add([name])
+                self._last_drug_created = created_at
+
+            entries = DrugCatalogEntry.objects.filter(id__gt=self._last_entry_id).order_by('id')
+            for entry_id, name in entries.values_list('id', 'name').iterator():
+                self.index.add([name])
+                self._last_entry_id = entry_id
+
+            self._loaded_at = time.monotonic()
+
+    def search(self, query, limit=None):
+        """
+        Автодополнение по каталогу.
+
+        Returns:
+            tuple: (список названий, поставлен ли запрос на обогащение)
+        """
+        limit = limit or _setting('DRUG_CATALOG_RESULTS', 20)
+        normalized = normalize_name(query)
+        if len(normalized) < 2:
+            return [], False
+
+        self.ensure_loaded()
+        results = self.index.prefix_search(normalized, limit)
+        prefix_matches = len(results)
+
+        if len(results) < limit and len(normalized) >= 3:
+            threshold = _setting('DRUG_CATALOG_FUZZY_THRESHOLD', 0.5)
+            for name in self.index.fuzzy_search(normalized, limit, threshold):
+                if name not in results:
+                    results.append(name)
+                    if len(results) >= limit:
+                        break
+
+        enriching = False
+        if prefix_matches < _setting('DRUG_CATALOG_MIN_RESULTS', 5):
+            enriching = self.enrich_async(normalized)
+        return results, enriching
+
+    def add_names(self, names, source):
+        """Добавление названий в индекс и таблицу каталога"""
+        added = self.index.add(names)
+        if added:
+            DrugCatalogEntry.objects.bulk_create(
+                [DrugCatalogEntry(name=name, normalized_name=normalize_name(name), source=source) for name in added],
+                ignore_conflicts=True
+            )
+        return added
+
+    def _enriched_key(self, normalized):
+        return ENRICHED_KEY.format(hashlib.md5(normalized.encode()).hexdigest())
+
+    def enrich_async(self, normalized):
+        """Постановка запроса на обогащение с tabletka.by (не чаще раза в DRUG_CATALOG_ENRICH_TTL)"""
+        if cache.get(self._enriched_key(normalized)):
+            return False
+        with self._pending_lock:
+            if normalized in self._pending:
+                return True
+            if len(self._pending) >= _setting('DRUG_CATALOG_MAX_PENDING', 100):
+                return False
+            self._pending.add(normalized)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=_setting('DRUG_CATALOG_ENRICH_WORKERS', 2),
+                    thread_name_prefix='drug-catalog-enrich'
+                )
+        self._executor.submit(self._enrich, normalized)
+        return True
+
+    def enrich(self, normalized):
+        """Запрос к tabletka.by и добавление найденных названий. Возвращает новые названия."""
+        from .services import get_tabletka_client
+
+        names = get_tabletka_client().search_drugs(normalized)
+        added = self.add_names(names, source='tabletka')
+        cache.set(self._enriched_key(normalized), True, timeout=_setting('DRUG_CATALOG_ENRICH_TTL', 86400))
+        if added:
+            logger.info(f"Drug catalog enriched with {len(added)} names for '{normalized}'")
+        return added
+
+    def _enrich(self, normalized):
+        try:
+            self.enrich(normalized)
+        except DrugSearchException as e:
+            logger.warning(f"Drug catalog enrichment failed for '{normalized}': {str(e)}")
+        except Exception as e:
+            logger.error(f"Drug catalog enrichment error for '{normalized}': {str(e)}")
+        finally:
+            with self._pending_lock:
+                self._pending.discard(normalized)
+            connection.close()
+
+
+drug_catalog = DrugCatalog()
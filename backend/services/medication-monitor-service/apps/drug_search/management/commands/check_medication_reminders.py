@@ -1,4 +1,5 @@
 import time
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from apps.drug_search.reminder_service import MedicationReminderService
 
@@ -10,7 +11,13 @@ class Command(BaseCommand):
         parser.add_argument(
             '--continuous',
             action='store_true',
-            help='Run continuously checking every 5 minutes',
+            help='Run continuously checking every --interval seconds',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=getattr(settings, 'REMINDER_CHECK_INTERVAL', 60),
+            help='Seconds between checks in continuous mode',
         )
         parser.add_argument(
             '--check-missed',
@@ -20,17 +27,23 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         service = MedicationReminderService()
-        
+        scheduled = service.schedule_missing()
+        if scheduled:
+            self.stdout.write(f'Scheduled {scheduled} reminders without next fire time')
+
         if options['continuous']:
             self.stdout.write('Starting continuous medication reminder service...')
+            missed_interval = getattr(settings, 'REMINDER_MISSED_CHECK_INTERVAL', 300)
+            last_missed_check = 0
             try:
                 while True:
                     service.check_and_send_reminders()
                     
-                    if options['check_missed']:
+                    if options['check_missed'] and time.monotonic() - last_missed_check >= missed_interval:
                         service.check_missed_medications()
+                        last_missed_check = time.monotonic()
                     
-                    time.sleep(300)
+                    time.sleep(options['interval'])
                     
             except KeyboardInterrupt:
                 self.stdout.write('Stopping medication reminder service...')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from apps.drug_search.catalog import drug_catalog, normalize_name
+from apps.drug_search.exceptions import DrugSearchException
+from apps.drug_search.models import Drug, DrugCatalogEntry
+
+
+class Command(BaseCommand):
+    help = 'Fill the local drug catalog from the Drug table and optionally from tabletka.by'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--enrich',
+            nargs='*',
+            default=[],
+            metavar='QUERY',
+            help='Queries to look up on tabletka.by and add to the catalog',
+        )
+
+    def handle(self, *args, **options):
+        names = {}
+        for name in Drug.objects.values_list('name', flat=True).distinct().iterator():
+            normalized = normalize_name(name)
+            if normalized:
+                names.setdefault(normalized, ' '.join(name.split()))
+
+        before = DrugCatalogEntry.objects.count()
+        DrugCatalogEntry.objects.bulk_create(
+            [DrugCatalogEntry(name=name, normalized_name=normalized, source='drug') for normalized, name in names.items()],
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+        self.stdout.write(f'Added {DrugCatalogEntry.objects.count() - before} names from the Drug table')
+
+        drug_catalog.ensure_loaded()
+
+        for query in options['enrich']:
+            try:
+                added = drug_catalog.enrich(normalize_name(query))
+            except DrugSearchException as e:
+                self.stderr.write(f'Enrichment failed for "{query}": {e}')
+                continue
+            self.stdout.write(f'Added {len(added)} names for "{query}"')
+
+        self.stdout.write(self.style.SUCCESS(f'Catalog contains {len(drug_catalog.index)} names'))
@@ -1,6 +1,9 @@
 import uuid
+from datetime import datetime, timedelta
+
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
+from django.utils import timezone
 
 
 class UserManager(BaseUserManager):
@@ -74,6 +77,26 @@ class Drug(models.Model):
         return f"{self.name} ({self.form})"
 
 
+class DrugCatalogEntry(models.Model):
+    """Название лекарства в локальном каталоге автодополнения"""
+    SOURCE_CHOICES = [
+        ('tabletka', 'tabletka.by'),
+        ('drug', 'Справочник лекарств'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, unique=True)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'medication_drug_catalog'
+
+    def __str__(self):
+        return self.name
+
+
 class MedicationIntake(models.Model):
     UNIT_CHOICES = [
         ('pieces', 'штуки'),
@@ -176,6 +199,9 @@ class MedicationReminder(models.Model):
         ('sunday', 'Воскресенье'),
     ]
 
+    # Поля, от которых зависит next_fire_at
+    SCHEDULE_FIELDS = ('frequency', 'time', 'weekdays', 'start_date', 'end_date', 'is_active')
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='medication_reminders')
     drug = models.ForeignKey(Drug, on_delete=models.CASCADE, related_name='reminders')
@@ -189,12 +215,68 @@ class MedicationReminder(models.Model):
     end_date = models.DateField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     notes = models.TextField(blank=True)
+    next_fire_at = models.DateTimeField(null=True, blank=True, help_text="Время следующего срабатывания")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'medication_reminder'
         ordering = ['time']
+        indexes = [
+            models.Index(fields=['is_active', 'next_fire_at'], name='medication_reminder_due_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.email} - {self.title}"
\ No newline at end of file
+        return f"{self.user.email} - {self.title}"
+
+    def fires_on(self, day):
+        """Срабатывает ли напоминание в указанный день"""
+        if day < self.start_date or (self.end_date and day > self.end_date):
+            return False
+        if self.frequency == 'daily':
+            return True
+        weekday = self.WEEKDAY_CHOICES[day.weekday()][0]
+        return weekday in (self.weekdays or [])
+
+    def compute_next_fire_at(self, after=None):
+        """
+        Ближайшее время срабатывания строго позже after (по умолчанию - сейчас).
+        None, если напоминание больше не сработает.
+        """
+        after = after or timezone.now()
+        day = max(timezone.localtime(after).date(), self.start_date)
+        # Расписание повторяется с периодом в неделю
+        for offset in range(8):
+            candidate_day = day + timedelta(days=offset)
+            if self.end_date and candidate_day > self.end_date:
+                return None
+            if not self.fires_on(candidate_day):
+                continue
+            candidate = timezone.make_aware(datetime.combine(candidate_day, self.time))
+            if candidate > after:
+                return candidate
+        return None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_schedule = instance.schedule_state()
+        return instance
+
+    def schedule_state(self):
+        """Значения полей расписания (отложенные поля не загружаются)"""
+        return tuple(
+            list(value) if isinstance(value, list) else value
+            for value in (self.__dict__.get(name) for name in self.SCHEDULE_FIELDS)
+        )
+
+    def save(self, *args, **kwargs):
+        # Без изменения расписания next_fire_at не пересчитывается: наступившее, но ещё
+        # не отправленное напоминание не переносится на следующий день
+        if self._state.adding or self.schedule_state() != getattr(self, '_saved_schedule', None):
+            self.next_fire_at = self.compute_next_fire_at() if self.is_active else None
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'next_fire_at' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'next_fire_at']
+        super().save(*args, **kwargs)
+        self._saved_schedule = self.schedule_state()
\ No newline at end of file
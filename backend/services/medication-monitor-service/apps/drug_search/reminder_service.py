@@ -1,44 +1,125 @@
 import logging
 from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
 from django.utils import timezone
-from django.db.models import Q
 from .models import MedicationReminder, MedicationIntake
-from .rabbitmq_publisher import RabbitMQPublisher
+from .rabbitmq_publisher import publisher
 
 logger = logging.getLogger(__name__)
 
 
 class MedicationReminderService:
     def __init__(self):
-        self.publisher = RabbitMQPublisher()
+        self.publisher = publisher
+
+    def check_and_send_reminders(self, now=None):
+        """
+        Отправка наступивших напоминаний.
+
+        Выбираются только строки с next_fire_at <= now (индекс is_active,
+        next_fire_at) порциями по REMINDER_BATCH_SIZE вместе с пользователем
+        и лекарством; приёмы за день срабатывания проверяются одним запросом
+        на порцию. Порция сначала "забирается": next_fire_at переносится на
+        следующее срабатывание и транзакция фиксируется, снимая блокировки
+        строк. Затем уведомления публикуются одной пачкой с ожиданием
+        подтверждений брокера; напоминаниям, уведомления которых брокер не
+        подтвердил, возвращается прежний next_fire_at - их повторит следующая
+        проверка. Напоминания, опоздавшие больше чем на REMINDER_MAX_DELAY
+        секунд (например, после простоя), не отправляются.
+        """
+        current_time = now or timezone.now()
+        batch_size = getattr(settings, 'REMINDER_BATCH_SIZE', 500)
+        max_delay = timedelta(seconds=getattr(settings, 'REMINDER_MAX_DELAY', 900))
 
-    def check_and_send_reminders(self):
-        current_time = timezone.now()
-        current_date = current_time.date()
-        current_weekday = current_time.strftime('%A').lower()
-        
         logger.info(f"Checking medication reminders at {current_time}")
-        
-        active_reminders = MedicationReminder.objects.filter(
-            is_active=True,
-            start_date__lte=current_date
-        ).filter(
-            Q(end_date__isnull=True) | Q(end_date__gte=current_date)
-        )
-        
+
         reminders_sent = 0
-        
-        for reminder in active_reminders:
-            if self.should_send_reminder(reminder, current_time, current_weekday):
-                if not self.has_taken_medication_today(reminder, current_date):
-                    self.send_reminder_notification(reminder)
-                    reminders_sent += 1
-                else:
-                    logger.info(f"User {reminder.user.email} already took {reminder.drug.name} today")
-        
+        while True:
+            with transaction.atomic():
+                due = list(
+                    MedicationReminder.objects
+                    .select_for_update(skip_locked=True, of=('self',))
+                    .select_related('user', 'drug')
+                    .filter(is_active=True, next_fire_at__lte=current_time)
+                    .order_by('next_fire_at')[:batch_size]
+                )
+                if not due:
+                    break
+
+                taken = self.taken_on_fire_dates(due)
+                claimed = []  # [(напоминание, прежний next_fire_at)]
+                events = []
+                for reminder in due:
+                    fire_date = timezone.localtime(reminder.next_fire_at).date()
+                    if current_time - reminder.next_fire_at > max_delay:
+                        logger.info(f"Skipping stale reminder {reminder.id} scheduled at {reminder.next_fire_at}")
+                    elif (reminder.user_id, reminder.drug_id, fire_date) in taken:
+                        logger.info(f"User {reminder.user.email} already took {reminder.drug.name} today")
+                    else:
+                        claimed.append((reminder, reminder.next_fire_at))
+                        events.append(self.publisher.medication_reminder_event(
+                            user_id=reminder.user.id,
+                            reminder_data=self.reminder_data(reminder)
+                        ))
+                    reminder.next_fire_at = reminder.compute_next_fire_at(after=current_time)
+
+                MedicationReminder.objects.bulk_update(due, ['next_fire_at'])
+
+            failed = self.publisher.publish_batch(events) if events else []
+            reminders_sent += len(events) - len(failed)
+            if failed:
+                logger.warning(f"Failed to send {len(failed)} of {len(events)} medication reminders, "
+                               f"they will be retried")
+                self.release_claims([claimed[index] for index in failed])
+                # Повтор - на следующей проверке, чтобы не отправлять ту же порцию в недоступный брокер
+                break
+
+            if len(due) < batch_size:
+                break
+
         logger.info(f"Sent {reminders_sent} medication reminders")
         return reminders_sent
 
+    def release_claims(self, claims):
+        """
+        Возврат прежнего next_fire_at напоминаниям, уведомления которых не отправлены.
+        Напоминание, изменённое после забора порции, не трогается.
+        """
+        condition = Q()
+        for reminder, fire_at in claims:
+            condition |= Q(id=reminder.id, next_fire_at=reminder.next_fire_at)
+        return MedicationReminder.objects.filter(condition).update(next_fire_at=Case(
+            *[When(id=reminder.id, then=Value(fire_at)) for reminder, fire_at in claims],
+            output_field=MedicationReminder._meta.get_field('next_fire_at')
+        ))
+
+    def taken_on_fire_dates(self, reminders):
+        """
+        Приёмы лекарств напоминаний в дни их срабатывания - один запрос на весь набор.
+
+        Returns:
+            set: {(user_id, drug_id, дата)}
+        """
+        dates = {timezone.localtime(reminder.next_fire_at).date() for reminder in reminders}
+        intakes = MedicationIntake.objects.filter(
+            user_id__in={reminder.user_id for reminder in reminders},
+            drug_id__in={reminder.drug_id for reminder in reminders},
+            taken_at__date__in=dates,
+            is_deleted=False
+        ).values_list('user_id', 'drug_id', 'taken_at__date').distinct()
+        return set(intakes)
+
+    def schedule_missing(self):
+        """Расчёт next_fire_at для активных напоминаний, у которых он не задан (созданных до планировщика)"""
+        reminders = list(MedicationReminder.objects.filter(is_active=True, next_fire_at__isnull=True))
+        for reminder in reminders:
+            reminder.next_fire_at = reminder.compute_next_fire_at()
+        scheduled = [reminder for reminder in reminders if reminder.next_fire_at is not None]
+        MedicationReminder.objects.bulk_update(scheduled, ['next_fire_at'], batch_size=500)
+        return len(scheduled)
+
     def should_send_reminder(self, reminder, current_time, current_weekday):
         reminder_time = datetime.combine(current_time.date(), reminder.time)
         reminder_time = timezone.make_aware(reminder_time)
@@ -67,20 +148,21 @@ class MedicationReminderService:
         
         return taken_today
 
+    def reminder_data(self, reminder):
+        return {
+            'medication_name': reminder.drug.name,
+            'scheduled_time': reminder.time.strftime('%H:%M'),
+            'amount': str(reminder.amount),
+            'unit': reminder.unit,
+            'notes': reminder.notes,
+            'reminder_id': str(reminder.id)
+        }
+
     def send_reminder_notification(self, reminder):
         try:
-            reminder_data = {
-                'medication_name': reminder.drug.name,
-                'scheduled_time': reminder.time.strftime('%H:%M'),
-                'amount': str(reminder.amount),
-                'unit': reminder.unit,
-                'notes': reminder.notes,
-                'reminder_id': str(reminder.id)
-            }
-            
             success = self.publisher.publish_medication_reminder(
                 user_id=reminder.user.id,
-                reminder_data=reminder_data
+                reminder_data=self.reminder_data(reminder)
             )
             
             if success:
@@ -127,9 +127,9 @@ class MedicationReminderSerializer(serializers.ModelSerializer):
             'id', 'drug', 'drug_name', 'drug_form', 'title',
             'amount', 'unit', 'frequency', 'frequency_display',
             'time', 'weekdays', 'start_date', 'end_date',
-            'is_active', 'notes', 'created_at', 'updated_at'
+            'is_active', 'notes', 'next_fire_at', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'next_fire_at', 'created_at', 'updated_at']
 
 
 class CreateMedicationReminderSerializer(serializers.Serializer):
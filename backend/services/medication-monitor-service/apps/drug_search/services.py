@@ -1,110 +1,370 @@
-import requests
-from bs4 import BeautifulSoup
+import hashlib
+import logging
 import re
+import threading
 import time
-import random
+import uuid
+
+import requests
+from bs4 import BeautifulSoup
 from django.core.cache import cache
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .catalog import normalize_name
 from .exceptions import DrugSearchException
 
+logger = logging.getLogger(__name__)
 
-class TabletkaByClient:
-    BASE_URL = "https://tabletka.by"
-    AUTOCOMPLETE_URL = f"{BASE_URL}/ajax-request/autocomplete/"
+CSRF_CACHE_KEY = 'drug_search:tabletka_csrf'
+RESULTS_KEY = 'drug_search:{}'
+LOCK_KEY = 'drug_search:lock:{}'
+# Токен находится в <head>, главная страница дочитывается только до него
+CSRF_SCAN_LIMIT = 256 * 1024
+CSRF_PATTERNS = (
+    re.compile(rb'<meta[^>]*name=["\']csrf-token["\'][^>]*content=["\']([^"\']+)["\']', re.IGNORECASE),
+    re.compile(rb'<input[^>]*name=["\']_csrf["\'][^>]*value=["\']([^"\']+)["\']', re.IGNORECASE),
+)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def find_csrf_token(html):
+    """Поиск CSRF токена в начале HTML-страницы (bytes)"""
+    for pattern in CSRF_PATTERNS:
+        match = pattern.search(html)
+        if match:
+            return match.group(1).decode()
+    return None
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def results_key(query):
+    return RESULTS_KEY.format(hashlib.md5(query.encode()).hexdigest())
+
+
+class _Flight:
+    """Запрос к tabletka.by, результата которого ждут остальные потоки с тем же запросом"""
 
     def __init__(self):
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class TabletkaByClient:
+    """
+    Клиент автодополнения tabletka.by.
+
+    Экземпляр разделяется всеми запросами процесса (get_tabletka_client):
+    сессия requests держит пул keep-alive соединений. CSRF токен вместе с
+    cookie сессии хранится в кэше Django (TABLETKA_CSRF_TTL) и обновляется
+    фоновым потоком заранее, за TABLETKA_CSRF_REFRESH_AHEAD секунд до истечения,
+    поэтому промах кэша результатов стоит одного запроса к автодополнению.
+    """
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36',
+        'Accept': 'application/json, text/javascript, */*; q=0.01',
+        'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+        'Accept-Encoding': 'gzip, deflate',
+        'Cache-Control': 'no-cache',
+        'Pragma': 'no-cache',
+        'X-Requested-With': 'XMLHttpRequest'
+    }
+
+    def __init__(self, base_url=None, pool_size=None, timeout=None, csrf_ttl=None, refresh_ahead=None,
+                 max_attempts=None, min_delay=None, retry_backoff=None):
+        self.base_url = (base_url or _setting('TABLETKA_BASE_URL', 'https://tabletka.by')).rstrip('/')
+        self.autocomplete_url = f"{self.base_url}/ajax-request/autocomplete/"
+        self.timeout = timeout or _setting('TABLETKA_TIMEOUT', 10)
+        self.csrf_ttl = csrf_ttl or _setting('TABLETKA_CSRF_TTL', 1800)
+        self.refresh_ahead = refresh_ahead if refresh_ahead is not None else _setting('TABLETKA_CSRF_REFRESH_AHEAD', 300)
+        self.max_attempts = max_attempts or _setting('TABLETKA_MAX_ATTEMPTS', 3)
+        self.min_delay = min_delay if min_delay is not None else _setting('TABLETKA_MIN_DELAY', 0.1)
+        self.retry_backoff = retry_backoff if retry_backoff is not None else _setting('TABLETKA_RETRY_BACKOFF', 0.3)
+
+        pool_size = pool_size or _setting('TABLETKA_POOL_SIZE', 10)
         self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36',
-            'Accept': 'application/json, text/javascript, */*; q=0.01',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Accept-Encoding': 'gzip, deflate, br, zstd',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache',
-            'X-Requested-With': 'XMLHttpRequest'
-        })
-        self.csrf_token = None
-        self.last_request_time = 0
-        self.min_delay = 0.5
-        self._init_session()
-
-    def _init_session(self):
-        """Инициализация сессии и получение CSRF токена"""
+        self.session.headers.update(self.HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._csrf = None
+        self._csrf_lock = threading.Lock()
+        self._refreshing = False
+        self._throttle_lock = threading.Lock()
+        self.last_request_time = 0.0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    # CSRF токен
+
+    def _is_fresh(self, state, margin=0):
+        return state is not None and time.time() - state['fetched_at'] < self.csrf_ttl - margin
+
+    def _apply_csrf(self, state):
+        self.session.cookies.update(state['cookies'])
+        self._csrf = state
+
+    def _get_csrf_token(self):
+        """Токен из памяти процесса или общего кэша; синхронная загрузка только при его отсутствии"""
+        state = self._csrf
+        if not self._is_fresh(state):
+            cached = cache.get(CSRF_CACHE_KEY)
+            if self._is_fresh(cached):
+                self._apply_csrf(cached)
+                state = cached
+            else:
+                state = self._refresh_csrf()
+
+        if not self._is_fresh(state, self.refresh_ahead):
+            self._refresh_in_background()
+        return state['token']
+
+    def _refresh_csrf(self, rejected_token=None):
+        """
+        Загрузка нового токена. Параллельные вызовы ждут одну загрузку:
+        если токен уже обновлён другим потоком, повторной загрузки нет.
+        """
+        with self._csrf_lock:
+            state = self._csrf
+            if rejected_token is not None:
+                if state is not None and state['token'] != rejected_token:
+                    return state
+            elif self._is_fresh(state, self.refresh_ahead):
+                return state
+
+            state = self._fetch_csrf()
+            self._apply_csrf(state)
+            cache.set(CSRF_CACHE_KEY, state, timeout=self.csrf_ttl)
+            return state
+
+    def _refresh_in_background(self):
+        with self._csrf_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name='tabletka-csrf-refresh', daemon=True).start()
+
+    def _background_refresh(self):
         try:
-            response = self.session.get(self.BASE_URL, timeout=10)
-            response.raise_for_status()
+            self._refresh_csrf()
+        except Exception as e:
+            logger.warning(f"Background CSRF refresh failed: {str(e)}")
+        finally:
+            self._refreshing = False
 
-            soup = BeautifulSoup(response.text, 'html.parser')
-            csrf_input = soup.find('input', {'name': '_csrf'})
-            if csrf_input:
-                self.csrf_token = csrf_input.get('value')
+    def _fetch_csrf(self):
+        """Получение CSRF токена и cookie сессии с главной страницы"""
+        try:
+            response = self.session.get(f"{self.base_url}/", timeout=self.timeout, stream=True)
+            try:
+                response.raise_for_status()
+                html = b''
+                token = None
+                for chunk in response.iter_content(chunk_size=16384):
+                    html += chunk
+                    token = find_csrf_token(html)
+                    if token or len(html) >= CSRF_SCAN_LIMIT:
+                        break
+            finally:
+                response.close()
 
-            if not self.csrf_token:
+            if not token:
+                soup = BeautifulSoup(html, 'html.parser')
+                csrf_input = soup.find('input', {'name': '_csrf'})
                 csrf_meta = soup.find('meta', {'name': 'csrf-token'})
-                if csrf_meta:
-                    self.csrf_token = csrf_meta.get('content')
+                token = (csrf_input and csrf_input.get('value')) or (csrf_meta and csrf_meta.get('content'))
 
-            if not self.csrf_token:
+            if not token:
                 raise DrugSearchException("CSRF token not found")
-
+        except DrugSearchException:
+            raise
         except Exception as e:
             raise DrugSearchException(f"Session initialization failed: {str(e)}")
 
+        return {
+            'token': token,
+            'cookies': self.session.cookies.get_dict(),
+            'fetched_at': time.time(),
+        }
+
+    def _invalidate_csrf(self, token):
+        """Токен отклонён сервером (403/419)"""
+        with self._csrf_lock:
+            if self._csrf is not None and self._csrf['token'] == token:
+                self._csrf = None
+                cache.delete(CSRF_CACHE_KEY)
+
+    # Запросы
+
     def _throttle_request(self):
-        """Контроль частоты запросов"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.min_delay:
-            time.sleep(self.min_delay - time_since_last)
-        self.last_request_time = time.time()
-        time.sleep(random.uniform(0.1, 0.3))  # Случайная задержка
+        """Минимальный интервал между запросами всего процесса"""
+        with self._throttle_lock:
+            now = time.monotonic()
+            slot = max(now, self.last_request_time + self.min_delay)
+            self.last_request_time = slot
+        if slot > now:
+            time.sleep(slot - now)
 
     def search_drugs(self, query):
-        """Поиск лекарств по запросу"""
+        """
+        Поиск лекарств по запросу.
+
+        Порядок: кэш точного запроса (пустые результаты кэшируются на
+        DRUG_SEARCH_EMPTY_TTL), результат, выведенный из кэша более короткого
+        префикса, и только затем запрос к tabletka.by - один на нормализованный
+        запрос: остальные потоки процесса и другие процессы ждут его результат.
+        """
         if not query or len(query.strip()) < 2:
             return []
+        query = normalize_query(query)
+
+        cached = self._cached_results(query)
+        if cached is not None:
+            return cached
 
-        # Проверяем кэш
-        cache_key = f"drug_search:{query.lower()}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
+        with self._flights_lock:
+            flight = self._flights.get(query)
+            leader = flight is None
+            if leader:
+                flight = self._flights[query] = _Flight()
 
-        self._throttle_request()
+        if not leader:
+            if not flight.done.wait(self._coalesce_wait()):
+                raise DrugSearchException("Search failed: timed out waiting for a concurrent request")
+            if flight.error is not None:
+                raise flight.error
+            return list(flight.results)
 
         try:
-            data = {'query': query}
-            if self.csrf_token:
-                data['_csrf'] = self.csrf_token
-
-            response = self.session.post(
-                self.AUTOCOMPLETE_URL,
-                data=data,
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-                    'Origin': self.BASE_URL,
-                    'Referer': f"{self.BASE_URL}/"
-                },
-                timeout=10
-            )
+            flight.results = self._search_upstream(query)
+            return list(flight.results)
+        except Exception as e:
+            flight.error = e if isinstance(e, DrugSearchException) else DrugSearchException(f"Search failed: {str(e)}")
+            raise flight.error
+        finally:
+            with self._flights_lock:
+                self._flights.pop(query, None)
+            flight.done.set()
+
+    def _coalesce_wait(self):
+        return _setting('DRUG_SEARCH_COALESCE_WAIT', self.timeout * self.max_attempts)
+
+    def _cache_results(self, query, results, complete):
+        ttl = _setting('DRUG_SEARCH_CACHE_TTL', 3600) if results else _setting('DRUG_SEARCH_EMPTY_TTL', 300)
+        cache.set(results_key(query), {'results': results, 'complete': complete}, timeout=ttl)
+
+    def _cached_results(self, query):
+        """
+        Результат из кэша: точный запрос или фильтрация результата более
+        короткого префикса. Фильтрация допустима, только если результат
+        префикса полный (меньше TABLETKA_RESULT_LIMIT названий) и каждое
+        название содержит префикс - значит, сайт искал по тексту названия.
+        """
+        prefixes = [query[:length] for length in range(len(query), 1, -1)]
+        keys = {results_key(prefix): prefix for prefix in prefixes}
+        found = cache.get_many(list(keys))
+        entries = {keys[key]: entry for key, entry in found.items()}
+
+        entry = entries.get(query)
+        if entry is not None:
+            return list(entry['results'])
+
+        limit = _setting('TABLETKA_RESULT_LIMIT', 10)
+        normalized_query = normalize_name(query)
+        for prefix in prefixes[1:]:
+            entry = entries.get(prefix)
+            if entry is None or not entry['complete'] or len(entry['results']) >= limit:
+                continue
+            normalized_prefix = normalize_name(prefix)
+            names = [(name, normalize_name(name)) for name in entry['results']]
+            if not normalized_prefix or any(normalized_prefix not in normalized for _, normalized in names):
+                continue
+            results = [name for name, normalized in names if normalized_query in normalized]
+            self._cache_results(query, results, complete=True)
+            return results
+        return None
+
+    def _search_upstream(self, query):
+        """
+        Запрос к tabletka.by; параллельный запрос другого процесса ожидается через кэш.
+        Ожидание прекращается, как только блокировка освобождена: если лидер завершился
+        ошибкой и не оставил результата, запрос выполняет этот процесс.
+        """
+        lock_key = LOCK_KEY.format(hashlib.md5(query.encode()).hexdigest())
+        token = uuid.uuid4().hex
+        wait = self._coalesce_wait()
+        deadline = time.monotonic() + wait
+        acquired = cache.add(lock_key, token, timeout=wait)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.05)
+            found = cache.get_many([results_key(query), lock_key])
+            entry = found.get(results_key(query))
+            if entry is not None:
+                return list(entry['results'])
+            if lock_key not in found:
+                acquired = cache.add(lock_key, token, timeout=wait)
+
+        try:
+            json_data = self._autocomplete(query)
+            results = self._parse_results(json_data.get('data', '')) if json_data.get('status') == 1 else []
+            self._cache_results(query, results, complete=len(results) < _setting('TABLETKA_RESULT_LIMIT', 10))
+            return results
+        finally:
+            # Удаляется только своя блокировка (после таймаута она может принадлежать другому процессу)
+            if acquired and cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    def _autocomplete(self, query):
+        """
+        Запрос автодополнения с ограниченным числом попыток: отклонённый
+        CSRF токен (403/419) обновляется, 429/5xx и сетевые ошибки
+        повторяются с экспоненциальной задержкой.
+        """
+        last_error = None
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt > 1 and last_error and not last_error.startswith('csrf'):
+                time.sleep(self.retry_backoff * 2 ** (attempt - 2))
+
+            token = self._get_csrf_token()
+            self._throttle_request()
+            try:
+                response = self.session.post(
+                    self.autocomplete_url,
+                    data={'query': query, '_csrf': token},
+                    headers={
+                        'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+                        'Origin': self.base_url,
+                        'Referer': f"{self.base_url}/"
+                    },
+                    timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                last_error = f"request error: {str(e)}"
+                continue
 
             if response.status_code == 200:
-                json_data = response.json()
-                if json_data.get('status') == 1:
-                    results = self._parse_results(json_data.get('data', ''))
-                    # Кэшируем на 1 час
-                    cache.set(cache_key, results, timeout=3600)
-                    return results
-                else:
-                    return []
-            elif response.status_code in [403, 419]:
-                self._init_session()  # Обновляем сессию
-                return self.search_drugs(query)  # Повторяем запрос
-            else:
-                raise DrugSearchException(f"API returned {response.status_code}")
+                try:
+                    return response.json()
+                except ValueError:
+                    raise DrugSearchException("Search failed: invalid JSON response")
+            if response.status_code in (403, 419):
+                last_error = f"csrf rejected ({response.status_code})"
+                self._invalidate_csrf(token)
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                last_error = f"API returned {response.status_code}"
+                continue
+            raise DrugSearchException(f"Search failed: API returned {response.status_code}")
 
-        except Exception as e:
-            raise DrugSearchException(f"Search failed: {str(e)}")
+        raise DrugSearchException(f"Search failed after {self.max_attempts} attempts: {last_error}")
 
     def _parse_results(self, html_data):
         """Парсинг HTML результатов"""
@@ -125,4 +385,18 @@ class TabletkaByClient:
                     if drug_name not in results:  # Убираем дубликаты
                         results.append(drug_name)
 
-        return results
\ No newline at end of file
+        return results
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_tabletka_client():
+    """Общий для процесса клиент tabletka.by"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TabletkaByClient()
+    return _client
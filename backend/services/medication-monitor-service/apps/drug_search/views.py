@@ -10,7 +10,6 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .exceptions import DrugSearchException
 from .models import Drug, MedicationIntake
 from .models import FavoriteDrug, MedicationPattern, MedicationPatternItem, MedicationReminder
 from .serializers import DrugSearchSerializer
@@ -27,7 +26,7 @@ from .serializers import (
     CreateMedicationIntakeSerializer,
     MedicationStatsSerializer
 )
-from .services import TabletkaByClient
+from .catalog import drug_catalog
 
 
 class FavoriteDrugListView(ListCreateAPIView):
@@ -340,7 +339,7 @@ def medication_timeline(request):
 
 class DrugSearchAPIView(APIView):
     """
-    API для поиска лекарств по названию
+    API для поиска лекарств по названию (автодополнение по локальному каталогу)
     """
 
     def get(self, request):
@@ -353,13 +352,6 @@ class DrugSearchAPIView(APIView):
 
         query = serializer.validated_data['query']
 
-        try:
-            client = TabletkaByClient()
-            results = client.search_drugs(query)
-            return Response({"query": query, "results": results})
-
-        except DrugSearchException as e:
-            return Response(
-                {"error": "Drug search failed", "message": str(e)},
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
+        # Ответ из локального каталога; tabletka.by только пополняет каталог в фоне
+        results, enriching = drug_catalog.search(query)
+        return Response({"query": query, "results": results, "enriching": enriching})
@@ -0,0 +1,50 @@
+"""Индекс локального каталога лекарств: префиксы и нечёткий поиск"""
+import pytest
+
+from apps.drug_search.catalog import CatalogIndex, normalize_name, trigrams
+
+
+@pytest.fixture
+def index():
+    catalog = CatalogIndex()
+    catalog.add([
+        'Метформин', 'Метформин Лонг', 'Метформин-Тева', 'Метопролол', 'Глюкофаж',
+        'Глюкофаж Лонг', 'Глибенкламид', 'Инсулин гларгин', 'Ёжевика экстракт',
+    ])
+    return catalog
+
+
+def test_normalize_name():
+    assert normalize_name('  Метформин-Тева,  500 мг ') == 'метформин тева 500 мг'
+    assert normalize_name('Ёж') == 'еж'
+
+
+def test_duplicates_are_not_added(index):
+    assert index.add(['МЕТФОРМИН', 'метформин  лонг', 'Диабетон']) == ['Диабетон']
+    assert len(index) == 10
+
+
+def test_prefix_search_ranks_name_prefix_first(index):
+    assert index.prefix_search('метф', 10) == ['Метформин', 'Метформин Лонг', 'Метформин-Тева']
+    assert index.prefix_search('лонг', 10) == ['Глюкофаж Лонг', 'Метформин Лонг']
+    assert index.prefix_search('гл', 2) == ['Глюкофаж', 'Глибенкламид']
+    assert index.prefix_search('ежев', 10) == ['Ёжевика экстракт']
+
+
+def test_prefix_search_without_matches(index):
+    assert index.prefix_search('аспирин', 10) == []
+
+
+def test_fuzzy_search_tolerates_typos(index):
+    assert index.fuzzy_search('метфорин', 3, 0.5)[0] == 'Метформин'
+    assert index.fuzzy_search('глюкафаж', 3, 0.5)[0] == 'Глюкофаж'
+    assert index.fuzzy_search('инсулн', 3, 0.5) == ['Инсулин гларгин']
+
+
+def test_fuzzy_search_threshold(index):
+    assert index.fuzzy_search('аспирин', 10, 0.5) == []
+
+
+def test_trigrams_of_unfinished_word():
+    assert 'ин ' in trigrams('метформин')
+    assert 'ин ' not in trigrams('метформин', prefix=True)
@@ -0,0 +1,220 @@
+"""Планировщик напоминаний: расчёт next_fire_at и выборка наступивших напоминаний"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils import timezone
+
+from apps.drug_search.models import Drug, MedicationIntake, MedicationReminder, User
+from apps.drug_search.rabbitmq_publisher import RabbitMQPublisher
+from apps.drug_search.reminder_service import MedicationReminderService
+
+from .rabbitmq_stub import StubBroker
+
+
+def aware(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class RecordingPublisher(RabbitMQPublisher):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def publish_batch(self, events, timeout=None):
+        self.events.extend(events)
+        return []
+
+
+def make_reminder(**fields):
+    defaults = {
+        'title': 'Метформин', 'amount': Decimal('1'), 'unit': 'pieces', 'frequency': 'daily',
+        'time': time(8, 0), 'start_date': date(2026, 1, 1),
+    }
+    defaults.update(fields)
+    return MedicationReminder(**defaults)
+
+
+def test_daily_next_fire():
+    reminder = make_reminder()
+    assert reminder.compute_next_fire_at(aware(2026, 3, 2, 7, 0)) == aware(2026, 3, 2, 8, 0)
+    assert reminder.compute_next_fire_at(aware(2026, 3, 2, 8, 0)) == aware(2026, 3, 3, 8, 0)
+
+
+def test_weekday_next_fire():
+    # 2026-03-02 - понедельник
+    reminder = make_reminder(frequency='custom', weekdays=['wednesday', 'sunday'])
+    assert reminder.compute_next_fire_at(aware(2026, 3, 2, 9, 0)) == aware(2026, 3, 4, 8, 0)
+    assert reminder.compute_next_fire_at(aware(2026, 3, 4, 9, 0)) == aware(2026, 3, 8, 8, 0)
+
+
+def test_next_fire_respects_start_and_end_dates():
+    reminder = make_reminder(start_date=date(2026, 3, 10), end_date=date(2026, 3, 11))
+    assert reminder.compute_next_fire_at(aware(2026, 3, 2, 9, 0)) == aware(2026, 3, 10, 8, 0)
+    assert reminder.compute_next_fire_at(aware(2026, 3, 11, 9, 0)) is None
+
+
+def test_weekly_without_weekdays_never_fires():
+    assert make_reminder(frequency='weekly', weekdays=[]).compute_next_fire_at(aware(2026, 3, 2, 9, 0)) is None
+
+
+@pytest.fixture
+def drug():
+    return Drug.objects.create(name='Метформин', form='Таблетки')
+
+
+@pytest.fixture
+def users():
+    return [
+        User.objects.create(email=f'user{i}@example.com', first_name='Test', last_name='User')
+        for i in range(20)
+    ]
+
+
+@pytest.fixture
+def service():
+    service = MedicationReminderService()
+    service.publisher = RecordingPublisher()
+    return service
+
+
+def create_due(users, drug, now, **fields):
+    reminders = []
+    for user in users:
+        reminder = make_reminder(user=user, drug=drug, start_date=now.date() - timedelta(days=1), **fields)
+        reminder.save()
+        reminders.append(reminder)
+    MedicationReminder.objects.filter(id__in=[r.id for r in reminders]).update(next_fire_at=now - timedelta(minutes=1))
+    return reminders
+
+
+@pytest.mark.django_db
+def test_save_schedules_next_fire(users, drug):
+    reminder = make_reminder(user=users[0], drug=drug, start_date=timezone.now().date())
+    reminder.save()
+    assert reminder.next_fire_at > timezone.now()
+
+    reminder.is_active = False
+    reminder.save(update_fields=['is_active'])
+    reminder.refresh_from_db()
+    assert reminder.next_fire_at is None
+
+
+@pytest.mark.django_db
+def test_save_keeps_due_reminder_unless_schedule_changes(users, drug):
+    now = timezone.now().replace(microsecond=0)
+    reminder, = create_due(users[:1], drug, now)
+    due_at = now - timedelta(minutes=1)
+
+    reminder = MedicationReminder.objects.get(id=reminder.id)
+    reminder.notes = 'После еды'
+    reminder.save()
+    reminder.refresh_from_db()
+    assert reminder.next_fire_at == due_at
+
+    reminder = MedicationReminder.objects.only('id', 'title', 'next_fire_at').get(id=reminder.id)
+    reminder.title = 'Метформин 500'
+    reminder.save(update_fields=['title'])
+    reminder.refresh_from_db()
+    assert reminder.next_fire_at == due_at
+
+    reminder.time = (now + timedelta(hours=1)).time()
+    reminder.save(update_fields=['time'])
+    reminder.refresh_from_db()
+    assert reminder.next_fire_at > now
+
+
+@pytest.mark.django_db
+def test_save_reschedules_when_weekdays_change_in_place(users, drug):
+    now = timezone.now().replace(microsecond=0)
+    reminder, = create_due(users[:1], drug, now, frequency='custom', weekdays=['monday'])
+
+    reminder = MedicationReminder.objects.get(id=reminder.id)
+    reminder.weekdays.append('tuesday')
+    reminder.save()
+
+    assert reminder.next_fire_at > now
+
+
+@pytest.mark.django_db
+def test_due_reminders_are_sent_once_and_rescheduled(users, drug, service):
+    now = timezone.now().replace(microsecond=0)
+    reminders = create_due(users[:3], drug, now, time=(now - timedelta(minutes=1)).time())
+    make_reminder(user=users[3], drug=drug, start_date=now.date()).save()  # не наступило
+
+    assert service.check_and_send_reminders(now) == 3
+    assert service.check_and_send_reminders(now) == 0
+    assert [event[0] for event in service.publisher.events] == ['medication.reminder'] * 3
+
+    for reminder in reminders:
+        reminder.refresh_from_db()
+        assert reminder.next_fire_at > now
+
+
+@pytest.mark.django_db
+def test_reminder_skipped_when_already_taken(users, drug, service):
+    now = timezone.now().replace(microsecond=0)
+    create_due(users[:2], drug, now)
+    MedicationIntake.objects.create(user=users[0], drug=drug, taken_at=now - timedelta(minutes=5),
+                                    amount=Decimal('1'), unit='pieces')
+
+    assert service.check_and_send_reminders(now) == 1
+    assert service.publisher.events[0][1]['user_id'] == users[1].id
+
+
+@pytest.mark.django_db
+def test_stale_reminders_are_rescheduled_without_sending(users, drug, service, settings):
+    settings.REMINDER_MAX_DELAY = 30
+    now = timezone.now()
+    create_due(users[:2], drug, now)
+
+    assert service.check_and_send_reminders(now) == 0
+    assert not MedicationReminder.objects.filter(next_fire_at__lte=now).exists()
+
+
+@pytest.mark.django_db
+def test_tick_queries_do_not_grow_with_due_reminders(users, drug, service, django_assert_max_num_queries):
+    now = timezone.now()
+    create_due(users, drug, now)
+
+    with django_assert_max_num_queries(6):
+        assert service.check_and_send_reminders(now) == 20
+
+
+@pytest.mark.django_db
+def test_tick_publishes_batch_over_one_connection(users, drug):
+    broker = StubBroker()
+    service = MedicationReminderService()
+    service.publisher = RabbitMQPublisher(url='amqp://localhost/', connection_factory=broker.connection_factory)
+    now = timezone.now()
+    create_due(users, drug, now)
+
+    try:
+        assert service.check_and_send_reminders(now) == 20
+    finally:
+        service.publisher.close()
+    assert len(broker.connections) == 1
+    assert [routing_key for _, routing_key, _, _ in broker.messages] == ['medication.reminder'] * 20
+
+
+@pytest.mark.django_db
+def test_unconfirmed_reminders_stay_due(users, drug):
+    broker = StubBroker()
+    broker.nack_routing_keys = {'medication.reminder'}
+    broker.nack_once = False
+    service = MedicationReminderService()
+    service.publisher = RabbitMQPublisher(url='amqp://localhost/', connection_factory=broker.connection_factory)
+    now = timezone.now()
+    reminders = create_due(users[:3], drug, now)
+
+    try:
+        assert service.check_and_send_reminders(now) == 0
+        for reminder in reminders:
+            reminder.refresh_from_db()
+            assert reminder.next_fire_at <= now
+
+        broker.nack_routing_keys = set()
+        assert service.check_and_send_reminders(now) == 3
+    finally:
+        service.publisher.close()
+    assert not MedicationReminder.objects.filter(next_fire_at__lte=now).exists()
@@ -0,0 +1,249 @@
+"""Клиент tabletka.by против локального stub HTTP-сервера"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+from django.core.cache import cache
+
+from apps.drug_search.exceptions import DrugSearchException
+from apps.drug_search.services import LOCK_KEY, TabletkaByClient
+
+HOMEPAGE = (
+    '<html><head><meta name="csrf-token" content="{token}"></head>'
+    '<body>' + 'x' * 50000 + '</body></html>'
+)
+CATALOG = ['Метформин&nbsp;табл.', 'Метформин+Глибенкламид', 'Метформин Лонг', 'Глюкофаж', 'Глюкофаж Лонг']
+
+
+class QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # клиент закрывает соединение, дочитав главную страницу до токена
+
+
+class StubTabletka:
+    """Минимальная имитация tabletka.by: главная страница с токеном и автодополнение"""
+
+    def __init__(self):
+        self.homepage_requests = 0
+        self.autocomplete_requests = 0
+        self.token_version = 0
+        self.fail_statuses = []  # статусы, которые автодополнение вернёт до успешного ответа
+        self.delay = 0.0
+        self.queries = []
+        self.server = QuietServer(('127.0.0.1', 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def token(self):
+        return f"token-{self.token_version}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type, headers=None):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                stub.homepage_requests += 1
+                self._send(200, HOMEPAGE.format(token=stub.token), 'text/html',
+                           {'Set-Cookie': f"_csrf=cookie-{stub.token_version}; Path=/"})
+
+            def do_POST(self):
+                stub.autocomplete_requests += 1
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                stub.queries.append(form['query'][0])
+                time.sleep(stub.delay)
+                if stub.fail_statuses:
+                    self._send(stub.fail_statuses.pop(0), '{}', 'application/json')
+                    return
+                cookie_ok = f"_csrf=cookie-{stub.token_version}" in (self.headers.get('Cookie') or '')
+                if form.get('_csrf') != [stub.token] or not cookie_ok:
+                    self._send(419, '{}', 'application/json')
+                    return
+                query = form['query'][0].lower()
+                items = ''.join(
+                    f'<li class="select-check-item">{name}</li>' for name in CATALOG if query in name.lower()
+                )
+                self._send(200, json.dumps({'status': 1, 'data': f'<ul>{items}</ul>'}), 'application/json')
+
+        return Handler
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    cache.clear()
+    server = StubTabletka()
+    server.start()
+    yield server
+    server.stop()
+    cache.clear()
+
+
+def make_client(stub, **kwargs):
+    options = {'csrf_ttl': 600, 'refresh_ahead': 60, 'min_delay': 0, 'retry_backoff': 0}
+    options.update(kwargs)
+    return TabletkaByClient(base_url=stub.url, **options)
+
+
+def test_cache_miss_costs_one_upstream_request(stub):
+    client = make_client(stub)
+
+    assert client.search_drugs('метформин') == ['Метформин табл.', 'Метформин', 'Метформин Лонг']
+    assert (stub.homepage_requests, stub.autocomplete_requests) == (1, 1)
+
+    client.search_drugs('глюкофаж')
+    assert (stub.homepage_requests, stub.autocomplete_requests) == (1, 2)
+
+    client.search_drugs('метформин')  # результат из кэша
+    assert (stub.homepage_requests, stub.autocomplete_requests) == (1, 2)
+
+
+def test_token_shared_between_clients_through_cache(stub):
+    make_client(stub).search_drugs('метформин')
+    make_client(stub).search_drugs('глюкофаж')
+    assert (stub.homepage_requests, stub.autocomplete_requests) == (1, 2)
+
+
+def test_rejected_token_is_refreshed_once(stub):
+    client = make_client(stub)
+    client.search_drugs('метформин')
+
+    stub.token_version += 1  # сервер сменил сессию
+    assert client.search_drugs('глюкофаж')
+    assert (stub.homepage_requests, stub.autocomplete_requests) == (2, 3)
+
+
+def test_retries_are_bounded(stub):
+    client = make_client(stub, max_attempts=3)
+    stub.fail_statuses = [403] * 10
+
+    with pytest.raises(DrugSearchException):
+        client.search_drugs('метформин')
+    assert stub.autocomplete_requests == 3
+
+
+def test_server_errors_are_retried(stub):
+    client = make_client(stub)
+    stub.fail_statuses = [502, 503]
+
+    assert client.search_drugs('метформин')
+    assert (stub.homepage_requests, stub.autocomplete_requests) == (1, 3)
+
+
+def test_token_refreshed_in_background_before_expiry(stub):
+    client = make_client(stub)
+    client.search_drugs('метформин')
+    assert stub.homepage_requests == 1
+
+    client.refresh_ahead = client.csrf_ttl
+    # Токен в зоне упреждающего обновления: запрос не ждёт загрузки страницы
+    client.search_drugs('глюкофаж')
+    deadline = time.time() + 5
+    while stub.homepage_requests < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert stub.homepage_requests == 2
+    assert stub.autocomplete_requests == 2
+
+
+def test_empty_results_are_cached(stub):
+    client = make_client(stub)
+    assert client.search_drugs('аспирин') == []
+    assert client.search_drugs('Аспирин ') == []
+    assert stub.autocomplete_requests == 1
+
+
+def test_longer_query_derived_from_complete_prefix(stub):
+    client = make_client(stub)
+    assert client.search_drugs('мет') == ['Метформин табл.', 'Метформин', 'Метформин Лонг']
+
+    assert client.search_drugs('метф') == ['Метформин табл.', 'Метформин', 'Метформин Лонг']
+    assert client.search_drugs('метформин лонг') == ['Метформин Лонг']
+    assert client.search_drugs('метан') == []
+    assert stub.queries == ['мет']
+
+
+def test_truncated_prefix_result_is_not_filtered(stub, settings):
+    settings.TABLETKA_RESULT_LIMIT = 3
+    client = make_client(stub)
+    client.search_drugs('мет')
+
+    assert client.search_drugs('метф') == ['Метформин табл.', 'Метформин', 'Метформин Лонг']
+    assert stub.queries == ['мет', 'метф']
+
+
+def test_concurrent_identical_queries_share_one_request(stub):
+    client = make_client(stub)
+    stub.delay = 0.3
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(client.search_drugs, ['глюкофаж'] * 8))
+
+    assert results == [['Глюкофаж', 'Глюкофаж Лонг']] * 8
+    assert stub.autocomplete_requests == 1
+
+
+def test_concurrent_callers_receive_leader_error(stub):
+    client = make_client(stub, max_attempts=2)
+    stub.delay = 0.1
+    stub.fail_statuses = [403] * 10
+
+    def search(query):
+        try:
+            return client.search_drugs(query)
+        except DrugSearchException as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(search, ['метформин'] * 4))
+
+    assert all(isinstance(result, DrugSearchException) for result in results)
+    assert stub.autocomplete_requests == 2
+
+
+def test_waiter_stops_when_lock_owner_gives_up(stub, settings):
+    settings.DRUG_SEARCH_COALESCE_WAIT = 10
+    client = make_client(stub)
+    lock_key = LOCK_KEY.format(hashlib.md5('глюкофаж'.encode()).hexdigest())
+    cache.set(lock_key, 'other-process', timeout=10)
+    threading.Timer(0.2, cache.delete, args=[lock_key]).start()
+
+    started = time.monotonic()
+    assert client.search_drugs('глюкофаж') == ['Глюкофаж', 'Глюкофаж Лонг']
+    assert time.monotonic() - started < 2
+
+
+def test_foreign_lock_survives_timed_out_wait(stub, settings):
+    settings.DRUG_SEARCH_COALESCE_WAIT = 0.2
+    client = make_client(stub)
+    lock_key = LOCK_KEY.format(hashlib.md5('глюкофаж'.encode()).hexdigest())
+    cache.set(lock_key, 'other-process', timeout=10)
+
+    assert client.search_drugs('глюкофаж') == ['Глюкофаж', 'Глюкофаж Лонг']
+    assert cache.get(lock_key) == 'other-process'
@@ -1,59 +1,317 @@
+"""
+Публикация событий в RabbitMQ через постоянное соединение с подтверждениями.
+
+Каждый процесс держит одно соединение (pika.SelectConnection) и один канал
+в режиме publisher confirms. Ввод-вывод выполняет фоновый поток: он же
+обслуживает heartbeat, поэтому соединение не разрывается между публикациями.
+
+publish_many передаёт пачку сообщений в поток соединения, публикует их
+подряд без ожидания и затем ждёт подтверждений брокера на всю пачку
+(брокер подтверждает сразу несколько сообщений флагом multiple).
+Сообщения, которые брокер отклонил (nack) или не подтвердил из-за обрыва
+соединения, публикуются повторно после переподключения - доставка
+"хотя бы один раз". publish_batch возвращает номера событий, которые так и
+не были подтверждены (в том числе за RABBITMQ_CONFIRM_TIMEOUT), чтобы
+вызывающий код повторил их позже. После неудачного подключения новые попытки
+выполняются не чаще раза в RABBITMQ_RECONNECT_DELAY секунд, чтобы
+недоступный брокер не задерживал вызывающий код.
+
+connection_factory позволяет подменить pika.SelectConnection
+(например, брокером в памяти в тестах).
+"""
 import json
 import logging
+import os
+import threading
+import time
+from functools import partial
+
 import pika
 from django.conf import settings
+from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
 
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class _Batch:
+    """Пачка сообщений, ожидающая подтверждений брокера"""
+
+    def __init__(self, messages):
+        self.messages = messages  # [(routing_key, body)]
+        self.results = [None] * len(messages)  # True - ack, False - nack или потеряно
+        self.remaining = len(messages)
+        self.done = threading.Event()
+
+    def confirm(self, index, acked):
+        if self.results[index] is None:
+            self.results[index] = acked
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+    def abort(self):
+        """Неподтверждённые сообщения считаются потерянными"""
+        for index, result in enumerate(self.results):
+            if result is None:
+                self.results[index] = False
+        self.remaining = 0
+        self.done.set()
+
+
 class RabbitMQPublisher:
-    def __init__(self):
-        self.connection = None
-        self.channel = None
-        self.exchange_name = 'glucose_monitoring_events'
+    def __init__(self, url=None, exchange_name='glucose_monitoring_events', connection_factory=None):
+        self.url = url
+        self.exchange_name = exchange_name
+        self.connection_factory = connection_factory or pika.SelectConnection
+        self._lock = threading.Lock()
+        self._batches_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._connection = None
+        self._channel = None
+        self._thread = None
+        self._opened = threading.Event()
+        self._ready = threading.Event()
+        self._closing = False
+        self._failed_at = None
+        self._delivery_tag = 0
+        self._pending = {}  # delivery_tag -> (пачка, номер сообщения); только поток соединения
+        self._batches = set()
+
+    @property
+    def is_connected(self):
+        return self._ready.is_set()
 
-    def connect(self):
+    def connect(self, timeout=None):
+        """Запуск соединения (если оно не открыто) и ожидание готовности канала"""
+        if timeout is None:
+            timeout = _setting('RABBITMQ_CONNECT_TIMEOUT', 5)
+        with self._lock:
+            if self._pid != os.getpid():
+                # После fork соединение и поток родителя недоступны
+                self._reset()
+            if self._ready.is_set():
+                return True
+            if self._thread is not None and self._thread.is_alive() and self._opened.is_set():
+                # Соединение закрывается - дожидаемся остановки его потока
+                self._thread.join(timeout)
+            if self._thread is None or not self._thread.is_alive():
+                if self._failed_at is not None and \
+                        time.monotonic() - self._failed_at < _setting('RABBITMQ_RECONNECT_DELAY', 5):
+                    return False
+                self._opened = threading.Event()
+                self._closing = False
+                self._thread = threading.Thread(target=self._run, name='rabbitmq-publisher', daemon=True)
+                self._thread.start()
+            opened = self._opened
+        opened.wait(timeout)
+        return self._ready.is_set()
+
+    def publish_event(self, routing_key, message_data):
+        return self.publish_many([(routing_key, message_data)]) == 1
+
+    def publish_many(self, events, timeout=None):
+        """
+        Публикация пачки событий [(routing_key, message_data)] с ожиданием
+        подтверждений брокера.
+
+        Returns:
+            int: количество сообщений, подтверждённых брокером
+        """
+        events = list(events)
+        return len(events) - len(self.publish_batch(events, timeout))
+
+    def publish_batch(self, events, timeout=None):
+        """
+        Публикация пачки событий с ожиданием подтверждений брокера.
+
+        Returns:
+            list: номера событий, не подтверждённых брокером (отклонены, потеряны
+            при обрыве соединения или не подтверждены за timeout) - вызывающий
+            код должен повторить их позже
+        """
+        messages = [(routing_key, json.dumps(message_data, default=str)) for routing_key, message_data in events]
+        if not messages:
+            return []
+        if timeout is None:
+            timeout = _setting('RABBITMQ_CONFIRM_TIMEOUT', 10)
+
+        unconfirmed = []  # не подтверждены за timeout - повторная публикация дала бы дубликат сразу
+        todo = list(range(len(messages)))
+        for attempt in range(2):
+            if not self.connect():
+                logger.warning("RabbitMQ not available, skipping event publication")
+                break
+
+            batch = _Batch([messages[index] for index in todo])
+            if not self._submit(batch):
+                continue
+            try:
+                if not batch.done.wait(timeout):
+                    logger.warning(f"RabbitMQ confirms timed out for {batch.remaining} of {len(todo)} events")
+            finally:
+                with self._batches_lock:
+                    self._batches.discard(batch)
+
+            results = list(batch.results)
+            unconfirmed.extend(index for index, result in zip(todo, results) if result is None)
+            todo = [index for index, result in zip(todo, results) if result is False]
+            if not todo:
+                break
+            logger.warning(f"RabbitMQ did not confirm {len(todo)} events (attempt {attempt + 1})")
+
+        failed = sorted(unconfirmed + todo)
+        if failed:
+            logger.error(f"Failed to publish {len(failed)} of {len(messages)} events")
+        else:
+            logger.info(f"Published {len(messages)} events")
+        return failed
+
+    def close(self, timeout=5):
+        """Закрытие соединения и остановка потока"""
+        with self._lock:
+            connection, thread = self._connection, self._thread
+        if connection is None or thread is None:
+            return
         try:
-            connection_params = pika.URLParameters(settings.RABBITMQ_URL)
-            self.connection = pika.BlockingConnection(connection_params)
-            self.channel = self.connection.channel()
-            
-            self.channel.exchange_declare(
-                exchange=self.exchange_name,
-                exchange_type='topic',
-                durable=True
-            )
-            
-            return True
+            connection.ioloop.add_callback_threadsafe(self._close_connection)
+        except Exception:
+            pass
+        thread.join(timeout)
+
+    def _submit(self, batch):
+        with self._batches_lock:
+            if not self._ready.is_set():
+                return False
+            self._batches.add(batch)
+        try:
+            self._connection.ioloop.add_callback_threadsafe(partial(self._publish_batch, batch))
         except Exception as e:
-            logger.error(f"Failed to connect to RabbitMQ: {e}")
-            return False
+            logger.warning(f"RabbitMQ publish scheduling failed: {e}")
+            batch.abort()
+        return True
 
-    def publish_event(self, routing_key, message_data):
-        if not self.connect():
-            return False
-        
+    def _abort_batches(self):
+        with self._batches_lock:
+            self._ready.clear()
+            batches, self._batches = self._batches, set()
+        for batch in batches:
+            batch.abort()
+        self._pending = {}
+
+    # Поток соединения: все методы ниже выполняются в нём
+
+    def _run(self):
         try:
-            message = json.dumps(message_data)
-            self.channel.basic_publish(
-                exchange=self.exchange_name,
-                routing_key=routing_key,
-                body=message,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,
-                    timestamp=int(timezone.now().timestamp()) if hasattr(timezone, 'now') else None
-                )
+            connection = self.connection_factory(
+                parameters=pika.URLParameters(self.url or settings.RABBITMQ_URL),
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_open_error,
+                on_close_callback=self._on_connection_closed,
             )
-            
-            logger.info(f"Published event: {routing_key}")
-            return True
-            
+            self._connection = connection
+            connection.ioloop.start()
         except Exception as e:
-            logger.error(f"Failed to publish event: {e}")
-            return False
+            logger.error(f"Failed to connect to RabbitMQ: {e}")
+            self._failed_at = time.monotonic()
         finally:
-            if self.connection and not self.connection.is_closed:
-                self.connection.close()
+            self._abort_batches()
+            self._opened.set()
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        logger.error(f"Failed to connect to RabbitMQ: {error}")
+        self._failed_at = time.monotonic()
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        if self._closing:
+            logger.info("RabbitMQ connection closed")
+        else:
+            logger.warning(f"RabbitMQ connection lost: {reason}")
+        self._abort_batches()
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.exchange_declare(
+            exchange=self.exchange_name,
+            exchange_type='topic',
+            durable=True,
+            callback=self._on_exchange_declared
+        )
+
+    def _on_exchange_declared(self, frame):
+        self._channel.confirm_delivery(ack_nack_callback=self._on_delivery_confirmation,
+                                       callback=self._on_confirm_selected)
+
+    def _on_confirm_selected(self, frame):
+        self._delivery_tag = 0
+        self._pending = {}
+        self._failed_at = None
+        self._ready.set()
+        self._opened.set()
+
+    def _on_channel_closed(self, channel, reason):
+        logger.warning(f"RabbitMQ channel closed: {reason}")
+        self._abort_batches()
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def _close_connection(self):
+        self._closing = True
+        self._abort_batches()
+        if self._connection.is_open:
+            self._connection.close()
+        else:
+            self._connection.ioloop.stop()
+
+    def _publish_batch(self, batch):
+        channel = self._channel
+        for index, (routing_key, body) in enumerate(batch.messages):
+            if batch.done.is_set():
+                return
+            try:
+                channel.basic_publish(
+                    exchange=self.exchange_name,
+                    routing_key=routing_key,
+                    body=body,
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,
+                        content_type='application/json',
+                        timestamp=int(timezone.now().timestamp())
+                    )
+                )
+            except Exception as e:
+                logger.warning(f"RabbitMQ publish failed: {e}")
+                batch.abort()
+                return
+            self._delivery_tag += 1
+            self._pending[self._delivery_tag] = (batch, index)
+
+    def _on_delivery_confirmation(self, frame):
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self._pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        for tag in tags:
+            entry = self._pending.pop(tag, None)
+            if entry is not None:
+                batch, index = entry
+                batch.confirm(index, acked)
+
+    # События сервиса
 
     def publish_glucose_alert(self, user_id, glucose_value, alert_type, **kwargs):
         routing_key = f"glucose.alert.{alert_type}"
@@ -95,15 +353,16 @@ class RabbitMQPublisher:
         routing_key = f"system.{event_type}"
         
         if user_ids:
-            for user_id in user_ids:
-                message_data = {
+            return self.publish_many([
+                (routing_key, {
                     'user_id': user_id,
                     'data': {
                         'message': message,
                         **kwargs
                     }
-                }
-                self.publish_event(routing_key, message_data)
+                })
+                for user_id in user_ids
+            ])
         else:
             message_data = {
                 'data': {
@@ -111,4 +370,4 @@ class RabbitMQPublisher:
                     **kwargs
                 }
             }
-            self.publish_event(routing_key, message_data)
+            return self.publish_event(routing_key, message_data)
@@ -0,0 +1,24 @@
+"""
+Настройки для тестов: локальный кэш вместо Redis.
+
+TEST_DB=sqlite - локальная SQLite-база вместо PostgreSQL из config.settings.
+"""
+import os
+import tempfile
+
+from config.settings import *  # noqa: F401,F403
+from config.settings import env
+
+if env('TEST_DB', default='postgresql') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tempfile.gettempdir(), 'notification_test.sqlite3'),
+        }
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}